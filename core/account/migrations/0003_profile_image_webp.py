@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_profile_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='image_webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='', verbose_name='profile image (WebP)'),
+        ),
+    ]
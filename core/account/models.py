@@ -71,5 +71,37 @@ class Profile(models.Model):
     last_name = models.CharField(null=True, blank=True, max_length=250, verbose_name='last name')
     birth_date = jmodels.jDateField(null=True, blank=True, verbose_name='birth date')
     image = models.ImageField(upload_to="profile_image", null=True, blank=True, verbose_name='profile image')
+    # WebP copy of the image, written next to the original by the shop reencode_media command
+    image_webp = models.ImageField(blank=True, editable=False, verbose_name='profile image (WebP)')
+    # hash of the original and the encoding settings the WebP copy was built with
+    image_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name='profile image hash')
+
     def __str__(self):
-        return self.user.email
\ No newline at end of file
+        return self.user.email
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the stored image name, so a new upload drops the WebP copy of the old one.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image_name = instance.__dict__.get('image')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Clears the WebP copy and its hash when the image changes; the
+        reencode_media command encodes the new one, the original is served meanwhile.
+        """
+        if (self.image.name or None) != (getattr(self, '_loaded_image_name', None) or None):
+            self.image_webp = ''
+            self.image_hash = ''
+        super().save(*args, **kwargs)
+        self._loaded_image_name = self.image.name
+
+    @property
+    def image_url(self):
+        """
+        URL to show the profile image with: the WebP copy, or the original until it is encoded.
+        """
+        return (self.image_webp or self.image).url if self.image else ''
@@ -1,3 +1,31 @@
 from django.contrib import admin
+from .models import CartLine, StoredCart
+from .store import recompute_totals
 
-# Register your models here.
+
+# ---------------------------------------------
+# Inline admin class for cart lines
+# ---------------------------------------------
+class CartLineInline(admin.TabularInline):
+    model = CartLine
+    extra = 0
+    raw_id_fields = ('product',)
+
+
+# ---------------------------------------------
+# Cart Admin
+# ---------------------------------------------
+@admin.register(StoredCart)
+class StoredCartAdmin(admin.ModelAdmin):
+    """
+    Server-side carts of users and anonymous visitors.
+    """
+    list_display = ('id', 'user', 'item_count', 'subtotal', 'created', 'updated')
+    raw_id_fields = ('user',)
+    readonly_fields = ('item_count', 'subtotal', 'total_weight', 'total_discount')
+    inlines = [CartLineInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # lines edited here bypass the store, so the totals are recomputed
+        recompute_totals(form.instance.pk)
@@ -1,90 +1,179 @@
 # from coupon.models import Coupon
-from shop.models import Product
-from copy import deepcopy
+from bisect import bisect_left
+
+from django.db.models import Prefetch
+from shop.models import Image, Product
+from . import store
+
+# Shipping cost by total weight in grams: (heaviest weight of the tier, cost),
+# lightest first; heavier carts cost SHIPPING_MAX_COST.
+SHIPPING_TIERS = (
+    (0, 0),
+    (999, 100000),
+    (1000, 30000),
+    (30000, 50000),
+    (50000, 75000),
+)
+SHIPPING_MAX_COST = 100000
+
+_SHIPPING_BOUNDS = [weight for weight, _ in SHIPPING_TIERS]
+_SHIPPING_COSTS = [cost for _, cost in SHIPPING_TIERS] + [SHIPPING_MAX_COST]
+
+
+def shipping_cost(weight):
+    return _SHIPPING_COSTS[bisect_left(_SHIPPING_BOUNDS, weight)]
+
+
+def get_cart(request):
+    """
+    Returns the request's cart, created once per request, so views, templates
+    and the context processor share its hydrated products and totals.
+    """
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
+
 
 class Cart:
+    """
+    The visitor's cart, stored server side by cart.store and read through
+    the cache. `cart` holds the lines as {product id: line dict} and `totals`
+    the running totals kept by the store, so prices and counts never sum the lines.
+    """
+
     def __init__(self, request):
+        self.request = request
         self.session = request.session
-        cart = self.session.get('cart')
-
-        if not cart:
-            cart = self.session['cart'] = {}
-        self.cart = cart
         self.coupon_id = self.session.get('coupon_id')
+        if store.LEGACY_SESSION_KEY in self.session:
+            store.import_session_cart(request)
+        self._state = None
+        self._cart_id = None
+        self._items = None
+
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = store.load_state(self.request)
+        return self._state
+
+    @property
+    def cart(self):
+        return self.state['lines']
+
+    @property
+    def totals(self):
+        return self.state['totals']
+
+    @property
+    def version(self):
+        """
+        Changes whenever the cart changes (used in ETags).
+        """
+        return self.state['version']
+
+    def cart_id(self):
+        if self._cart_id is None:
+            self._cart_id = self.state['id'] or store.get_or_create_cart_id(self.request)
+        return self._cart_id
 
     def add(self, product):
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {'quantity': 1,
-                                     'price': int(product.discounted_price),
-                                     'weight': product.weight,
-                                     'price_before_discount': int(product.original_price),
-                                     }
-        else:
-            if self.cart[product_id]['quantity'] < product.inventory:
-                self.cart[product_id]['quantity'] += 1
-
-        self.save()
+        self.save({product.id: store.add_line(self.cart_id(), product)})
 
     def decrease(self, product):
-        product_id = str(product.id)
-        if self.cart[product_id]['quantity'] > 1:
-            self.cart[product_id]['quantity'] -= 1
-        self.save()
+        self.save({product.id: store.decrease_line(self.cart_id(), product.id)})
 
     def delete(self, product):
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
-        self.save()
+        if str(product.id) in self.cart:
+            self.save({product.id: store.remove_line(self.cart_id(), product.id)})
+
+    def apply(self, operations):
+        """
+        Applies a batch of (action, product id, quantity) operations at once
+        (see store.apply_operations) and saves the cart once.
+        Returns {product id: line dict or None} for the touched products.
+        """
+        lines = store.apply_operations(self.cart_id(), operations)
+        self.save(lines)
+        return lines
 
     def clear(self):
-        del self.session['cart']
-        self.save()
+        if self.cart:
+            store.clear_lines(self.cart_id())
+            self.save()
+
+    def revalidate(self):
+        """
+        Refreshes the cart's prices and quantities from the catalog (see
+        store.revalidate_lines) and returns the issues found, to be shown
+        before the visitor pays.
+        """
+        if self.state['id'] is None:
+            return []
+        issues, changed = store.revalidate_lines(self.cart_id(), self.totals)
+        if changed:
+            self.save()
+        return issues
 
     def get_post_price(self):
-        total_weight = sum(item['weight'] * item['quantity'] for item in self.cart.values())
-        if total_weight == 0:
-            return 0
-        elif total_weight == 1000:
-            return 30000
-        elif 1000 <= total_weight <= 30000:
-            return 50000
-        elif 30000 <= total_weight <= 50000:
-            return 75000
-        else:
-            return 100000
+        return shipping_cost(self.totals['weight'])
 
     def get_total_price(self):
-        total_price = sum(item['price'] * item['quantity'] for item in self.cart.values())
-        return total_price
+        return self.totals['subtotal']
 
     def get_final_price(self):
-        final_price = self.get_total_price() + self.get_post_price()
-        return final_price
+        return self.get_total_price() + self.get_post_price()
 
     def total_discount(self):
-        td = sum(item["price_before_discount"] - item["price"] for item in self.cart.values())
-        return td
-
+        return self.totals['discount']
 
     def __len__(self):
-        return sum(item['quantity'] for item in self.cart.values())
+        # number of items, from the running totals (the header shows it on every page)
+        return self.totals['quantity']
 
     def __iter__(self):
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        cart_dict = deepcopy(self.cart)
-
-        for product in products:
-            cart_dict[str(product.id)]['product'] = product
-
-        for item in cart_dict.values():
-            item['total'] = item['price'] * item['quantity']
-            yield item
-
-    def save(self):
-        self.session.modified = True
+        return iter(self.items)
+
+    @property
+    def items(self):
+        """
+        The cart lines with their products and line totals, hydrated with one
+        product query (plus one for the primary images) on first use and
+        memoized until the cart changes.
+        """
+        if self._items is None:
+            products = {}
+            if self.cart:
+                products = Product.objects.select_related('category').prefetch_related(
+                    Prefetch('images', queryset=Image.objects.order_by('created', 'id'), to_attr='listing_images'),
+                ).in_bulk([int(product_id) for product_id in self.cart])
+
+            self._items = []
+            for product_id, item in self.cart.items():
+                # lines are copied, so templates never change the session data
+                line = dict(item, total=item['price'] * item['quantity'])
+                if int(product_id) in products:
+                    line['product'] = products[int(product_id)]
+                self._items.append(line)
+        return self._items
+
+    def save(self, lines=None):
+        """
+        Makes the cached cart stale after a change. Changed lines ({product id:
+        line dict, None once removed}) are applied to the loaded state (with
+        the totals read back from the cart row) rather than reloading every line.
+        """
+        store.changed(self.request)
+        self._items = None
+        if lines is None or self._state is None:
+            self._state = None
+            return
+        for product_id, line in lines.items():
+            if line is None:
+                self._state['lines'].pop(str(product_id), None)
+            else:
+                self._state['lines'][str(product_id)] = line
+        self._state.update(store.read_totals(self.cart_id()))
 
 
     # @property
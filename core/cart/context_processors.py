@@ -1,5 +1,8 @@
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
 
-def cart_context(request):
-    return {'cart': Cart(request)}
 
+def cart_context(request):
+    # lazy: pages that never use the cart do not build it, and `cart|length` needs no query
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cart.models import StoredCart
+
+
+class Command(BaseCommand):
+    """
+    Deletes anonymous carts that were not touched for a while. Their session
+    (and with it the token) is gone by then; users' carts are kept.
+    """
+    help = "Delete abandoned anonymous carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Days since the cart was last changed")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = StoredCart.objects.filter(user__isnull=True, updated__lt=before).delete()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} rows deleted"))
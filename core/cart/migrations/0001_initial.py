@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('shop', '0014_alter_relatedproduct_kind_copurchase'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(blank=True, max_length=32, null=True, unique=True, verbose_name='anonymous token')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cart', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'cart',
+                'verbose_name_plural': 'carts',
+            },
+        ),
+        migrations.CreateModel(
+            name='CartLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1, verbose_name='quantity')),
+                ('price', models.PositiveIntegerField(default=0, verbose_name='price')),
+                ('weight', models.PositiveIntegerField(default=0, verbose_name='weight (grams)')),
+                ('price_before_discount', models.PositiveIntegerField(default=0, verbose_name='price before discount')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='added at')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='product')),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='cart.storedcart', verbose_name='cart')),
+            ],
+            options={
+                'verbose_name': 'cart line',
+                'verbose_name_plural': 'cart lines',
+                'ordering': ['created', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='storedcart',
+            index=models.Index(fields=['updated'], name='cart_stored_updated_ea90c0_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cartline',
+            unique_together={('cart', 'product')},
+        ),
+    ]
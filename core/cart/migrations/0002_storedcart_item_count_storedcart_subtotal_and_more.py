@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:53
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Sum
+
+
+def backfill_cart_totals(apps, schema_editor):
+    """
+    Fills the running totals of carts that already have lines.
+    """
+    StoredCart = apps.get_model('cart', 'StoredCart')
+    CartLine = apps.get_model('cart', 'CartLine')
+    unit = ExpressionWrapper(F('quantity'), output_field=BigIntegerField())
+    rows = CartLine.objects.order_by().values('cart_id').annotate(
+        item_count=Sum('quantity'),
+        subtotal=Sum(unit * F('price')),
+        total_weight=Sum(unit * F('weight')),
+        total_discount=Sum(unit * (F('price_before_discount') - F('price'))),
+    )
+    fields = ['item_count', 'subtotal', 'total_weight', 'total_discount']
+    carts = [StoredCart(pk=row['cart_id'], **{field: row[field] for field in fields}) for row in rows]
+    StoredCart.objects.bulk_update(carts, fields, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedcart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='items'),
+        ),
+        migrations.AddField(
+            model_name='storedcart',
+            name='subtotal',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='subtotal'),
+        ),
+        migrations.AddField(
+            model_name='storedcart',
+            name='total_discount',
+            field=models.BigIntegerField(default=0, verbose_name='total discount'),
+        ),
+        migrations.AddField(
+            model_name='storedcart',
+            name='total_weight',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='total weight (grams)'),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
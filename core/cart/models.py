@@ -1,3 +1,52 @@
 from django.db import models
+from account.models import ShopUser
+from shop.models import Product
 
-# Create your models here.
+
+class StoredCart(models.Model):
+    """
+    A visitor's cart, owned by a user or, before login, by an anonymous
+    token kept in the session. Read through the cache by cart.store.
+    """
+    user = models.OneToOneField(ShopUser, on_delete=models.CASCADE, null=True, blank=True, related_name='cart',
+                                verbose_name='user')
+    token = models.CharField(max_length=32, unique=True, null=True, blank=True, verbose_name='anonymous token')
+
+    # running totals over the lines, updated with every line change (see cart.store)
+    item_count = models.PositiveIntegerField(default=0, verbose_name='items')
+    subtotal = models.PositiveBigIntegerField(default=0, verbose_name='subtotal')
+    total_weight = models.PositiveBigIntegerField(default=0, verbose_name='total weight (grams)')
+    total_discount = models.BigIntegerField(default=0, verbose_name='total discount')
+
+    created = models.DateTimeField(auto_now_add=True, verbose_name='created at')
+    updated = models.DateTimeField(auto_now=True, verbose_name='updated at')
+
+    class Meta:
+        verbose_name = "cart"
+        verbose_name_plural = "carts"
+        indexes = [models.Index(fields=['updated'])]
+
+    def __str__(self):
+        return f'cart {self.pk} ({self.user or "anonymous"})'
+
+
+class CartLine(models.Model):
+    """
+    One product in a cart, with the price and weight it was added at.
+    """
+    cart = models.ForeignKey(StoredCart, on_delete=models.CASCADE, related_name='lines', verbose_name='cart')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='product')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='quantity')
+    price = models.PositiveIntegerField(default=0, verbose_name='price')
+    weight = models.PositiveIntegerField(default=0, verbose_name='weight (grams)')
+    price_before_discount = models.PositiveIntegerField(default=0, verbose_name='price before discount')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='added at')
+
+    class Meta:
+        verbose_name = "cart line"
+        verbose_name_plural = "cart lines"
+        ordering = ['created', 'id']
+        unique_together = ('cart', 'product')
+
+    def __str__(self):
+        return f'{self.quantity} × {self.product_id}'
@@ -0,0 +1,40 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from shop.models import Product
+from .models import CartLine
+from .store import merge_anonymous_cart, refresh_carts
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """
+    🔔 Signal: user_logged_in
+
+    Moves what the visitor put in their cart before logging in into the user's own cart.
+    """
+    if request is not None and hasattr(request, 'session'):
+        merge_anonymous_cart(request, user)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_carts_of_product(sender, instance, **kwargs):
+    """
+    🔔 Signal: pre_delete (Product)
+
+    Notes which carts hold the product, before its lines are deleted with it.
+    """
+    instance._cart_ids = list(CartLine.objects.filter(product=instance).values_list('cart_id', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_carts_of_product(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_delete (Product)
+
+    The product's lines are gone: recomputes the totals of the carts that held it.
+    """
+    cart_ids = getattr(instance, '_cart_ids', None)
+    if cart_ids:
+        refresh_carts(cart_ids)
@@ -0,0 +1,483 @@
+"""
+Server-side cart storage.
+
+Carts live in the StoredCart and CartLine tables instead of the session: a
+logged in user's cart is found by user, a visitor's by a random token, which
+is all the session keeps (so the session row is written once, when the cart
+is created, not on every click). Carts follow users across devices, and the
+visitor's cart is merged into the user's cart on login.
+
+Every change locks the single line it touches and, in the same transaction,
+moves the cart's running totals (quantity, subtotal, weight, discount) by the
+difference, so concurrent requests never lose an update and the totals never
+have to be summed over the lines.
+
+Reads go through the cache: a cart's lines and totals are cached per owner
+under a version (see shop.cache) that every change bumps after writing, so
+showing a cart costs two cache gets, and a copy read from the database before
+a change can only ever be stored under the old, unreachable version.
+"""
+import secrets
+from collections import Counter
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from shop.cache import bump_version, get_version
+from shop.models import Product
+from .models import CartLine, StoredCart
+
+# Session key of the anonymous cart token.
+SESSION_KEY = 'cart_token'
+
+# Session key of carts saved by older versions, entirely in the session.
+LEGACY_SESSION_KEY = 'cart'
+
+CART_CACHE_TIMEOUT = 60 * 60 * 24
+
+LINE_FIELDS = ('quantity', 'price', 'weight', 'price_before_discount')
+
+# Actions of apply_operations, and the most operations one batch may hold.
+BATCH_ACTIONS = ('add', 'set', 'remove')
+MAX_BATCH_OPERATIONS = 100
+
+
+def user_cache_key(user_id):
+    return f'cart:user:{user_id}'
+
+
+def token_cache_key(token):
+    return f'cart:token:{token}'
+
+
+def cart_version_key(cache_key):
+    return f'{cache_key}:version'
+
+
+def forget(*cache_keys):
+    """
+    Makes the cached copies of carts stale, after a change has been written.
+    """
+    for cache_key in cache_keys:
+        bump_version(cart_version_key(cache_key))
+
+
+def owner(request):
+    """
+    Returns (lookup, cache key) of the request's cart, or (None, None) for a
+    visitor who never added anything.
+    """
+    if request.user.is_authenticated:
+        return {'user_id': request.user.pk}, user_cache_key(request.user.pk)
+    token = request.session.get(SESSION_KEY)
+    if token:
+        return {'token': token}, token_cache_key(token)
+    return None, None
+
+
+TOTAL_FIELDS = {'quantity': 'item_count', 'subtotal': 'subtotal', 'weight': 'total_weight',
+                'discount': 'total_discount'}
+
+
+def empty_state():
+    return {'id': None, 'version': 0, 'lines': {}, 'totals': dict.fromkeys(TOTAL_FIELDS, 0)}
+
+
+def read_state(lookup):
+    """
+    Loads a cart from the database as {'id', 'version', 'lines', 'totals'};
+    `lines` is {product id (str): {quantity, price, weight, price_before_discount}}
+    and `totals` the cart's running {quantity, subtotal, weight, discount}.
+    """
+    cart = StoredCart.objects.filter(**lookup).first()
+    if cart is None:
+        return empty_state()
+    lines = {
+        str(line['product_id']): {field: line[field] for field in LINE_FIELDS}
+        for line in cart.lines.order_by('created', 'id').values('product_id', *LINE_FIELDS)
+    }
+    totals = {name: getattr(cart, field) for name, field in TOTAL_FIELDS.items()}
+    return {'id': cart.pk, 'version': cart.updated.timestamp(), 'lines': lines, 'totals': totals}
+
+
+def load_state(request):
+    lookup, key = owner(request)
+    if lookup is None:
+        return empty_state()
+    # the version is read before the database: if the cart changes meanwhile,
+    # the copy read here goes under a version nobody reads any more
+    key = f'{key}:{get_version(cart_version_key(key))}'
+    state = cache.get(key)
+    if state is None:
+        state = read_state(lookup)
+        cache.set(key, state, CART_CACHE_TIMEOUT)
+    return state
+
+
+def get_or_create_cart_id(request):
+    """
+    Returns the id of the request's cart, creating the cart (and, for
+    visitors, its session token) when needed.
+    """
+    if request.user.is_authenticated:
+        cart, _ = StoredCart.objects.get_or_create(user=request.user)
+        return cart.pk
+    token = request.session.get(SESSION_KEY)
+    if not token:
+        token = request.session[SESSION_KEY] = secrets.token_hex(16)
+    cart, _ = StoredCart.objects.get_or_create(token=token)
+    return cart.pk
+
+
+def changed(request):
+    """
+    Makes the cached copy of the request's cart stale after a change.
+    """
+    forget(owner(request)[1])
+
+
+# ----- totals -----
+
+def read_totals(cart_id):
+    """
+    Reads a cart's totals and version, to refresh a loaded state after a line update.
+    """
+    cart = StoredCart.objects.only('updated', *TOTAL_FIELDS.values()).get(pk=cart_id)
+    return {
+        'id': cart.pk,
+        'version': cart.updated.timestamp(),
+        'totals': {name: getattr(cart, field) for name, field in TOTAL_FIELDS.items()},
+    }
+
+
+def line_values(line):
+    return {field: getattr(line, field) for field in LINE_FIELDS}
+
+
+def line_totals(line, quantity):
+    """
+    What `quantity` units (negative to take away) of `line` add to each cart total.
+    """
+    return {
+        'item_count': quantity,
+        'subtotal': quantity * line.price,
+        'total_weight': quantity * line.weight,
+        'total_discount': quantity * (line.price_before_discount - line.price),
+    }
+
+
+def move_totals(cart_id, deltas):
+    """
+    Adds {total field: delta} to the cart's running totals and bumps its
+    `updated` time, in one UPDATE.
+    """
+    StoredCart.objects.filter(pk=cart_id).update(
+        **{field: F(field) + deltas.get(field, 0) for field in TOTAL_FIELDS.values()}, updated=timezone.now(),
+    )
+
+
+def add_to_totals(cart_id, line, quantity):
+    move_totals(cart_id, line_totals(line, quantity))
+
+
+def sum_totals(lines):
+    """
+    The totals of `lines`, summed in Python ({total field: value}).
+    """
+    totals = Counter(dict.fromkeys(TOTAL_FIELDS.values(), 0))
+    for line in lines:
+        totals.update(line_totals(line, line.quantity))
+    return totals
+
+
+def recompute_totals(cart_id):
+    """
+    Recomputes a cart's totals from its lines, after changes that move many lines at once.
+    """
+    unit = ExpressionWrapper(F('quantity'), output_field=BigIntegerField())
+    totals = CartLine.objects.filter(cart_id=cart_id).aggregate(
+        item_count=Sum('quantity'),
+        subtotal=Sum(unit * F('price')),
+        total_weight=Sum(unit * F('weight')),
+        total_discount=Sum(unit * (F('price_before_discount') - F('price'))),
+    )
+    StoredCart.objects.filter(pk=cart_id).update(
+        **{field: value or 0 for field, value in totals.items()}, updated=timezone.now(),
+    )
+
+
+# ----- line updates -----
+# Each locks the one line it changes and moves the cart's totals by the
+# difference, so it costs the same few statements however big the cart is.
+# They return the line's values after the change, None once it is gone.
+
+def add_line(cart_id, product):
+    """
+    Adds one unit of `product`, up to its inventory; a new line always gets one unit.
+    """
+    with transaction.atomic():
+        line, created = CartLine.objects.select_for_update().get_or_create(
+            cart_id=cart_id, product=product,
+            defaults={'quantity': 1, 'price': int(product.discounted_price), 'weight': product.weight,
+                      'price_before_discount': int(product.original_price)},
+        )
+        if not created:
+            if line.quantity >= product.inventory:
+                return line_values(line)
+            CartLine.objects.filter(pk=line.pk).update(quantity=F('quantity') + 1)
+            line.quantity += 1
+        add_to_totals(cart_id, line, 1)
+    return line_values(line)
+
+
+def decrease_line(cart_id, product_id):
+    with transaction.atomic():
+        line = CartLine.objects.select_for_update().filter(cart_id=cart_id, product_id=product_id).first()
+        if line is None:
+            return None
+        if line.quantity > 1:
+            CartLine.objects.filter(pk=line.pk).update(quantity=F('quantity') - 1)
+            line.quantity -= 1
+            add_to_totals(cart_id, line, -1)
+    return line_values(line)
+
+
+def remove_line(cart_id, product_id):
+    with transaction.atomic():
+        line = CartLine.objects.select_for_update().filter(cart_id=cart_id, product_id=product_id).first()
+        if line is not None:
+            line.delete()
+            add_to_totals(cart_id, line, -line.quantity)
+    return None
+
+
+def apply_operations(cart_id, operations):
+    """
+    Applies a batch of (action, product id, quantity) operations in one
+    transaction: 'add' adds quantity units, 'set' sets the quantity (0
+    removes the line) and 'remove' removes the line. Operations on the same
+    product are folded first, so the inventory of every touched product is
+    read with one query, growing quantities are capped by it, and the lines
+    are written with at most one insert, one update and one delete before
+    the totals are moved once.
+
+    Returns {product id: line values, None once removed} for the touched
+    products. Raises Product.DoesNotExist if a product does not exist.
+    """
+    product_ids = {product_id for _, product_id, _ in operations}
+    with transaction.atomic():
+        products = Product.objects.only(
+            'inventory', 'weight', 'original_price', 'discounted_price',
+        ).in_bulk(product_ids)
+        if len(products) < len(product_ids):
+            raise Product.DoesNotExist(f'unknown products: {sorted(product_ids - set(products))}')
+        lines = {
+            line.product_id: line
+            for line in CartLine.objects.select_for_update().filter(cart_id=cart_id, product_id__in=product_ids)
+        }
+
+        quantities = {product_id: line.quantity for product_id, line in lines.items()}
+        for action, product_id, quantity in operations:
+            if action == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            elif action == 'set':
+                quantities[product_id] = quantity
+            else:
+                quantities[product_id] = 0
+
+        created, changed_lines, removed, deltas = [], [], [], Counter()
+        for product_id, quantity in quantities.items():
+            line = lines.get(product_id)
+            old = line.quantity if line else 0
+            if quantity > old:
+                quantity = max(old, min(quantity, products[product_id].inventory))
+            if quantity == old:
+                continue
+            if line is None:
+                product = products[product_id]
+                line = lines[product_id] = CartLine(
+                    cart_id=cart_id, product_id=product_id, price=int(product.discounted_price),
+                    weight=product.weight, price_before_discount=int(product.original_price),
+                )
+                created.append(line)
+            elif quantity == 0:
+                removed.append(line.pk)
+            else:
+                changed_lines.append(line)
+            deltas.update(line_totals(line, quantity - old))
+            line.quantity = quantity
+
+        if created:
+            CartLine.objects.bulk_create(created)
+        if changed_lines:
+            CartLine.objects.bulk_update(changed_lines, ['quantity'])
+        if removed:
+            CartLine.objects.filter(pk__in=removed).delete()
+        if created or changed_lines or removed:
+            move_totals(cart_id, deltas)
+
+    return {
+        product_id: line_values(lines[product_id]) if lines.get(product_id) and lines[product_id].quantity else None
+        for product_id in product_ids
+    }
+
+
+# ----- revalidation -----
+
+@dataclass
+class LineIssue:
+    """
+    Something about a cart line that changed since it was added.
+    `kind` is PRICE_CHANGED, QUANTITY_REDUCED or OUT_OF_STOCK; `old` and
+    `new` are the prices or quantities before and after.
+    """
+    product_id: int
+    name: str
+    kind: str
+    old: int
+    new: int
+
+    def __str__(self):
+        if self.kind == PRICE_CHANGED:
+            return f'قیمت «{self.name}» از {self.old} به {self.new} تغییر کرد'
+        if self.kind == QUANTITY_REDUCED:
+            return f'از «{self.name}» فقط {self.new} عدد موجود است'
+        return f'«{self.name}» ناموجود است'
+
+
+PRICE_CHANGED = 'price_changed'
+QUANTITY_REDUCED = 'quantity_reduced'
+OUT_OF_STOCK = 'out_of_stock'
+
+
+def check_lines(lines):
+    """
+    Compares lines (with their products) to the catalog: refreshes the
+    price, price before discount and weight snapshots, caps quantities by
+    inventory, and returns (changed lines, issues). Lines of products out of
+    stock are kept, and flagged every time.
+    """
+    changed_lines, issues = [], []
+    for line in lines:
+        product = line.product
+        price, price_before_discount = int(product.discounted_price or 0), int(product.original_price)
+        changed = (line.price, line.price_before_discount, line.weight) != (price, price_before_discount,
+                                                                            product.weight)
+        if line.price != price:
+            issues.append(LineIssue(product.pk, product.name, PRICE_CHANGED, line.price, price))
+        if product.inventory == 0:
+            issues.append(LineIssue(product.pk, product.name, OUT_OF_STOCK, line.quantity, 0))
+        elif line.quantity > product.inventory:
+            issues.append(LineIssue(product.pk, product.name, QUANTITY_REDUCED, line.quantity, product.inventory))
+            line.quantity = product.inventory
+            changed = True
+        if changed:
+            line.price, line.price_before_discount, line.weight = price, price_before_discount, product.weight
+            changed_lines.append(line)
+    return changed_lines, issues
+
+
+def revalidate_lines(cart_id, totals=None):
+    """
+    Checks a cart's lines against current prices and inventory with one
+    query (lines joined to their products). Only when something changed, or
+    the lines do not add up to the cart's `totals` (as loaded, {quantity,
+    subtotal, weight, discount}), are the lines read again, locked, and
+    rewritten with one bulk update, and the totals recomputed from them.
+    Returns (issues, whether the cart was changed).
+    """
+    lines = CartLine.objects.filter(cart_id=cart_id).select_related('product').only(
+        *LINE_FIELDS, 'product__name', 'product__inventory', 'product__weight', 'product__original_price',
+        'product__discounted_price',
+    )
+    current = list(lines)
+    changed_lines, issues = check_lines(current)
+    consistent = totals is None or sum_totals(current) == {
+        field: totals[name] for name, field in TOTAL_FIELDS.items()
+    }
+    if not changed_lines and consistent:
+        return issues, False
+
+    with transaction.atomic():
+        locked = list(lines.select_for_update(of=('self',)))
+        changed_lines, issues = check_lines(locked)
+        if changed_lines:
+            CartLine.objects.bulk_update(changed_lines, LINE_FIELDS)
+        # all the lines are at hand, so the totals are set outright (which also repairs any drift)
+        totals = sum_totals(locked)
+        StoredCart.objects.filter(pk=cart_id).update(
+            **{field: totals[field] for field in TOTAL_FIELDS.values()}, updated=timezone.now(),
+        )
+    return issues, True
+
+
+def clear_lines(cart_id):
+    with transaction.atomic():
+        CartLine.objects.filter(cart_id=cart_id).delete()
+        StoredCart.objects.filter(pk=cart_id).update(
+            **{field: 0 for field in TOTAL_FIELDS.values()}, updated=timezone.now(),
+        )
+
+
+def refresh_carts(cart_ids):
+    """
+    Recomputes the totals of carts whose lines changed outside the store
+    (e.g. a product was deleted) and makes their cached copies stale.
+    """
+    for cart_id in cart_ids:
+        recompute_totals(cart_id)
+    carts = StoredCart.objects.filter(pk__in=cart_ids).values_list('user_id', 'token')
+    forget(*[user_cache_key(user_id) if user_id else token_cache_key(token) for user_id, token in carts])
+
+
+# ----- moving carts -----
+
+def import_session_cart(request):
+    """
+    Moves a cart saved in the session by an older version into the store.
+    Lines of products deleted since are dropped.
+    """
+    lines = request.session.pop(LEGACY_SESSION_KEY, None) or {}
+    lines = {int(product_id): line for product_id, line in lines.items() if str(product_id).isdigit()}
+    existing = set(Product.objects.filter(pk__in=lines).values_list('pk', flat=True)) if lines else set()
+    if not existing:
+        return
+    cart_id = get_or_create_cart_id(request)
+    CartLine.objects.bulk_create([
+        CartLine(cart_id=cart_id, product_id=product_id, **{field: line.get(field, 0) for field in LINE_FIELDS})
+        for product_id, line in lines.items() if product_id in existing
+    ], ignore_conflicts=True)
+    recompute_totals(cart_id)
+    changed(request)
+
+
+def merge_anonymous_cart(request, user):
+    """
+    Merges the visitor's cart into `user`'s cart (quantities of products in
+    both are added up) and forgets the visitor's token.
+    """
+    token = request.session.pop(SESSION_KEY, None)
+    anonymous = StoredCart.objects.filter(token=token).first() if token else None
+    if anonymous is None:
+        return
+
+    with transaction.atomic():
+        cart = StoredCart.objects.select_for_update().filter(user=user).first()
+        if cart is None:
+            # the visitor's cart simply becomes the user's
+            StoredCart.objects.filter(pk=anonymous.pk).update(user=user, token=None, updated=timezone.now())
+        else:
+            existing = {line.product_id: line for line in cart.lines.all()}
+            merged = []
+            for line in anonymous.lines.filter(product_id__in=existing):
+                existing[line.product_id].quantity += line.quantity
+                merged.append(existing[line.product_id])
+            CartLine.objects.bulk_update(merged, ['quantity'])
+            anonymous.lines.exclude(product_id__in=existing).update(cart=cart)
+            anonymous.delete()
+            recompute_totals(cart.pk)
+
+    forget(token_cache_key(token), user_cache_key(user.pk))
@@ -1,3 +1,350 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from account.models import ShopUser
+from order.models import Order
+from shop.models import Category, Product
+from shop.recommendations import similar_in_categories
+from .cart import get_cart, shipping_cost
+from .models import CartLine, StoredCart
+from . import store
+from .store import OUT_OF_STOCK, PRICE_CHANGED, QUANTITY_REDUCED, SESSION_KEY, revalidate_lines
+
+
+class CartHydrationTest(TestCase):
+    """
+    The cart loads its products once per request, and the header count needs no query.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Category', slug='category')
+        self.products = [
+            Product.objects.create(category=category, name=f'Product {i}', slug=f'product-{i}', description='d',
+                                   original_price=1000 * (i + 1), weight=100, inventory=10)
+            for i in range(3)
+        ]
+
+    def make_request(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    def test_products_are_hydrated_once_per_request(self):
+        request = self.make_request()
+        cart = get_cart(request)
+        for product in self.products:
+            cart.add(product)
+        cart.add(self.products[0])
+        self.assertIs(get_cart(request), cart)
+
+        self.assertEqual(len(cart), 4)
+
+        # products + their primary images, however often the cart is read
+        with self.assertNumQueries(2):
+            for _ in range(3):
+                lines = list(cart)
+        self.assertEqual([line['product'] for line in lines], self.products)
+        self.assertEqual(lines[0]['total'], 2000)
+
+        # changing the cart drops the memoized lines
+        cart.delete(self.products[1])
+        self.assertEqual(len(cart), 3)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(list(cart)), 2)
+
+    def test_empty_cart_needs_no_query_or_session(self):
+        response = self.client.get(reverse('shop:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cart']), 0)
+        # the header count never hydrated the cart, and no session was started
+        self.assertIsNone(response.wsgi_request._cart._items)
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_detail_page(self):
+        for product in self.products:
+            self.client.post(reverse('cart:add_cart', args=[product.pk]))
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertContains(response, 'Product 2')
+        self.assertEqual(len(response.context['cart']), 3)
+
+
+class CartStoreTest(TestCase):
+    """
+    Carts are stored server side, read through the cache and merged on login.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category', slug='category')
+        self.phone = Product.objects.create(category=category, name='Phone', slug='phone', description='d',
+                                            original_price=1000, inventory=2)
+        self.case = Product.objects.create(category=category, name='Case', slug='case', description='d',
+                                           original_price=100, inventory=10)
+        self.user = ShopUser.objects.create_user(email='user@example.com', password='pass', phone='09120000000')
+
+    def add(self, product):
+        return self.client.post(reverse('cart:add_cart', args=[product.pk]))
+
+    def test_session_only_keeps_a_token(self):
+        for _ in range(3):
+            self.add(self.phone)
+        session = self.client.session
+        self.assertEqual(set(session.keys()), {SESSION_KEY})
+        # quantity is capped by inventory
+        self.assertEqual(CartLine.objects.get(product=self.phone).quantity, 2)
+
+        # the next request reads the cart from the cache
+        response = self.client.get(reverse('shop:index'))
+        with self.assertNumQueries(0):
+            self.assertEqual(len(response.context['cart']), 2)
+
+    def test_copy_read_before_a_change_is_never_cached(self):
+        self.add(self.phone)
+        request = RequestFactory().get('/')
+        request.user, request.session = AnonymousUser(), self.client.session
+        read_state = store.read_state
+
+        def read_then_change(lookup):
+            # another request changes the cart after this one read it
+            state = read_state(lookup)
+            store.add_line(state['id'], self.case)
+            store.changed(request)
+            return state
+
+        with mock.patch.object(store, 'read_state', read_then_change):
+            self.assertEqual(len(store.load_state(request)['lines']), 1)
+        self.assertEqual(len(store.load_state(request)['lines']), 2)
+
+    def test_login_merges_the_anonymous_cart(self):
+        user_cart = StoredCart.objects.create(user=self.user)
+        CartLine.objects.create(cart=user_cart, product=self.phone, quantity=1, price=1000)
+        self.add(self.phone)
+        self.add(self.case)
+
+        self.client.force_login(self.user)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertEqual(StoredCart.objects.count(), 1)
+        self.assertEqual(dict(user_cart.lines.values_list('product__slug', 'quantity')), {'phone': 2, 'case': 1})
+        response = self.client.get(reverse('shop:index'))
+        self.assertEqual(len(response.context['cart']), 3)
+
+    def test_legacy_session_cart_is_imported(self):
+        session = self.client.session
+        session['cart'] = {str(self.case.pk): {'quantity': 3, 'price': 100, 'weight': 0,
+                                               'price_before_discount': 100},
+                           # a product deleted since
+                           '999999': {'quantity': 1, 'price': 10, 'weight': 0, 'price_before_discount': 10}}
+        session.save()
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertEqual(len(response.context['cart']), 3)
+        self.assertNotIn('cart', self.client.session)
+        self.assertEqual(CartLine.objects.get().quantity, 3)
+
+
+class CartTotalsTest(TestCase):
+    """
+    Totals are kept with the cart, so cart endpoints do the same work for any cart size.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category', slug='category')
+        self.products = [
+            Product.objects.create(category=category, name=f'Product {i}', slug=f'product-{i}', description='d',
+                                   original_price=1000, discount=10, weight=400, inventory=5)
+            for i in range(6)
+        ]
+
+    def update_quantity(self, product, action='add'):
+        return self.client.post(reverse('cart:update_quantity'), {'product_id': product.pk, 'action': action})
+
+    def test_shipping_tiers(self):
+        for weight, cost in [(0, 0), (1, 100000), (999, 100000), (1000, 30000), (1001, 50000), (30000, 50000),
+                             (30001, 75000), (50000, 75000), (50001, 100000)]:
+            self.assertEqual(shipping_cost(weight), cost, weight)
+
+    def test_totals_follow_every_change(self):
+        first, second = self.products[:2]
+        self.client.post(reverse('cart:add_cart', args=[first.pk]))
+        self.update_quantity(first)
+        self.update_quantity(second)
+        response = self.update_quantity(first, 'decrease')
+        data = response.json()
+        self.assertEqual((data['item_count'], data['quantity'], data['product_cost']), (2, 1, 900))
+        self.assertEqual((data['get_total_price'], data['get_post_price'], data['get_final_price']),
+                         (1800, 100000, 101800))
+
+        cart = StoredCart.objects.get()
+        self.assertEqual((cart.item_count, cart.subtotal, cart.total_weight, cart.total_discount),
+                         (2, 1800, 800, 200))
+
+        data = self.client.post(reverse('cart:delete_product'), {'product_id': second.pk}).json()
+        self.assertEqual((data['item_count'], data['get_total_price']), (1, 900))
+
+    def test_update_quantity_does_not_depend_on_cart_size(self):
+        def queries():
+            with CaptureQueriesContext(connection) as context:
+                self.update_quantity(self.products[0])
+            return len(context)
+
+        for product in self.products[:2]:
+            self.update_quantity(product)
+        small = queries()
+        for product in self.products[2:]:
+            self.update_quantity(product)
+        self.assertEqual(queries(), small)
+
+
+class CartBatchTest(TestCase):
+    """
+    A batch of cart operations is validated with one product query and applied at once.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category', slug='category')
+        self.phone = Product.objects.create(category=category, name='Phone', slug='phone', description='d',
+                                            original_price=1000, weight=500, inventory=3)
+        self.case = Product.objects.create(category=category, name='Case', slug='case', description='d',
+                                           original_price=100, weight=100, inventory=10)
+        self.cable = Product.objects.create(category=category, name='Cable', slug='cable', description='d',
+                                            original_price=50, inventory=10)
+
+    def batch(self, *operations):
+        return self.client.post(reverse('cart:batch_update'), {'operations': list(operations)},
+                                content_type='application/json')
+
+    def test_operations_are_applied_together(self):
+        self.client.post(reverse('cart:add_cart', args=[self.cable.pk]))
+        response = self.batch(
+            {'action': 'add', 'product_id': self.phone.pk},
+            {'action': 'add', 'product_id': self.phone.pk, 'quantity': 5},
+            {'action': 'set', 'product_id': self.case.pk, 'quantity': 2},
+            {'action': 'remove', 'product_id': self.cable.pk},
+        )
+        data = response.json()
+        # the phone is capped by its inventory
+        self.assertEqual(data['lines'], {
+            str(self.phone.pk): {'quantity': 3, 'product_cost': 3000},
+            str(self.case.pk): {'quantity': 2, 'product_cost': 200},
+            str(self.cable.pk): {'quantity': 0, 'product_cost': 0},
+        })
+        self.assertEqual((data['item_count'], data['get_total_price'], data['get_post_price']), (5, 3200, 50000))
+        cart = StoredCart.objects.get()
+        self.assertEqual((cart.item_count, cart.subtotal, cart.total_weight), (5, 3200, 1700))
+        self.assertEqual(dict(cart.lines.values_list('product__slug', 'quantity')), {'phone': 3, 'case': 2})
+
+        # the next page shows the same cart
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertEqual(len(response.context['cart']), 5)
+
+    def test_invalid_batches_change_nothing(self):
+        self.assertEqual(self.batch({'action': 'explode', 'product_id': self.phone.pk}).status_code, 400)
+        self.assertEqual(self.batch({'action': 'set', 'product_id': self.phone.pk}).status_code, 400)
+        response = self.batch(
+            {'action': 'add', 'product_id': self.phone.pk},
+            {'action': 'add', 'product_id': 0},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartLine.objects.exists())
+
+
+class CartSimilarProductsTest(TestCase):
+    """
+    Similar products of a whole cart come from one windowed query, cached per cart.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.products = {}
+        for category_name in ('phones', 'cases', 'cables'):
+            category = Category.objects.create(name=category_name, slug=category_name)
+            for i in range(6):
+                slug = f'{category_name}-{i}'
+                self.products[slug] = Product.objects.create(category=category, name=slug, slug=slug,
+                                                              description='d', original_price=100)
+
+    def test_top_products_per_category_without_the_cart(self):
+        cart = [self.products['phones-0'], self.products['phones-2'], self.products['cases-5']]
+        with self.assertNumQueries(1):
+            similar = similar_in_categories([product.pk for product in cart])
+        self.assertEqual([product.slug for product in similar],
+                         ['phones-1', 'phones-3', 'phones-4', 'phones-5', 'cases-0', 'cases-1', 'cases-2', 'cases-3'])
+
+        with self.assertNumQueries(0):
+            similar_in_categories([product.pk for product in reversed(cart)])
+        self.assertEqual(similar_in_categories([]), [])
+
+    def test_detail_page(self):
+        self.client.post(reverse('cart:add_cart', args=[self.products['cables-0'].pk]))
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertContains(response, 'cables-4')
+        self.assertNotContains(response, 'cables-5')
+
+
+class CartRevalidationTest(TestCase):
+    """
+    Cart lines are checked against current prices and stock on the cart page and at checkout.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Category', slug='category')
+        self.phone = Product.objects.create(category=category, name='Phone', slug='phone', description='d',
+                                            original_price=1000, weight=500, inventory=5)
+        self.case = Product.objects.create(category=category, name='Case', slug='case', description='d',
+                                           original_price=100, inventory=5)
+        self.user = ShopUser.objects.create_user(email='user@example.com', password='pass', phone='09120000000')
+        self.client.force_login(self.user)
+        for product in (self.phone, self.phone, self.phone, self.case):
+            self.client.post(reverse('cart:add_cart', args=[product.pk]))
+
+    def test_unchanged_cart_costs_one_query(self):
+        cart_id = StoredCart.objects.get().pk
+        with self.assertNumQueries(1):
+            self.assertEqual(revalidate_lines(cart_id), ([], False))
+
+    def test_cart_page_refreshes_prices_and_quantities(self):
+        Product.objects.filter(pk=self.phone.pk).update(discounted_price=800, inventory=2)
+        response = self.client.get(reverse('cart:detail_cart'))
+        issues = {(issue.product_id, issue.kind, issue.old, issue.new) for issue in response.context['cart_issues']}
+        self.assertEqual(issues, {(self.phone.pk, PRICE_CHANGED, 1000, 800),
+                                  (self.phone.pk, QUANTITY_REDUCED, 3, 2)})
+        self.assertEqual(response.context['cart'].get_total_price(), 1700)
+        self.assertEqual(StoredCart.objects.get().subtotal, 1700)
+
+        # changes are reported once
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertEqual(response.context['cart_issues'], [])
+
+    def test_deleted_product_leaves_the_totals(self):
+        self.client.get(reverse('cart:detail_cart'))
+        self.phone.delete()
+        response = self.client.get(reverse('cart:detail_cart'))
+        cart = response.context['cart']
+        self.assertEqual(list(cart.cart), [str(self.case.pk)])
+        self.assertEqual((len(cart), cart.get_total_price(), cart.get_post_price()), (1, 100, 0))
+
+        # totals that disagree with the lines are repaired by revalidation
+        StoredCart.objects.update(item_count=7, subtotal=7000)
+        cache.clear()
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertEqual(len(response.context['cart']), 1)
+        self.assertEqual(StoredCart.objects.get().subtotal, 100)
+
+    def test_checkout_waits_for_out_of_stock_lines(self):
+        Product.objects.filter(pk=self.case.pk).update(inventory=0)
+        for _ in range(2):
+            response = self.client.post(reverse('order:order_create'), {})
+            self.assertRedirects(response, reverse('cart:detail_cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        response = self.client.get(reverse('cart:detail_cart'))
+        self.assertEqual([issue.kind for issue in response.context['cart_issues']], [OUT_OF_STOCK])
@@ -10,4 +10,5 @@ urlpatterns = [
     path('update-quantity', views.update_quantity, name='update_quantity'),
 
     path('delete-product', views.delete_product, name='delete_product'),
+    path('batch', views.batch_update, name='batch_update'),
 ]
\ No newline at end of file
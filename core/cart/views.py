@@ -1,3 +1,4 @@
+import json
 import traceback
 
 from django.contrib.messages.api import success
@@ -5,27 +6,26 @@ from django.http import JsonResponse
 from django.shortcuts import render
 from django.views.decorators.http import require_POST
 from shop.models import Product
-from .cart import Cart
+from shop.recommendations import bought_together_with, similar_in_categories
+from .cart import get_cart
+from .store import BATCH_ACTIONS, MAX_BATCH_OPERATIONS
 from django.shortcuts import redirect
 from order.models import Order
 
 
 # Create your views here.
 def detail_cart(request):
-    cart = Cart(request)
-    similar_products = []
-    for item in cart:
-        product = item['product']
-        # پیدا کردن محصولات مشابه بر اساس دسته‌بندی
-        similars = Product.objects.filter(
-            category=product.category
-        ).exclude(id=product.id)[:4]
-        similar_products.extend(similars)
-    similar_products = list(set(similar_products))
-    print(similar_products)
+    cart = get_cart(request)
+    # prices and stock may have changed since the products were added
+    cart_issues = cart.revalidate()
+    product_ids = [int(product_id) for product_id in cart.cart]
     context = {
         'cart': cart,
-        'similar_products': similar_products,
+        'cart_issues': cart_issues,
+        # a few products of each cart product's category, with one cached query
+        'similar_products': similar_in_categories(product_ids),
+        # "frequently bought together" with the cart's products, precomputed from paid orders
+        'bought_together': bought_together_with(product_ids),
     }
     return render(request, 'cart/detail_cart.html', context)
 
@@ -33,7 +33,7 @@ def detail_cart(request):
 def add(request, product_id):
     try:
         product = Product.objects.get(id = product_id)
-        cart = Cart(request)
+        cart = get_cart(request)
         cart.add(product)
         context = {
             'item_count': len(cart),
@@ -56,7 +56,7 @@ def update_quantity(request):
     action = request.POST['action']
     try:
         product = Product.objects.get(id=product_id)
-        cart = Cart(request)
+        cart = get_cart(request)
         if action == 'add':
             cart.add(product)
         elif action == 'decrease':
@@ -83,7 +83,7 @@ def delete_product(request):
     try:
         product_id = request.POST['product_id']
         product = Product.objects.get(id=product_id)
-        cart = Cart(request)
+        cart = get_cart(request)
         cart.delete(product)
         context = {
             'success': True,
@@ -96,3 +96,70 @@ def delete_product(request):
     except:
         return JsonResponse({'error': 'Something went wrong'})
 
+
+
+# ---------------------------------------------
+# Batch cart update
+# ---------------------------------------------
+def parse_operations(data):
+    """
+    Returns the (action, product id, quantity) tuples of a batch request, or None if it is invalid.
+    """
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_BATCH_OPERATIONS:
+        return None
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('action') not in BATCH_ACTIONS:
+            return None
+        try:
+            product_id = int(operation['product_id'])
+            quantity = int(operation.get('quantity', 1 if operation['action'] == 'add' else 0))
+        except (KeyError, TypeError, ValueError):
+            return None
+        if quantity < 0 or (operation['action'] == 'set' and 'quantity' not in operation):
+            return None
+        parsed.append((operation['action'], product_id, quantity))
+    return parsed
+
+
+@require_POST
+def batch_update(request):
+    """
+    Applies several cart changes in one request, e.g. a burst of +/- clicks.
+    Expected JSON:
+        {"operations": [{"action": "add", "product_id": 1, "quantity": 2},
+                        {"action": "set", "product_id": 2, "quantity": 5},
+                        {"action": "remove", "product_id": 3}]}
+    Returns the quantity and cost of every touched product and the cart totals.
+    """
+    try:
+        data = json.loads(request.body.decode())
+    except (UnicodeDecodeError, ValueError):
+        return JsonResponse({'error': 'invalid_json'}, status=400)
+    operations = parse_operations(data)
+    if operations is None:
+        return JsonResponse({'error': 'invalid_operations'}, status=400)
+
+    cart = get_cart(request)
+    try:
+        lines = cart.apply(operations)
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'unknown_product'}, status=404)
+
+    context = {
+        'success': True,
+        'lines': {
+            product_id: {
+                'quantity': line['quantity'] if line else 0,
+                'product_cost': line['quantity'] * line['price'] if line else 0,
+            }
+            for product_id, line in lines.items()
+        },
+        'item_count': len(cart),
+        'get_total_price': cart.get_total_price(),
+        'get_post_price': cart.get_post_price(),
+        'get_final_price': cart.get_final_price(),
+        'total_discount': cart.total_discount(),
+    }
+    return JsonResponse(context)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'shop.apps.ShopConfig',
     'django_jalali',
+    'mptt',
     'order.apps.OrderConfig',
     'cart.apps.CartConfig',
     'ticket.apps.TicketConfig',
@@ -67,6 +69,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shop.context_processors.categories',
+                'cart.context_processors.cart_context',
             ],
         },
     },
@@ -85,6 +89,39 @@ DATABASES = {
     }
 }
 
+# PostgreSQL only features (trigram lookups used by shop.search)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default. In production set REDIS_URL (needs the `redis`
+# package) so every process shares cached pages and version numbers,
+# or CACHE_DIR for a file based cache on a single machine.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'online-shop',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,3 +178,16 @@ AUTH_USER_MODEL = 'account.ShopUser'
 # ZarinPall Payment
 MERCHANT = "00000000-0000-0000-0000-000000000000"
 SANDBOX = False
+
+# Product view counter (see shop.counters)
+VIEW_COUNTER_FLUSH_INTERVAL = 30  # seconds, 0 disables the background flush
+VIEW_COUNTER_DAILY_BUCKETS = True
+VIEW_COUNTER_HOURLY_BUCKETS = True
+
+# Product image processing (see shop.images)
+IMAGE_PROCESSING_WORKERS = 2
+IMAGE_WEBP_QUALITY = 75
+IMAGE_WEBP_METHOD = 4
+
+# Anonymous page cache (see shop.cache)
+PAGE_CACHE_TIMEOUT = 300  # seconds, 0 disables it
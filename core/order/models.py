@@ -23,6 +23,8 @@ class Order(models.Model):
     ref_id = models.CharField(max_length=100, default="")
     # coupon = models.ForeignKey(Coupon, on_delete=models.SET_NULL, blank=True, null=True)
     discount = models.IntegerField(default=0)
+    # set once the order is counted in the "bought together" recommendations (see shop.recommendations)
+    co_purchases_counted = models.BooleanField(default=False, editable=False)
 
     class Meta:
         verbose_name = "سفارش"
@@ -38,6 +40,15 @@ class Order(models.Model):
     def __str__(self):
         return f"order {self.id}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers whether the order was paid when loaded, so saving can tell when it becomes paid.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_paid = instance.__dict__.get('paid')
+        return instance
+
 
     def get_total_cost(self):
         total = sum(item.get_cost() for item in self.items.all())
@@ -1,7 +1,8 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from .models import Order, OrderItem
+from .models import Order
 from shop.models import Product
+from shop.leaderboards import record_sales
 from django.db.models.signals import post_save
 
 @receiver(post_save, sender=Order)
@@ -11,3 +12,12 @@ def update_product_sold_count(sender, instance, created, **kwargs):
             product = item.product
             product.sold_count += item.quantity
             product.save()
+
+
+@receiver(post_save, sender=Order)
+def count_sales_for_leaderboards(sender, instance, **kwargs):
+    # units sold per hour, summed by the best-seller leaderboards (see shop.leaderboards);
+    # counted once, when the order becomes paid, so unpaid orders never count
+    if instance.paid and not getattr(instance, '_loaded_paid', False):
+        instance._loaded_paid = True
+        record_sales(instance.items.values_list('product_id', 'quantity'))
@@ -8,7 +8,7 @@ from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from account.models import ShopUser
-from cart.cart import Cart
+from cart.cart import get_cart
 from .forms import PhoneVerificationForm, OrderCreateForm
 from .models import OrderItem, Order
 from django.http import HttpResponse
@@ -86,7 +86,14 @@ def verify_code(request):
 
 @login_required
 def order_create(request):
-    cart = Cart(request)
+    cart = get_cart(request)
+    # orders are made at current prices and stock: if anything changed since
+    # the products were added, the visitor reviews the cart first
+    issues = cart.revalidate()
+    if issues:
+        for issue in issues:
+            messages.warning(request, str(issue))
+        return redirect("cart:detail_cart")
     if request.method == "POST":
         form = OrderCreateForm(request.POST)
         if form.is_valid():
@@ -134,7 +141,7 @@ def send_request(request):
         order = Order.objects.get(id=request.session["order_id"])
     except:
         return HttpResponse("error")
-    cart = Cart(request)
+    cart = get_cart(request)
     description = ""
     for item in order.items.all():
         description += item.product.name +", "
@@ -168,7 +175,7 @@ def send_request(request):
 
 
 def verify(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     order = Order.objects.get(id=request.session["order_id"])
     data = {
         "MerchantID": settings.MERCHANT,
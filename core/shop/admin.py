@@ -1,5 +1,7 @@
 from django.contrib import admin
-from shop.models import Product, Category, Comment, Rating, Image, ProductFeature
+from mptt.admin import MPTTModelAdmin
+from shop.catalog import catalog_changed
+from shop.models import Product, Category, Comment, Rating, Image, ProductFeature, ProductDailyView, ProductHourlyStat, RelatedProduct, Campaign
 
 
 # ---------------------------------------------
@@ -43,11 +45,11 @@ class ProductAdmin(admin.ModelAdmin):
 # Category Admin
 # ---------------------------------------------
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(MPTTModelAdmin):
     """
-    Admin configuration for the Category model.
+    Admin configuration for the Category model (shown as an indented tree).
     """
-    list_display = ['name', 'slug']  # Display category name and slug
+    list_display = ['name', 'slug', 'product_count', 'min_price', 'max_price']  # Display category name, slug and cached stats
 
 
 # ---------------------------------------------
@@ -72,3 +74,71 @@ class RatingAdmin(admin.ModelAdmin):
     """
     list_display = ('product', 'user', 'score', 'created')
     search_fields = ('product__name', 'user__phone')  # Enables search by product name or user phone number
+
+
+# ---------------------------------------------
+# Daily views Admin
+# ---------------------------------------------
+@admin.register(ProductDailyView)
+class ProductDailyViewAdmin(admin.ModelAdmin):
+    """
+    Read-only access to the per-day view counts written by the view counter.
+    """
+    list_display = ('product', 'date', 'views')
+    list_filter = ('date',)
+    raw_id_fields = ('product',)
+
+
+# ---------------------------------------------
+# Hourly stats Admin
+# ---------------------------------------------
+@admin.register(ProductHourlyStat)
+class ProductHourlyStatAdmin(admin.ModelAdmin):
+    """
+    Read-only access to the per-hour views and sales the leaderboards are built from.
+    """
+    list_display = ('product', 'hour', 'views', 'sales')
+    raw_id_fields = ('product',)
+
+
+# ---------------------------------------------
+# Related products Admin
+# ---------------------------------------------
+@admin.register(RelatedProduct)
+class RelatedProductAdmin(admin.ModelAdmin):
+    """
+    Read-only access to the precomputed related products.
+    """
+    list_display = ('product', 'kind', 'rank', 'related', 'score')
+    list_filter = ('kind',)
+    raw_id_fields = ('product', 'related')
+
+
+# ---------------------------------------------
+# Campaign Admin
+# ---------------------------------------------
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for discount campaigns.
+    Campaigns are switched on and off by the `run_campaigns` command;
+    the actions below apply or revert selected campaigns right away.
+    """
+    list_display = ('name', 'discount', 'category', 'brand', 'starts_at', 'ends_at', 'is_active')
+    list_filter = ('is_active',)
+    raw_id_fields = ('products',)
+    actions = ['apply_campaigns', 'revert_campaigns']
+
+    @admin.action(description="Apply selected campaigns now")
+    def apply_campaigns(self, request, queryset):
+        changed = sum(campaign.apply() for campaign in queryset.order_by('-discount'))
+        if changed:
+            catalog_changed()
+        self.message_user(request, f"{changed} products updated.")
+
+    @admin.action(description="Revert selected campaigns")
+    def revert_campaigns(self, request, queryset):
+        changed = sum(campaign.revert() for campaign in queryset)
+        if changed:
+            catalog_changed()
+        self.message_user(request, f"{changed} products updated.")
@@ -0,0 +1,265 @@
+"""
+In-memory prefix index for the search box autocomplete.
+
+The index is a sorted array of (term, key) pairs. Every suggestion (product,
+brand or category) is indexed under its full label and under each word of it,
+so "phone" finds "Apple phone". A lookup is a binary search for the prefix
+followed by a scan of the matching range; results are ranked by popularity
+(`sold_count` and `views`) and memoized per prefix until the index changes.
+
+The index is built from the database once per process and then kept up to
+date by the Product/Category signals in shop.signals. Changes made by other
+processes are noticed through a generation number in the cache, so a query
+never touches the database.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from shop.models import Product, Category
+
+GENERATION_CACHE_KEY = 'shop:autocomplete:generation'
+
+# A sold item counts as much as this many views.
+SOLD_WEIGHT = 20
+
+# Max number of memoized prefixes.
+RESULT_CACHE_SIZE = 2048
+
+# Seconds between checks of the shared generation number.
+GENERATION_CHECK_INTERVAL = 1
+
+# Arabic characters that are commonly typed instead of their Persian forms.
+CHARACTER_MAP = str.maketrans({'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', '‌': ' '})
+
+
+def normalize(text):
+    """
+    Normalizes text for prefix matching: case, Arabic/Persian letters and spaces.
+    """
+    return ' '.join((text or '').translate(CHARACTER_MAP).casefold().split())
+
+
+def product_score(sold_count, views):
+    return sold_count * SOLD_WEIGHT + views
+
+
+@dataclass
+class Suggestion:
+    kind: str
+    label: str
+    url: str
+    score: int = 0
+    terms: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {'kind': self.kind, 'label': self.label, 'url': self.url}
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index of products, brands and categories.
+    All public methods are thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._built_at = 0
+        self._generation = None
+        self._checked_at = 0
+        self._terms = []
+        self._suggestions = {}
+        self._results = {}
+        # brand / category key -> {product id: score}, used to rank brands and categories
+        self._members = {}
+        self._product_groups = {}
+
+    # ----- building -----
+
+    def build(self):
+        """
+        Rebuilds the whole index from the database (two queries).
+        """
+        products = Product.objects.order_by().values_list(
+            'id', 'name', 'slug', 'brand', 'category_id', 'sold_count', 'views'
+        )
+        categories = Category.objects.order_by().values_list('id', 'name', 'slug')
+        with self._lock:
+            self._terms = []
+            self._suggestions = {}
+            self._results = {}
+            self._members = {}
+            self._product_groups = {}
+            for category_id, name, slug in categories:
+                self._set_category(category_id, name, slug)
+            for row in products:
+                self._set_product(*row)
+            self._terms.sort()
+            self._built = True
+            self._built_at = time.monotonic()
+            self._generation = cache.get(GENERATION_CACHE_KEY)
+            self._checked_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        max_age = getattr(settings, 'AUTOCOMPLETE_REBUILD_INTERVAL', 3600)
+        now = time.monotonic()
+        if not self._built or now - self._built_at > max_age:
+            self.build()
+        elif now - self._checked_at > GENERATION_CHECK_INTERVAL:
+            self._checked_at = now
+            if cache.get(GENERATION_CACHE_KEY) != self._generation:
+                self.build()
+
+    # ----- incremental updates (called from signals) -----
+
+    def update_product(self, product, scores_only=False):
+        """
+        Re-indexes the product. Changes to its label, URL, brand or category are
+        announced to the other processes; `scores_only` changes (sold_count, views)
+        are applied here only and reach the others with their periodic rebuild.
+        """
+        with self._lock:
+            if self._built:
+                self._set_product(product.id, product.name, product.slug, product.brand, product.category_id,
+                                  product.sold_count, product.views)
+                self._results = {}
+            if not scores_only:
+                self._changed()
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self._built:
+                self._remove_product(product_id)
+            self._changed()
+
+    def update_category(self, category):
+        with self._lock:
+            if self._built:
+                self._set_category(category.id, category.name, category.slug)
+            self._changed()
+
+    def remove_category(self, category_id):
+        with self._lock:
+            if self._built:
+                self._remove(('category', category_id))
+                self._members.pop(('category', category_id), None)
+            self._changed()
+
+    def invalidate(self):
+        """
+        Marks the index stale in every process, e.g. after bulk writes that
+        bypass signals. It is rebuilt on the next lookup.
+        """
+        with self._lock:
+            self._built = False
+            self._changed()
+
+    def _changed(self):
+        self._results = {}
+        # Tell other processes their copy is stale; remember the new number so this one is not.
+        try:
+            self._generation = cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            cache.add(GENERATION_CACHE_KEY, 1, None)
+            self._generation = cache.get(GENERATION_CACHE_KEY)
+
+    def _set_product(self, product_id, name, slug, brand, category_id, sold_count, views):
+        self._remove_product(product_id)
+        score = product_score(sold_count, views)
+        url = reverse('shop:product_detail', kwargs={'slug': slug})
+        self._add(('product', product_id), Suggestion('product', name, url, score))
+
+        groups = [('category', category_id)]
+        if brand:
+            brand_key = ('brand', normalize(brand))
+            if brand_key not in self._suggestions:
+                url = f"{reverse('shop:search')}?{urlencode({'query': brand})}"
+                self._add(brand_key, Suggestion('brand', brand, url))
+            groups.append(brand_key)
+        for key in groups:
+            self._members.setdefault(key, {})[product_id] = score
+            self._rescore(key)
+        self._product_groups[product_id] = groups
+
+    def _remove_product(self, product_id):
+        self._remove(('product', product_id))
+        for key in self._product_groups.pop(product_id, []):
+            members = self._members.get(key, {})
+            members.pop(product_id, None)
+            if key[0] == 'brand' and not members:
+                self._remove(key)
+                self._members.pop(key, None)
+            else:
+                self._rescore(key)
+
+    def _set_category(self, category_id, name, slug):
+        key = ('category', category_id)
+        self._remove(key)
+        url = reverse('shop:products_by_category', kwargs={'category_slug': slug})
+        self._add(key, Suggestion('category', name, url))
+        self._rescore(key)
+
+    def _rescore(self, key):
+        suggestion = self._suggestions.get(key)
+        if suggestion is not None:
+            suggestion.score = sum(self._members.get(key, {}).values())
+
+    def _add(self, key, suggestion):
+        words = normalize(suggestion.label).split()
+        # index the full label and every word suffix of it ("apple phone x" -> "phone x", "x")
+        suggestion.terms = sorted({' '.join(words[i:]) for i in range(len(words))})
+        self._suggestions[key] = suggestion
+        for term in suggestion.terms:
+            if self._built:
+                insort(self._terms, (term, key))
+            else:
+                self._terms.append((term, key))
+
+    def _remove(self, key):
+        suggestion = self._suggestions.pop(key, None)
+        if suggestion is None:
+            return
+        for term in suggestion.terms:
+            i = bisect_left(self._terms, (term, key))
+            if i < len(self._terms) and self._terms[i] == (term, key):
+                del self._terms[i]
+
+    # ----- querying -----
+
+    def search(self, prefix, limit=10):
+        """
+        Returns up to `limit` suggestions starting with `prefix`, most popular first.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            self._ensure_fresh()
+            cache_key = (prefix, limit)
+            results = self._results.get(cache_key)
+            if results is None:
+                results = self._search(prefix, limit)
+                if len(self._results) >= RESULT_CACHE_SIZE:
+                    self._results = {}
+                self._results[cache_key] = results
+            return results
+
+    def _search(self, prefix, limit):
+        keys = set()
+        i = bisect_left(self._terms, (prefix,))
+        while i < len(self._terms) and self._terms[i][0].startswith(prefix):
+            keys.add(self._terms[i][1])
+            i += 1
+        best = heapq.nlargest(limit, keys, key=lambda key: (self._suggestions[key].score, key[0] == 'product'))
+        return [self._suggestions[key].as_dict() for key in best]
+
+
+prefix_index = PrefixIndex()
@@ -0,0 +1,163 @@
+"""
+Caching of shop pages for anonymous visitors.
+
+Cached pages are stored under keys that include version numbers:
+
+- the catalog version, bumped by the signals in shop.signals whenever a
+  product, image, rating or category changes (listings show all of those);
+- a per-product version, bumped when anything shown on that product's page
+  changes, including comments.
+
+Bumping a version makes every key built from the old one unreachable, so no
+key ever has to be enumerated or deleted. Versions are bumped when the
+writing transaction commits, not while it can still be rendered around. Versions start from the current
+time, so a version evicted from the cache never comes back with an old value.
+
+Hot keys are recomputed single-flight: the first request to miss takes a
+short lock and renders, concurrent requests wait for its result instead of
+all rendering the same page at once.
+
+Product cards are additionally cached as template fragments, keyed by
+`Product.cache_version` (see product_list.html).
+"""
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+CATALOG_VERSION_KEY = 'shop:version:catalog'
+
+# Response headers kept with a cached page.
+CACHED_HEADERS = ('X-Next-Cursor',)
+
+# Seconds a recompute lock is held at most, and how long other requests wait for it.
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 5
+LOCK_POLL_INTERVAL = 0.05
+
+
+def product_version_key(product_id):
+    return f'shop:version:product:{product_id}'
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns() // 1000, None)
+
+
+def invalidate_catalog():
+    """
+    Makes every cached listing (and product page) stale, once the current
+    transaction commits: a page rendered from the old rows before then would
+    otherwise be cached under the new version.
+    """
+    transaction.on_commit(partial(bump_version, CATALOG_VERSION_KEY))
+
+
+def invalidate_product(product_id):
+    """
+    Makes the cached pages of one product stale, once the current transaction commits.
+    """
+    transaction.on_commit(partial(bump_version, product_version_key(product_id)))
+
+
+def single_flight(key, compute, timeout):
+    """
+    Returns the cached value of `key`, computing and caching it on a miss.
+    Only one caller computes a missing key at a time; the others wait for
+    its result (up to LOCK_WAIT seconds, then compute it themselves).
+    `compute` may return None to skip caching.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = compute()
+            if value is not None:
+                cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if not cache.get(lock_key):
+            break
+    return compute()
+
+
+def is_page_cacheable(request):
+    """
+    Only anonymous GETs without a session are served from the cache;
+    anything with a session may show per-visitor content (cart, messages).
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and getattr(settings, 'PAGE_CACHE_TIMEOUT', 300) > 0
+    )
+
+
+def page_cache_key(request, versions):
+    ajax = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+    path = hashlib.md5(f'{ajax}:{request.get_full_path()}'.encode()).hexdigest()
+    return f"shop:page:{path}:{'.'.join(str(v) for v in versions)}"
+
+
+def cached_page(request, render, product_id=None):
+    """
+    Returns `render()`'s response, from the cache for anonymous visitors.
+    The page is cached under the catalog version, and under the product's
+    version too when `product_id` is given. Cached pages must not embed a
+    CSRF token; templates read it from the cookie, which is set here.
+    """
+    if not is_page_cacheable(request):
+        return render()
+
+    get_token(request)
+    versions = [get_version(CATALOG_VERSION_KEY)]
+    if product_id is not None:
+        versions.append(get_version(product_version_key(product_id)))
+
+    rendered = {}
+
+    def compute():
+        response = rendered['response'] = render()
+        if response.status_code != 200 or response.streaming:
+            return None
+        return {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'headers': {name: response[name] for name in CACHED_HEADERS if name in response},
+        }
+
+    entry = single_flight(page_cache_key(request, versions), compute, getattr(settings, 'PAGE_CACHE_TIMEOUT', 300))
+    if 'response' in rendered:
+        return rendered['response']
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    for name, value in entry['headers'].items():
+        response[name] = value
+    return response
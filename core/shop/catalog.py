@@ -0,0 +1,23 @@
+"""
+Bookkeeping after bulk catalog writes.
+
+`bulk_create`, `bulk_update` and `QuerySet.update` do not send model signals,
+so commands that write products in bulk call `catalog_changed` afterwards to
+do what the receivers in shop.signals would have done, once for the run.
+Search documents are refreshed by the callers per batch, with
+`shop.search.update_search_vectors`.
+"""
+from shop.autocomplete import prefix_index
+from shop.cache import invalidate_catalog
+from shop.categories import update_category_stats
+from shop.facets import invalidate_facets
+
+
+def catalog_changed():
+    """
+    Refreshes category stats and makes the facet, page and autocomplete caches stale.
+    """
+    update_category_stats()
+    invalidate_facets()
+    invalidate_catalog()
+    prefix_index.invalidate()
@@ -0,0 +1,188 @@
+"""
+Cached category tree for menus and category pages.
+
+Each Category row stores its product count and price range, subcategories
+included (`update_category_stats` keeps them current from the Product signals).
+The whole tree is loaded with one query, turned into plain `CategoryNode`
+objects and cached, so rendering menus, breadcrumbs or a category page's
+subcategory list needs no query and no aggregation.
+"""
+from dataclasses import dataclass, field
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.urls import reverse
+
+from shop.models import Category, Product
+
+TREE_CACHE_KEY = 'shop:categories:tree'
+
+STAT_FIELDS = ['product_count', 'min_price', 'max_price']
+
+
+@dataclass
+class CategoryNode:
+    id: int
+    name: str
+    slug: str
+    parent_id: int
+    level: int
+    product_count: int = 0
+    min_price: int = None
+    max_price: int = None
+    children: list = field(default_factory=list)
+    # ids of the category and all of its subcategories
+    descendant_ids: list = field(default_factory=list)
+
+    def get_absolute_url(self):
+        return reverse('shop:products_by_category', kwargs={'category_slug': self.slug})
+
+
+class CategoryTree:
+    """
+    The category tree: `roots` in display order, and lookups by id and slug.
+    """
+
+    def __init__(self, nodes):
+        self.by_id = {node.id: node for node in nodes}
+        self.by_slug = {node.slug: node for node in nodes}
+        self.roots = []
+        # nodes come in tree order, so a parent is always seen before its children
+        for node in nodes:
+            parent = self.by_id.get(node.parent_id)
+            (parent.children if parent else self.roots).append(node)
+        for node in reversed(nodes):
+            node.descendant_ids.insert(0, node.id)
+            parent = self.by_id.get(node.parent_id)
+            if parent:
+                parent.descendant_ids.extend(node.descendant_ids)
+
+    def __iter__(self):
+        return iter(self.roots)
+
+    def get(self, slug):
+        return self.by_slug.get(slug)
+
+    def ancestors(self, node):
+        """
+        Returns the ancestors of `node`, root first.
+        """
+        ancestors = []
+        while node.parent_id in self.by_id:
+            node = self.by_id[node.parent_id]
+            ancestors.insert(0, node)
+        return ancestors
+
+
+def build_category_tree():
+    nodes = [
+        CategoryNode(**row)
+        for row in Category.objects.order_by('tree_id', 'lft').values(
+            'id', 'name', 'slug', 'parent_id', 'level', *STAT_FIELDS,
+        )
+    ]
+    return CategoryTree(nodes)
+
+
+def get_category_tree():
+    """
+    Returns the cached CategoryTree, building it with a single query on a miss.
+    """
+    tree = cache.get(TREE_CACHE_KEY)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(TREE_CACHE_KEY, tree, getattr(settings, 'CATEGORY_TREE_CACHE_TIMEOUT', 3600))
+    return tree
+
+
+def invalidate_category_tree():
+    """
+    Drops the cached tree once the current transaction commits, so a tree
+    built from the old rows before then is not cached again.
+    """
+    transaction.on_commit(partial(cache.delete, TREE_CACHE_KEY))
+
+
+def update_category_stats(category_ids=None):
+    """
+    Recomputes the denormalized product count and price range of the given
+    categories and their ancestors, and of no other category (of every
+    category when None). Each affected category is aggregated over its
+    subtree with conditional aggregates of a single query; only changed rows
+    are written.
+    """
+    if category_ids is None:
+        return rebuild_category_stats()
+
+    chains = Q()
+    for tree_id, lft, rght in Category.objects.filter(pk__in=[pk for pk in category_ids if pk]).values_list(
+            'tree_id', 'lft', 'rght'):
+        # the category and its ancestors: the nodes whose range contains it
+        chains |= Q(tree_id=tree_id, lft__lte=lft, rght__gte=rght)
+    if not chains:
+        return
+    categories = list(Category.objects.filter(chains).only('id', 'tree_id', 'lft', 'rght', *STAT_FIELDS))
+
+    aggregates = {}
+    for category in categories:
+        subtree = Q(category__tree_id=category.tree_id, category__lft__gte=category.lft,
+                    category__lft__lte=category.rght)
+        aggregates[f'product_count_{category.pk}'] = Count('id', filter=subtree)
+        aggregates[f'min_price_{category.pk}'] = Min('discounted_price', filter=subtree)
+        aggregates[f'max_price_{category.pk}'] = Max('discounted_price', filter=subtree)
+    values = Product.objects.filter(category__tree_id__in={c.tree_id for c in categories}).aggregate(**aggregates)
+
+    save_category_stats(categories, {
+        category.pk: {name: values[f'{name}_{category.pk}'] for name in STAT_FIELDS} for category in categories
+    })
+
+
+def rebuild_category_stats():
+    """
+    Recomputes the stats of every category: all products are aggregated with
+    one grouped query and rolled up the tree in Python.
+    """
+    categories = list(Category.objects.order_by('tree_id', 'lft').only('id', 'parent_id', 'tree_id', 'lft',
+                                                                        *STAT_FIELDS))
+    if not categories:
+        return
+
+    stats = {
+        row.pop('category_id'): row
+        for row in Product.objects.order_by().values('category_id').annotate(
+            product_count=Count('id'), min_price=Min('discounted_price'), max_price=Max('discounted_price'),
+        )
+    }
+    totals = {c.pk: dict(stats.get(c.pk, {'product_count': 0, 'min_price': None, 'max_price': None}))
+              for c in categories}
+
+    # children come after their parent in tree order; walk backwards to roll up
+    for category in reversed(categories):
+        parent = totals.get(category.parent_id)
+        if parent is None:
+            continue
+        own = totals[category.pk]
+        parent['product_count'] += own['product_count']
+        parent['min_price'] = min((p for p in (parent['min_price'], own['min_price']) if p is not None), default=None)
+        parent['max_price'] = max((p for p in (parent['max_price'], own['max_price']) if p is not None), default=None)
+
+    save_category_stats(categories, totals)
+
+
+def save_category_stats(categories, totals):
+    """
+    Writes {category id: stats} for the categories whose stats changed, with one bulk_update.
+    """
+    changed = []
+    for category in categories:
+        values = totals[category.pk]
+        if any(getattr(category, name) != values[name] for name in STAT_FIELDS):
+            for name in STAT_FIELDS:
+                setattr(category, name, values[name])
+            changed.append(category)
+    if changed:
+        Category.objects.bulk_update(changed, STAT_FIELDS)
+        invalidate_category_tree()
@@ -0,0 +1,40 @@
+"""
+Paginated loading of threaded product comments.
+
+A page of top-level comments is fetched with keyset pagination, then every
+reply of those threads is fetched with one query through `Comment.root` and
+the tree is assembled in Python. Rendering a page therefore costs two queries
+however many replies or nesting levels the threads have.
+"""
+from shop.models import Comment
+from shop.pagination import KeysetPaginator
+
+COMMENTS_PER_PAGE = 10
+COMMENTS_ORDERING = ('-created', '-id')
+
+
+def get_comment_page(product, cursor=None, per_page=COMMENTS_PER_PAGE):
+    """
+    Returns a page of top-level comments of `product`, newest first.
+    Each comment has its nested replies in `reply_list` (oldest first),
+    and the author and author's profile are already loaded.
+    """
+    threads = Comment.objects.filter(product=product, parent__isnull=True).select_related('user__profile')
+    page = KeysetPaginator(threads, COMMENTS_ORDERING, per_page).get_page(cursor)
+
+    comments = {}
+    for comment in page:
+        comment.reply_list = []
+        comments[comment.pk] = comment
+
+    if comments:
+        replies = Comment.objects.filter(root__in=comments).select_related('user__profile').order_by('created', 'id')
+        replies = list(replies)
+        for reply in replies:
+            reply.reply_list = []
+            comments[reply.pk] = reply
+        for reply in replies:
+            parent = comments.get(reply.parent_id)
+            if parent is not None:
+                parent.reply_list.append(reply)
+    return page
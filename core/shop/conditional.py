@@ -0,0 +1,60 @@
+"""
+Validators for conditional GET (ETag) on catalog pages.
+
+ETags are computed without rendering, from the cache versions of shop.cache
+(bumped whenever anything shown on a page changes) and the visitor's own
+state. Browsers and CDNs revalidating an unchanged page get a
+`304 Not Modified` with no body.
+
+No Last-Modified is sent: no single timestamp moves on every change that
+bumps a version (deleted products, rating aggregates, processed images and
+campaigns are all written without touching `updated_at`), nor with the
+visitor's cart, so If-Modified-Since could answer 304 for a stale page.
+"""
+import hashlib
+
+from django.conf import settings
+
+from cart.cart import get_cart
+from shop.cache import CATALOG_VERSION_KEY, get_version, product_version_key
+
+
+def as_datetime(value):
+    """
+    Converts jalali datetimes (django_jalali fields) to regular ones.
+    """
+    return value.togregorian() if hasattr(value, 'togregorian') else value
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def viewer(request):
+    """
+    Per-visitor state shown on pages: logged in users see their own rating
+    and forms, and every visitor sees their cart in the header.
+    """
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return user
+    return f"{user}:{get_cart(request).version}"
+
+
+def is_ajax(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest'
+
+
+# ----- listings -----
+
+def listing_etag(request, *args, **kwargs):
+    return make_etag(request.get_full_path(), is_ajax(request), get_version(CATALOG_VERSION_KEY), viewer(request))
+
+
+# ----- product pages -----
+
+def product_etag(request, product, *args, **kwargs):
+    return make_etag(
+        request.get_full_path(), product.pk, as_datetime(product.updated_at).isoformat(),
+        get_version(CATALOG_VERSION_KEY), get_version(product_version_key(product.pk)), viewer(request),
+    )
@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .categories import get_category_tree
+
+
+def categories(request):
+    """
+    Adds the cached category tree (for navigation menus) to every template.
+    Loaded lazily, so pages that do not render it never touch the cache.
+    """
+    return {'category_tree': SimpleLazyObject(get_category_tree)}
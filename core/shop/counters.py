@@ -0,0 +1,181 @@
+"""
+Write-behind view counter for product pages.
+
+Saving the product on every page view rewrites the whole row, fires the
+pre_save signal, bumps `updated_at` and turns popular products into a
+row-lock hotspot. Instead, `product_detail` only records the hit in an
+in-process buffer, and the buffer is flushed periodically with one batched
+`views = views + CASE ...` UPDATE (plus the per-day and per-hour buckets,
+if enabled).
+"""
+import atexit
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from shop.models import Product, ProductDailyView, ProductHourlyStat
+
+# Max number of products updated by a single UPDATE statement.
+FLUSH_BATCH_SIZE = 500
+
+
+def batched_increment(pending, field='pk'):
+    """
+    Builds a `CASE WHEN <field>=<id> THEN <n> ... END` expression adding
+    `pending[id]` to every matched row.
+    """
+    return Case(
+        *[When(**{field: key}, then=Value(count)) for key, count in pending.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def current_hour():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def add_to_buckets(model, period_field, counts, value_field='views'):
+    """
+    Adds `counts` ({(product_id, period): n}) to the per-period counter rows
+    of `model` (ProductDailyView, ProductHourlyStat), creating missing rows.
+    Costs a few statements per period and batch, not per product.
+    """
+    by_period = {}
+    for (product_id, period), count in counts.items():
+        by_period.setdefault(period, {})[product_id] = count
+
+    for period, period_counts in by_period.items():
+        items = list(period_counts.items())
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = dict(items[start:start + FLUSH_BATCH_SIZE])
+            # Products deleted since the count was recorded have no bucket to write to.
+            existing = set(Product.objects.filter(pk__in=batch).order_by().values_list('pk', flat=True))
+            batch = {product_id: count for product_id, count in batch.items() if product_id in existing}
+            if not batch:
+                continue
+            # Make sure every bucket row exists, then add to all of them in one statement.
+            model.objects.bulk_create(
+                [model(product_id=product_id, **{period_field: period}) for product_id in batch],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(**{period_field: period}, product_id__in=batch).update(
+                **{value_field: F(value_field) + batched_increment(batch, field='product_id')}
+            )
+
+
+class ViewCounter:
+    """
+    Aggregates product view increments in memory and writes them in batches.
+
+    Settings:
+        VIEW_COUNTER_FLUSH_INTERVAL: seconds between automatic flushes
+            (0 disables the background flush; call `flush()` yourself).
+        VIEW_COUNTER_DAILY_BUCKETS: also keep per-day counts in ProductDailyView.
+        VIEW_COUNTER_HOURLY_BUCKETS: also keep per-hour counts in ProductHourlyStat
+            (needed by the trending leaderboards).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._daily = Counter()
+        self._hourly = Counter()
+        self._timer = None
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 30)
+
+    @property
+    def daily_buckets(self):
+        return getattr(settings, 'VIEW_COUNTER_DAILY_BUCKETS', True)
+
+    @property
+    def hourly_buckets(self):
+        return getattr(settings, 'VIEW_COUNTER_HOURLY_BUCKETS', True)
+
+    def record(self, product_id, count=1):
+        """
+        Buffers `count` views of a product. Never touches the database.
+        """
+        with self._lock:
+            self._pending[product_id] += count
+            if self.daily_buckets:
+                self._daily[(product_id, timezone.localdate())] += count
+            if self.hourly_buckets:
+                self._hourly[(product_id, current_hour())] += count
+            if self._timer is None and self.flush_interval > 0:
+                self._schedule()
+
+    def pending(self, product_id):
+        """
+        Returns the number of views of a product that are not flushed yet.
+        """
+        with self._lock:
+            return self._pending[product_id]
+
+    def flush(self):
+        """
+        Writes all buffered increments to the database.
+        Returns the number of products that were updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            daily, self._daily = self._daily, Counter()
+            hourly, self._hourly = self._hourly, Counter()
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                self._write_totals(pending)
+                if daily:
+                    add_to_buckets(ProductDailyView, 'date', daily)
+                if hourly:
+                    add_to_buckets(ProductHourlyStat, 'hour', hourly)
+        except Exception:
+            # Put the increments back so they are retried on the next flush.
+            with self._lock:
+                self._pending.update(pending)
+                self._daily.update(daily)
+                self._hourly.update(hourly)
+            raise
+        return len(pending)
+
+    def _write_totals(self, pending):
+        items = list(pending.items())
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = dict(items[start:start + FLUSH_BATCH_SIZE])
+            Product.objects.filter(pk__in=batch).update(views=F('views') + batched_increment(batch))
+
+    def _schedule(self):
+        self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # Connections are per thread; do not leak the timer thread's one.
+            connections.close_all()
+            with self._lock:
+                self._timer = None
+                if self._pending and self.flush_interval > 0:
+                    self._schedule()
+
+
+view_counter = ViewCounter()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        pass
@@ -0,0 +1,212 @@
+"""
+Faceted navigation for the product listing.
+
+For the current filter state (a bound `ProductFilter`) every facet — brand,
+category, price bucket and feature values — gets the number of products that
+selecting each of its values would show. Counts of a facet ignore that facet's
+own selection, so sibling values stay selectable (selecting "Samsung" does not
+hide "Apple").
+
+Each facet is one grouped query (price buckets are one conditional aggregate),
+and the result is cached per filter state. Cached facets belong to a version
+number that the signals in shop.signals bump whenever products, their features
+or categories change, which invalidates every cached state at once.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+
+from shop.models import Product, ProductFeature
+
+VERSION_CACHE_KEY = 'shop:facets:version'
+
+# key -> (label, lower bound, upper bound) of the discounted price, in Toman
+PRICE_BUCKETS = {
+    'under-100k': ('کمتر از ۱۰۰ هزار', None, 100_000),
+    '100k-500k': ('۱۰۰ تا ۵۰۰ هزار', 100_000, 500_000),
+    '500k-1m': ('۵۰۰ هزار تا ۱ میلیون', 500_000, 1_000_000),
+    '1m-5m': ('۱ تا ۵ میلیون', 1_000_000, 5_000_000),
+    'over-5m': ('بیشتر از ۵ میلیون', 5_000_000, None),
+}
+
+# Max number of values shown per feature, most common first.
+FEATURE_VALUES_LIMIT = 10
+
+
+def price_bucket_q(key):
+    """
+    Condition selecting the products of a price bucket.
+    """
+    _, low, high = PRICE_BUCKETS[key]
+    q = Q()
+    if low is not None:
+        q &= Q(discounted_price__gte=low)
+    if high is not None:
+        q &= Q(discounted_price__lt=high)
+    return q
+
+
+def feature_q(name, values):
+    """
+    Condition selecting products having feature `name` with one of `values`.
+    An EXISTS subquery, so combining several features does not duplicate rows.
+    """
+    return Exists(ProductFeature.objects.filter(product=OuterRef('pk'), name=name, value__in=values))
+
+
+def parse_features(values):
+    """
+    Groups 'name:value' strings into a {name: [values]} dict.
+    """
+    features = {}
+    for item in values or ():
+        name, sep, value = item.partition(':')
+        if sep and name and value:
+            features.setdefault(name, []).append(value)
+    return features
+
+
+# ----- cache versioning -----
+
+def facets_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, 1, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate_facets():
+    """
+    Makes every cached facet (and brand list) stale, once the current
+    transaction commits, so counts of the old rows are not cached under the new version.
+    """
+    transaction.on_commit(bump_facets_version)
+
+
+def bump_facets_version():
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.add(VERSION_CACHE_KEY, 1, None)
+
+
+def cached(name, state, compute):
+    """
+    Returns `compute()` cached under the current facets version and `state`.
+    """
+    digest = hashlib.md5(json.dumps(state, sort_keys=True).encode()).hexdigest()
+    key = f'shop:facets:{facets_version()}:{name}:{digest}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, getattr(settings, 'FACETS_CACHE_TIMEOUT', 600))
+    return value
+
+
+def brand_choices():
+    """
+    (value, label) choices of every brand in the catalog, cached.
+    """
+    def compute():
+        brands = Product.objects.exclude(brand__isnull=True).exclude(brand='').order_by('brand')
+        return [(brand, brand) for brand in brands.values_list('brand', flat=True).distinct()]
+    return cached('brands', {}, compute)
+
+
+# ----- counting -----
+
+def filter_state(filterset):
+    """
+    JSON-able, order independent description of the valid filter values.
+    """
+    data = getattr(filterset.form, 'cleaned_data', {})
+    state = {}
+    for name, value in data.items():
+        if value in (None, '', [], ()):
+            continue
+        state[name] = sorted(value) if isinstance(value, (list, tuple)) else str(value)
+    return state
+
+
+def queryset_without(filterset, *excluded):
+    """
+    The filtered product queryset with the filters named in `excluded` left out.
+    """
+    queryset = Product.objects.all()
+    for name, value in getattr(filterset.form, 'cleaned_data', {}).items():
+        if name not in excluded:
+            queryset = filterset.filters[name].filter(queryset, value)
+    return queryset.order_by()
+
+
+def count_facets(filterset):
+    """
+    Computes the facet counts of a validated `ProductFilter` (no caching).
+    """
+    state = filter_state(filterset)
+    selected_brands = set(state.get('brand', ()))
+    selected_category = state.get('category')
+    selected_price = state.get('price')
+    selected_features = parse_features(state.get('feature'))
+
+    brands = [
+        {'value': row['brand'], 'count': row['count'], 'selected': row['brand'] in selected_brands}
+        for row in queryset_without(filterset, 'brand').exclude(brand__isnull=True).exclude(brand='')
+        .values('brand').annotate(count=Count('id')).order_by('-count', 'brand')
+    ]
+
+    categories = [
+        {'value': row['category__slug'], 'label': row['category__name'], 'count': row['count'],
+         'selected': row['category__slug'] == selected_category}
+        for row in queryset_without(filterset, 'category')
+        .values('category__slug', 'category__name').annotate(count=Count('id')).order_by('-count', 'category__name')
+    ]
+
+    price_counts = queryset_without(filterset, 'price').aggregate(
+        **{key: Count('id', filter=price_bucket_q(key)) for key in PRICE_BUCKETS}
+    )
+    prices = [
+        {'value': key, 'label': label, 'count': price_counts[key], 'selected': key == selected_price}
+        for key, (label, _, _) in PRICE_BUCKETS.items() if price_counts[key]
+    ]
+
+    # Unselected features share one query; a feature with a selection is
+    # counted without its own selection, one query each.
+    features = {}
+    feature_queries = [(None, queryset_without(filterset))]
+    without_features = queryset_without(filterset, 'feature')
+    for name in selected_features:
+        others = without_features
+        for other, values in selected_features.items():
+            if other != name:
+                others = others.filter(feature_q(other, values))
+        feature_queries.append((name, others))
+
+    for name, products in feature_queries:
+        rows = ProductFeature.objects.filter(product__in=products.values('pk'))
+        rows = rows.filter(name=name) if name else rows.exclude(name__in=selected_features)
+        for row in rows.values('name', 'value').annotate(count=Count('product', distinct=True)).order_by('name', '-count', 'value'):
+            values = features.setdefault(row['name'], [])
+            if len(values) < FEATURE_VALUES_LIMIT:
+                values.append({'value': row['value'], 'count': row['count'],
+                               'selected': row['value'] in selected_features.get(row['name'], ())})
+
+    return {
+        'brand': brands,
+        'category': categories,
+        'price': prices,
+        'features': dict(sorted(features.items())),
+    }
+
+
+def get_facets(filterset):
+    """
+    Facet counts for the filter state of `filterset`, cached until the catalog changes.
+    """
+    filterset.is_valid()
+    return cached('counts', filter_state(filterset), lambda: count_facets(filterset))
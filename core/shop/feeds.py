@@ -0,0 +1,151 @@
+"""
+Streaming product feeds (JSONL, CSV and XML) for marketplaces and exports.
+
+Products are read with `QuerySet.iterator(chunk_size=...)`, with categories
+joined and images/features prefetched once per chunk, and every row is
+encoded as soon as it is read. Nothing accumulates, so memory stays constant
+whatever the catalog size. The encoded chunks can be compressed with gzip on
+the fly and are consumed by a StreamingHttpResponse or written to a file.
+"""
+import csv
+import io
+import json
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from django.db.models import Prefetch
+
+from shop.models import Image, Product
+
+FEED_CHUNK_SIZE = 2000
+
+FEED_CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'xml': 'application/xml; charset=utf-8',
+}
+
+CSV_COLUMNS = ['id', 'slug', 'name', 'brand', 'category', 'category_slug', 'url', 'image_url', 'price',
+               'original_price', 'discount', 'availability', 'inventory', 'features', 'updated_at']
+
+
+def feed_products(chunk_size=FEED_CHUNK_SIZE):
+    """
+    Every product with its category, images and features, streamed by chunks.
+    """
+    return Product.objects.select_related('category').prefetch_related(
+        Prefetch('images', queryset=Image.objects.order_by('created', 'id'), to_attr='listing_images'),
+        'features',
+    ).order_by('pk').iterator(chunk_size=chunk_size)
+
+
+def feed_rows(base_url, chunk_size=FEED_CHUNK_SIZE):
+    """
+    Yields one plain dict per product. `base_url` (e.g. https://example.com)
+    makes product and image URLs absolute.
+    """
+    base_url = base_url.rstrip('/')
+
+    def absolute(url):
+        return url if url.startswith(('http://', 'https://')) else base_url + url
+
+    for product in feed_products(chunk_size):
+        image = product.primary_image
+        yield {
+            'id': product.pk,
+            'slug': product.slug,
+            'name': product.name,
+            'brand': product.brand or '',
+            'category': product.category.name,
+            'category_slug': product.category.slug,
+            'url': absolute(product.get_absolute_url()),
+            'image_url': absolute(image.display_url) if image else '',
+            'price': product.discounted_price,
+            'original_price': product.original_price,
+            'discount': product.discount or 0,
+            'availability': 'in_stock' if product.inventory > 0 else 'out_of_stock',
+            'inventory': product.inventory,
+            'features': {feature.name: feature.value for feature in product.features.all()},
+            'updated_at': product.updated_at.togregorian().isoformat(),
+        }
+
+
+# ----- encoders: each yields str chunks -----
+
+def encode_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def encode_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writeheader()
+    yield flush()
+    for row in rows:
+        row = dict(row, features='; '.join(f'{name}: {value}' for name, value in row['features'].items()))
+        writer.writerow(row)
+        yield flush()
+
+
+def encode_xml(rows):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<products>\n'
+    for row in rows:
+        parts = ['  <product>\n']
+        for name, value in row.items():
+            if name == 'features':
+                parts.append('    <features>\n')
+                for feature, feature_value in value.items():
+                    parts.append(f'      <feature name={quoteattr(feature)}>{escape(feature_value)}</feature>\n')
+                parts.append('    </features>\n')
+            else:
+                parts.append(f'    <{name}>{escape(str(value))}</{name}>\n')
+        parts.append('  </product>\n')
+        yield ''.join(parts)
+    yield '</products>\n'
+
+
+FEED_ENCODERS = {
+    'jsonl': encode_jsonl,
+    'csv': encode_csv,
+    'xml': encode_xml,
+}
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses a stream of byte chunks into a gzip stream, chunk by chunk.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def generate_feed(feed_format, rows, compress=False, buffer_size=64 * 1024):
+    """
+    Encodes `rows` (see `feed_rows`) and yields the feed as byte chunks of
+    about `buffer_size` bytes, so small rows are not written one by one.
+    """
+    def batched():
+        pending, size = [], 0
+        for text in FEED_ENCODERS[feed_format](rows):
+            data = text.encode('utf-8')
+            pending.append(data)
+            size += len(data)
+            if size >= buffer_size:
+                yield b''.join(pending)
+                pending, size = [], 0
+        if pending:
+            yield b''.join(pending)
+
+    return gzip_chunks(batched()) if compress else batched()
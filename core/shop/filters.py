@@ -1,31 +1,57 @@
 import django_filters
-from .models import Product, Category
+from .categories import get_category_tree
+from .facets import PRICE_BUCKETS, brand_choices, feature_q, parse_features, price_bucket_q
+from .models import Product
 
 
 class ProductFilter(django_filters.FilterSet):
+    """
+    Filters of the product listing. Facet counts for the current
+    filter state come from `shop.facets.get_facets`.
+    """
     # قیمت
     min_price = django_filters.NumberFilter(field_name='original_price', lookup_expr='gte', label='قیمت حداقل')
     max_price = django_filters.NumberFilter(field_name='original_price', lookup_expr='lte', label='قیمت حداکثر')
 
-    # برند به صورت انتخابی
-    BRAND_CHOICES = Product.objects.values_list('brand', 'brand').distinct()
-    brand = django_filters.ChoiceFilter(choices=[], label='برند')
+    # بازه قیمت (بر اساس قیمت بعد از تخفیف)
+    price = django_filters.ChoiceFilter(
+        choices=[(key, label) for key, (label, _, _) in PRICE_BUCKETS.items()],
+        method='filter_price',
+        label='بازه قیمت',
+    )
 
-    # دسته بندی به صورت انتخابی
-    # category = django_filters.ModelChoiceFilter(
-    #     queryset=Category.objects.all(),
-    #     label='دسته بندی'
-    # )
+    # برند به صورت انتخابی (چند انتخابی)
+    brand = django_filters.MultipleChoiceFilter(choices=[], label='برند')
+
+    # دسته بندی (با زیر دسته ها)
+    category = django_filters.CharFilter(method='filter_category', label='دسته بندی')
+
+    # ویژگی ها به صورت name:value
+    feature = django_filters.MultipleChoiceFilter(choices=[], method='filter_feature', label='ویژگی')
 
     class Meta:
         model = Product
-        fields = ['min_price', 'max_price', 'brand', 'category']
+        fields = ['min_price', 'max_price', 'price', 'brand', 'category', 'feature']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # تنظیم choices دینامیک
-        brands = Product.objects.values_list('brand', 'brand').distinct()
-        self.filters['brand'].extra['choices'] = [(b[0], b[0]) for b in brands if b[0]]
+        # تنظیم choices دینامیک (از کش، بدون کوئری DISTINCT در هر درخواست)
+        self.filters['brand'].extra['choices'] = brand_choices()
+        # feature values are free-form 'name:value' pairs; accept whatever was sent
+        features = self.data.getlist('feature') if hasattr(self.data, 'getlist') else []
+        self.filters['feature'].extra['choices'] = [(value, value) for value in features]
+
+    def filter_category(self, queryset, name, value):
+        # subcategory ids come from the cached tree, so no join with Category is needed
+        node = get_category_tree().get(value) if value else None
+        if node is None:
+            return queryset if not value else queryset.none()
+        return queryset.filter(category_id__in=node.descendant_ids)
+
+    def filter_price(self, queryset, name, value):
+        return queryset.filter(price_bucket_q(value)) if value else queryset
 
-        # categories = Category.objects.values_list('name', 'name').distinct()
-        # self.filters['category'].extra['choices'] = [(c[0], c[0]) for c in categories if c[0]]
\ No newline at end of file
+    def filter_feature(self, queryset, name, value):
+        for feature, values in parse_features(value).items():
+            queryset = queryset.filter(feature_q(feature, values))
+        return queryset
@@ -0,0 +1,172 @@
+"""
+Background processing of product images.
+
+Uploading an image only stores the original file. Encoding happens after the
+transaction commits, on a small worker pool, and produces WebP variants of
+several sizes (see IMAGE_VARIANTS) that templates use through `Image.srcset`.
+Pillow releases the GIL while encoding, so a thread pool keeps all workers busy.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image as PilImage, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+
+from shop.cache import invalidate_catalog, invalidate_product
+
+logger = logging.getLogger(__name__)
+
+# variant name -> max width/height in pixels, smallest first
+IMAGE_VARIANTS = {
+    'thumbnail': 320,
+    'medium': 800,
+    'full': 1600,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def webp_options():
+    """
+    Encoder options for the variants. `method` 4 is several times faster than 6
+    for a negligible size difference.
+    """
+    return {
+        'quality': getattr(settings, 'IMAGE_WEBP_QUALITY', 75),
+        'method': getattr(settings, 'IMAGE_WEBP_METHOD', 4),
+    }
+
+
+def variant_name(source_name, variant):
+    """
+    Storage name of a variant, e.g. products_images/variants/photo-thumbnail.webp
+    """
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}-{variant}.webp')
+
+
+def render_variants(source):
+    """
+    Encodes an open Pillow image into every variant.
+    Returns a {variant: (webp bytes, width in pixels)} dict; a source smaller
+    than a variant is not upscaled, so the width can be below the variant's size.
+    """
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ('RGB', 'RGBA'):
+        has_alpha = source.mode in ('LA', 'PA') or 'transparency' in source.info
+        source = source.convert('RGBA' if has_alpha else 'RGB')
+
+    options = webp_options()
+    rendered = {}
+    for variant, size in IMAGE_VARIANTS.items():
+        image = source.copy()
+        image.thumbnail((size, size), PilImage.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'WEBP', **options)
+        rendered[variant] = buffer.getvalue(), image.width
+    return rendered
+
+
+def save_variants(storage, source_name, rendered):
+    """
+    Writes rendered variants to storage, replacing older versions.
+    Returns the Image field values of the variants: their storage names and widths.
+    """
+    names = {}
+    for variant, (data, width) in rendered.items():
+        name = variant_name(source_name, variant)
+        if storage.exists(name):
+            storage.delete(name)
+        names[f'{variant}_file'] = storage.save(name, ContentFile(data))
+        names[f'{variant}_width'] = width
+    return names
+
+
+def encoding_signature():
+    """
+    Describes how variants are encoded; changing sizes or quality changes it.
+    """
+    return json.dumps([IMAGE_VARIANTS, webp_options()], sort_keys=True)
+
+
+def source_hash(data, signature=None):
+    """
+    Hash of an original image's content together with the encoding settings.
+    Variants only need regenerating when it changes.
+    """
+    signature = encoding_signature() if signature is None else signature
+    return hashlib.sha256(signature.encode() + data).hexdigest()
+
+
+def build_variants(storage, source_name, data=None, signature=None):
+    """
+    Renders and stores the variants of an original image.
+    Returns the Image field values to save (variant names and widths, and `source_hash`).
+    """
+    if data is None:
+        with storage.open(source_name, 'rb') as f:
+            data = f.read()
+    with PilImage.open(io.BytesIO(data)) as source:
+        source.load()
+        rendered = render_variants(source)
+    names = save_variants(storage, source_name, rendered)
+    names['source_hash'] = source_hash(data, signature)
+    return names
+
+
+def process_image(image_id):
+    """
+    Generates the variants of one Image and stores their names on the row.
+    """
+    from shop.models import Image
+
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None or not image.image_file:
+        return
+    updates = build_variants(image.image_file.storage, image.image_file.name)
+    Image.objects.filter(pk=image_id).update(**updates)
+
+    # the row was updated without signals; cached pages still show the original
+    invalidate_product(image.product_id)
+    invalidate_catalog()
+
+
+def _run(image_id):
+    try:
+        process_image(image_id)
+    except Exception:
+        logger.exception("processing of image %s failed", image_id)
+    finally:
+        # Each worker thread has its own connection; do not leak it.
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+                thread_name_prefix='image-processing',
+            )
+        return _executor
+
+
+def enqueue_image(image_id):
+    """
+    Schedules variant generation once the current transaction commits.
+    With IMAGE_PROCESSING_SYNC the image is processed inline instead (tests, scripts).
+    """
+    if getattr(settings, 'IMAGE_PROCESSING_SYNC', False):
+        transaction.on_commit(lambda: process_image(image_id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run, image_id))
@@ -0,0 +1,165 @@
+"""
+Rolling best-seller and trending leaderboards (24h, 7d and 30d), overall and per category.
+
+Views (from the view counter) and units sold (from order items) are counted
+in hourly buckets, ProductHourlyStat, so nothing ever sorts the whole product
+table by an all-time counter. `build_leaderboards` sums the buckets of the
+longest window with one grouped query, ranks products for every window and
+category (a category's board includes its subcategories) keeping only the
+top K of each with a heap, and snapshots what a product card shows. The
+result is cached, so pages read leaderboards without any query. The
+`update_leaderboards` command rebuilds them (run it every few minutes) and
+drops buckets older than the longest window.
+"""
+import heapq
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from shop.autocomplete import product_score
+from shop.cache import single_flight
+from shop.categories import get_category_tree
+from shop.counters import add_to_buckets, current_hour
+from shop.models import Product, ProductHourlyStat
+
+LEADERBOARDS_CACHE_KEY = 'shop:leaderboards'
+
+# Kept longer than the refresh interval of update_leaderboards, so pages never
+# have to build them; a missing value is built single-flight on first use.
+LEADERBOARDS_TIMEOUT = 60 * 60
+
+# Products kept per leaderboard.
+LEADERBOARD_SIZE = 20
+
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+
+@dataclass
+class LeaderboardEntry:
+    """
+    What a product card shows, as of the last leaderboard build.
+    """
+    id: int
+    name: str
+    url: str
+    image_url: str
+    average_rating: float
+    original_price: int
+    discount: int
+    discounted_price: int
+    views: int
+    sales: int
+
+
+class Leaderboards:
+    """
+    Top products per (metric, window, category id); category None is the whole catalog.
+    Metrics are 'trending' (views and sales, see `product_score`) and 'best_sellers'.
+    """
+
+    def __init__(self, boards, built_at):
+        self.boards = boards
+        self.built_at = built_at
+
+    def get(self, metric, window='24h', category_id=None, limit=10):
+        return self.boards.get((metric, window, category_id), [])[:limit]
+
+
+def record_sales(items):
+    """
+    Adds units sold, as (product id, quantity) pairs, to the current hour's buckets.
+    """
+    hour = current_hour()
+    counts = Counter()
+    for product_id, quantity in items:
+        counts[(product_id, hour)] += quantity
+    if counts:
+        add_to_buckets(ProductHourlyStat, 'hour', counts, value_field='sales')
+
+
+def build_leaderboards(now=None, size=LEADERBOARD_SIZE):
+    now = now or timezone.now()
+    since = {window: now - length for window, length in WINDOWS.items()}
+    aggregates = {}
+    for window, start in since.items():
+        aggregates[f'views_{window}'] = Sum('views', filter=Q(hour__gte=start))
+        aggregates[f'sales_{window}'] = Sum('sales', filter=Q(hour__gte=start))
+    rows = ProductHourlyStat.objects.filter(hour__gte=min(since.values())).order_by().values(
+        'product_id', 'product__category_id',
+    ).annotate(**aggregates)
+
+    tree = get_category_tree()
+    heaps = defaultdict(list)
+    totals = {}
+    for row in rows:
+        node = tree.by_id.get(row['product__category_id'])
+        categories = [None] + ([ancestor.id for ancestor in tree.ancestors(node)] + [node.id] if node else [])
+        for window in WINDOWS:
+            views, sales = row[f'views_{window}'] or 0, row[f'sales_{window}'] or 0
+            totals[(row['product_id'], window)] = (views, sales)
+            for metric, score in (('trending', product_score(sales, views)), ('best_sellers', sales)):
+                if score <= 0:
+                    continue
+                # ties go to the older product
+                item = (score, -row['product_id'])
+                for category_id in categories:
+                    heap = heaps[(metric, window, category_id)]
+                    if len(heap) < size:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+
+    ranked = {key: [-product_id for _, product_id in sorted(heap, reverse=True)] for key, heap in heaps.items()}
+    product_ids = {product_id for ids in ranked.values() for product_id in ids}
+    products = Product.objects.filter(pk__in=product_ids).for_listing().in_bulk() if product_ids else {}
+
+    boards = {}
+    for (metric, window, category_id), ids in ranked.items():
+        boards[(metric, window, category_id)] = [
+            leaderboard_entry(products[product_id], *totals[(product_id, window)])
+            for product_id in ids if product_id in products
+        ]
+    return Leaderboards(boards, now)
+
+
+def leaderboard_entry(product, views, sales):
+    image = product.primary_image
+    return LeaderboardEntry(
+        id=product.pk,
+        name=product.name,
+        url=product.get_absolute_url(),
+        image_url=image.thumbnail_url if image else '',
+        average_rating=float(product.average_rating),
+        original_price=product.original_price,
+        discount=product.discount,
+        discounted_price=product.discounted_price,
+        views=views,
+        sales=sales,
+    )
+
+
+def refresh_leaderboards():
+    leaderboards = build_leaderboards()
+    cache.set(LEADERBOARDS_CACHE_KEY, leaderboards, LEADERBOARDS_TIMEOUT)
+    return leaderboards
+
+
+def get_leaderboards():
+    return single_flight(LEADERBOARDS_CACHE_KEY, build_leaderboards, LEADERBOARDS_TIMEOUT)
+
+
+def prune_buckets(now=None):
+    """
+    Deletes buckets older than the longest window. Returns the number deleted.
+    """
+    before = (now or timezone.now()) - max(WINDOWS.values())
+    deleted, _ = ProductHourlyStat.objects.filter(hour__lt=before).delete()
+    return deleted
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import BATCH_SIZE, RELATED_PRODUCTS_COUNT, build_bought_together
+
+
+class Command(BaseCommand):
+    """
+    Adds the orders paid since the last run to the co-purchase counts and
+    rescores the "frequently bought together" products of the products in
+    them (see shop.recommendations). Meant to run hourly or nightly;
+    --rebuild recounts every paid order from scratch.
+    """
+    help = "Update 'frequently bought together' recommendations from paid orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=RELATED_PRODUCTS_COUNT, help="Related products per product")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Products rescored per transaction")
+        parser.add_argument('--rebuild', action='store_true', help="Recount all paid orders")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        orders, products = build_bought_together(options['count'], options['batch_size'], options['rebuild'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{orders} orders counted, {products} products rescored in {elapsed:.1f}s"
+        ))
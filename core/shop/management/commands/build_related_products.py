@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.recommendations import BATCH_SIZE, RELATED_PRODUCTS_COUNT, build_similar_products
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the content-based related products of the whole catalog
+    (see shop.recommendations). Meant to run nightly, or after large imports.
+    """
+    help = "Rebuild related products from product content (TF-IDF similarity)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=RELATED_PRODUCTS_COUNT, help="Related products per product")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Products written per transaction")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        processed = build_similar_products(options['count'], options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"related products of {processed} products rebuilt in {elapsed:.1f}s"
+        ))
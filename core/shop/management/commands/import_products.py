@@ -0,0 +1,288 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, F, Max, PositiveSmallIntegerField, When
+from django.utils.text import slugify
+
+from shop.catalog import catalog_changed
+from shop.models import Category, Product, ProductFeature, discounted_price_expression
+from shop.search import update_search_vectors
+
+# Product fields written by the import; anything else keeps its value.
+IMPORT_FIELDS = ['name', 'description', 'brand', 'category', 'original_price', 'discount', 'inventory', 'weight']
+
+# Largest value of a PositiveIntegerField on every supported database.
+MAX_POSITIVE_INT = 2 ** 31 - 1
+
+
+def max_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+def read_rows(path, file_format):
+    """
+    Yields (line number, dict, error) from a CSV file (with a header row) or a
+    JSONL file. A line that is not a JSON object comes with row None and the
+    reason in `error`, so it is skipped like any other invalid row.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if file_format == 'csv':
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                yield line, row, None
+        else:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError as e:
+                    yield line, None, f"invalid JSON ({e})"
+                    continue
+                if isinstance(row, dict):
+                    yield line, row, None
+                else:
+                    yield line, None, "not a JSON object"
+
+
+def text(value):
+    """
+    A row value as stripped text; JSONL values may be numbers, lists or null.
+    """
+    return '' if value is None else str(value).strip()
+
+
+def parse_features(value):
+    """
+    Features are a {name: value} object (JSONL) or "name: value; name: value" (CSV),
+    the format written by export_products.
+    """
+    if isinstance(value, dict):
+        return {str(name): str(feature) for name, feature in value.items()}
+    features = {}
+    for item in text(value).split(';'):
+        name, sep, feature = item.partition(':')
+        if sep and name.strip():
+            features[name.strip()] = feature.strip()
+    return features
+
+
+def parse_int(value, default=None):
+    if value in (None, ''):
+        return default
+    return int(float(value))
+
+
+class Command(BaseCommand):
+    """
+    Imports products from a CSV or JSONL file (the format written by
+    export_products; `name` and `category` are required, a `slug` is made
+    from the name when missing). Rows that the database would reject
+    (negative numbers, values too long for their field) are skipped and
+    reported like any other invalid row, so they never abort a batch.
+
+    Rows are upserted by slug in batches: missing categories are created at
+    once, products are written with one bulk_create(update_conflicts=True),
+    `discounted_price` is computed by a single UPDATE per batch (which also
+    keeps the imported discount of products in a campaign for when it ends), and features
+    of the imported products are replaced with one delete and one bulk_create.
+    No model save() or signals run per row; derived data (search documents,
+    category stats, caches) is refreshed per batch and once at the end.
+    """
+    help = "Bulk import (upsert) products from CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="File format (default: from the extension)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per batch")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        batch_size = options['batch_size']
+
+        started = time.monotonic()
+        self.imported = self.skipped = 0
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.categories_created = False
+        self.taken_slugs = set()
+        self.checked_slug_bases = set()
+
+        batch = {}
+        for line, row, error in read_rows(path, file_format):
+            if error:
+                self.skip(line, error)
+                continue
+            product = self.build_product(line, row)
+            if product is None:
+                continue
+            # a later row with the same slug replaces the earlier one
+            batch[product.slug] = product
+            if len(batch) >= batch_size:
+                self.write_batch(list(batch.values()))
+                batch = {}
+        if batch:
+            self.write_batch(list(batch.values()))
+
+        if self.categories_created:
+            Category.objects.rebuild()
+        catalog_changed()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.imported} products imported, {self.skipped} rows skipped in {elapsed:.1f}s "
+            f"({self.imported / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+
+    def build_product(self, line, row):
+        """
+        Turns an input row into an unsaved Product (with `import_features`),
+        or reports it and returns None when it is invalid.
+        """
+        name = text(row.get('name'))
+        category = text(row.get('category'))
+        category_slug = text(row.get('category_slug'))
+        if not name or not (category or category_slug):
+            return self.skip(line, "name and category are required")
+        try:
+            discount = parse_int(row.get('discount'))
+            product = Product(
+                name=name,
+                slug=text(row.get('slug')),
+                description='' if row.get('description') is None else str(row['description']),
+                brand=text(row.get('brand')) or None,
+                original_price=parse_int(row.get('original_price'), 0),
+                discount=discount or None,
+                inventory=parse_int(row.get('inventory'), 0),
+                weight=parse_int(row.get('weight'), 0),
+            )
+        except (TypeError, ValueError) as e:
+            return self.skip(line, f"invalid number ({e})")
+        if product.discount is not None and not 0 <= product.discount <= 100:
+            return self.skip(line, "discount must be between 0 and 100")
+        for field in ('original_price', 'inventory', 'weight'):
+            if not 0 <= getattr(product, field) <= MAX_POSITIVE_INT:
+                return self.skip(line, f"{field} must be between 0 and {MAX_POSITIVE_INT}")
+
+        product.category_slug = category_slug or slugify(category, allow_unicode=True)
+        product.category_name = category or product.category_slug
+        product.import_features = parse_features(row['features']) if 'features' in row else None
+
+        too_long = [
+            label for label, value, limit in [
+                ('name', product.name, max_length(Product, 'name')),
+                ('slug', product.slug, max_length(Product, 'slug')),
+                ('brand', product.brand or '', max_length(Product, 'brand')),
+                ('category', product.category_name, max_length(Category, 'name')),
+                ('category slug', product.category_slug, max_length(Category, 'slug')),
+            ] + [
+                (f'feature {feature_name!r}', value, max_length(ProductFeature, 'value'))
+                for feature_name, value in (product.import_features or {}).items()
+            ] + [
+                ('feature name', feature_name, max_length(ProductFeature, 'name'))
+                for feature_name in (product.import_features or {})
+            ]
+            if len(value) > limit
+        ]
+        if too_long:
+            return self.skip(line, f"too long: {', '.join(too_long)}")
+
+        if product.slug:
+            self.taken_slugs.add(product.slug)
+        else:
+            product.slug = self.allocate_slug(name)
+        return product
+
+    def allocate_slug(self, name):
+        """
+        Slug for a row without one: the slugified name, with a -2, -3...
+        suffix when it is taken by an existing product or an earlier row, so
+        a row without a slug always creates a new product and never
+        overwrites one (rows update products through their `slug`). The
+        existing slugs of a name are read once per import.
+        """
+        limit = max_length(Product, 'slug')
+        base = slugify(name, allow_unicode=True)[:limit] or 'product'
+        # suffixed slugs may cut the base short, so the shorter prefix is looked up
+        prefix = base[:limit - 10]
+        if prefix not in self.checked_slug_bases:
+            self.checked_slug_bases.add(prefix)
+            self.taken_slugs.update(Product.objects.filter(slug__startswith=prefix).values_list('slug', flat=True))
+
+        slug, count = base, 1
+        while slug in self.taken_slugs:
+            count += 1
+            suffix = f'-{count}'
+            slug = base[:limit - len(suffix)] + suffix
+        self.taken_slugs.add(slug)
+        return slug
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        self.stderr.write(f"line {line}: skipped, {reason}")
+        return None
+
+    @transaction.atomic
+    def write_batch(self, products):
+        self.create_categories(products)
+        for product in products:
+            product.category_id = self.categories[product.category_slug]
+            # staged in regular_discount, so an existing row's campaign discount is not overwritten
+            product.regular_discount = product.discount
+
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['slug'],
+            update_fields=[name for name in IMPORT_FIELDS if name != 'discount'] + ['regular_discount', 'updated_at'],
+        )
+        ids = dict(Product.objects.filter(slug__in=[p.slug for p in products]).values_list('slug', 'pk'))
+        batch = Product.objects.filter(pk__in=ids.values())
+
+        # products in a campaign keep its discount and get the imported one back when it ends
+        discount = Case(When(campaign=None, then=F('regular_discount')), default=F('discount'),
+                        output_field=PositiveSmallIntegerField())
+        batch.update(
+            discount=discount,
+            regular_discount=Case(When(campaign=None, then=None), default=F('regular_discount'),
+                                  output_field=PositiveSmallIntegerField()),
+            # same rule as Product.save, for the whole batch at once
+            discounted_price=discounted_price_expression(discount),
+        )
+        update_search_vectors(batch)
+
+        with_features = [p for p in products if p.import_features is not None]
+        if with_features:
+            ProductFeature.objects.filter(product_id__in=[ids[p.slug] for p in with_features]).delete()
+            ProductFeature.objects.bulk_create([
+                ProductFeature(product_id=ids[p.slug], name=name, value=value)
+                for p in with_features for name, value in p.import_features.items()
+            ])
+
+        self.imported += len(products)
+        self.stdout.write(f"{self.imported} products imported")
+
+    def create_categories(self, products):
+        """
+        Creates the missing categories of a batch as root nodes with one
+        bulk_create; the tree is rebuilt once at the end of the import.
+        """
+        missing = {}
+        for product in products:
+            if product.category_slug not in self.categories:
+                missing.setdefault(product.category_slug, product.category_name)
+        if not missing:
+            return
+
+        next_tree_id = (Category.objects.aggregate(last=Max('tree_id'))['last'] or 0) + 1
+        Category.objects.bulk_create([
+            Category(name=name, slug=slug, tree_id=tree_id, lft=1, rght=2, level=0)
+            for tree_id, (slug, name) in enumerate(missing.items(), start=next_tree_id)
+        ])
+        self.categories.update(Category.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+        self.categories_created = True
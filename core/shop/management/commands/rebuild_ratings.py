@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from shop.models import Product, Rating, RATING_SCORES, rating_fields_from
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the rating aggregates (count, sum, average and 1–5 histogram)
+    of every product from its Rating rows.
+
+    Ratings are aggregated with one grouped query per batch of products and
+    only products whose stored values drifted are written, with bulk_update.
+    Use --check to only report drift.
+    """
+    help = "Rebuild product rating aggregates from the Rating table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Number of products per batch")
+        parser.add_argument('--check', action='store_true', help="Only report products whose aggregates drifted")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        check = options['check']
+        fields = ['rating_count', 'rating_sum', 'average_rating'] + [f'rating_{score}' for score in RATING_SCORES]
+
+        started = time.monotonic()
+        checked = drifted = 0
+        last_id = 0
+        while True:
+            products = list(
+                Product.objects.filter(pk__gt=last_id).order_by('pk').only('pk', 'name', *fields)[:batch_size]
+            )
+            if not products:
+                break
+            last_id = products[-1].pk
+
+            aggregates = {
+                row.pop('product_id'): rating_fields_from(row)
+                for row in Rating.objects.filter(product_id__in=[p.pk for p in products]).order_by()
+                .values('product_id').annotate(
+                    rating_count=Count('id'),
+                    rating_sum=Sum('score'),
+                    **{f'rating_{score}': Count('id', filter=Q(score=score)) for score in RATING_SCORES},
+                )
+            }
+            empty = rating_fields_from({name: 0 for name in fields if name != 'average_rating'})
+
+            changed = []
+            for product in products:
+                expected = aggregates.get(product.pk, empty)
+                if any(getattr(product, name) != value for name, value in expected.items()):
+                    for name, value in expected.items():
+                        setattr(product, name, value)
+                    changed.append(product)
+                    if check:
+                        self.stdout.write(f"drift: product {product.pk} ({product.name})")
+
+            checked += len(products)
+            drifted += len(changed)
+            if changed and not check:
+                with transaction.atomic():
+                    Product.objects.bulk_update(changed, fields)
+
+        elapsed = time.monotonic() - started
+        action = "found" if check else "fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{checked} products checked, {drifted} {action} in {elapsed:.1f}s"
+        ))
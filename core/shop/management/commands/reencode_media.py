@@ -0,0 +1,202 @@
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image as PilImage, ImageOps
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from shop.cache import invalidate_catalog
+from shop.images import build_variants, encoding_signature, source_hash, variant_name, webp_options
+
+logger = logging.getLogger(__name__)
+
+# Max width/height of re-encoded profile images.
+AVATAR_SIZE = 512
+
+# Settings copied from the main process into every worker.
+WORKER_SETTINGS = ('MEDIA_ROOT', 'IMAGE_WEBP_QUALITY', 'IMAGE_WEBP_METHOD')
+
+
+def _init_worker(overrides):
+    """
+    Worker processes are spawned fresh, so Django has to be set up in each,
+    with the media root and encoding settings of the main process. This module
+    must therefore not import models at import time.
+    Workers only touch files; all database writes happen in the main process.
+    """
+    import django
+    django.setup()
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+
+
+def _read(name):
+    with default_storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def _reencode_product_image(task):
+    """
+    Regenerates the variants of a product image unless its content and the
+    encoding settings are unchanged. Returns (pk, field values or None, status).
+    """
+    pk, name, stored_hash, signature = task
+    try:
+        data = _read(name)
+        if source_hash(data, signature) == stored_hash:
+            return pk, None, 'skipped'
+        return pk, build_variants(default_storage, name, data, signature), 'encoded'
+    except FileNotFoundError:
+        return pk, None, 'missing'
+    except Exception:
+        logger.exception("re-encoding of product image %s (%s) failed", pk, name)
+        return pk, None, 'failed'
+
+
+def _reencode_profile_image(task):
+    """
+    Encodes a WebP copy of a profile image, at most AVATAR_SIZE pixels,
+    next to the original, which is kept (as product image variants are), so
+    every re-encode starts from the original rather than from a lossy copy.
+    """
+    pk, name, stored_hash, signature = task
+    signature = f'{signature}:{AVATAR_SIZE}'
+    try:
+        data = _read(name)
+        if source_hash(data, signature) == stored_hash:
+            return pk, None, 'skipped'
+
+        with PilImage.open(io.BytesIO(data)) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            image.thumbnail((AVATAR_SIZE, AVATAR_SIZE), PilImage.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', **webp_options())
+        encoded = buffer.getvalue()
+
+        webp_name = variant_name(name, 'avatar')
+        default_storage.delete(webp_name)
+        webp_name = default_storage.save(webp_name, ContentFile(encoded))
+        return pk, {'image_webp': webp_name, 'image_hash': source_hash(data, signature)}, 'encoded'
+    except FileNotFoundError:
+        return pk, None, 'missing'
+    except Exception:
+        logger.exception("re-encoding of profile image %s (%s) failed", pk, name)
+        return pk, None, 'failed'
+
+
+# kind -> (model, file field, hash field, worker function)
+MEDIA_KINDS = {
+    'image': ('shop.Image', 'image_file', 'source_hash', _reencode_product_image),
+    'profile': ('account.Profile', 'image', 'image_hash', _reencode_profile_image),
+}
+
+
+class Command(BaseCommand):
+    """
+    Re-encodes every product image (regenerating its WebP variants) and every
+    profile image (its WebP copy) with the current encoding settings; the
+    uploaded originals are never changed.
+
+    Encoding runs on a process pool; files whose content and settings did not
+    change since the last run are skipped by hash. Database rows are updated
+    with bulk_update once per batch, and the last finished row of each kind is
+    written to a checkpoint file, so an interrupted run continues where it stopped.
+    """
+    help = "Re-encode product and profile images in parallel (resumable)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per database batch")
+        parser.add_argument('--only', choices=sorted(MEDIA_KINDS), help="Only process one kind of media")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.MEDIA_ROOT, '.reencode-checkpoint.json'),
+                            help="Checkpoint file used to resume an interrupted run")
+        parser.add_argument('--reset', action='store_true', help="Ignore the checkpoint and start from the beginning")
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint']
+        checkpoint = {} if options['reset'] else self.load_checkpoint(checkpoint_path)
+        kinds = [options['only']] if options['only'] else list(MEDIA_KINDS)
+        signature = encoding_signature()
+        workers = max(1, options['workers'])
+        overrides = {name: getattr(settings, name) for name in WORKER_SETTINGS if hasattr(settings, name)}
+        overrides['MEDIA_ROOT'] = str(settings.MEDIA_ROOT)
+
+        started = time.monotonic()
+        totals = Counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(overrides,)) as pool:
+            for kind in kinds:
+                model_name, file_field, hash_field, worker = MEDIA_KINDS[kind]
+                model = apps.get_model(model_name)
+                last_pk = checkpoint.get(kind, 0)
+                while True:
+                    rows = list(
+                        model.objects.filter(pk__gt=last_pk).exclude(**{f'{file_field}__isnull': True})
+                        .exclude(**{file_field: ''}).order_by('pk')
+                        .values_list('pk', file_field, hash_field)[:options['batch_size']]
+                    )
+                    if not rows:
+                        break
+
+                    tasks = [(pk, name, stored_hash, signature) for pk, name, stored_hash in rows]
+                    chunksize = max(1, len(tasks) // (workers * 4))
+                    changed, fields = [], set()
+                    for pk, values, status in pool.map(worker, tasks, chunksize=chunksize):
+                        totals[status] += 1
+                        if values:
+                            obj = model(pk=pk)
+                            for name, value in values.items():
+                                setattr(obj, name, value)
+                            changed.append(obj)
+                            fields.update(values)
+                    if changed:
+                        model.objects.bulk_update(changed, sorted(fields))
+
+                    last_pk = rows[-1][0]
+                    checkpoint[kind] = last_pk
+                    self.save_checkpoint(checkpoint_path, checkpoint)
+                    self.stdout.write(f"{kind}: up to #{last_pk}, {dict(totals)}")
+
+        # Rows were written with bulk_update (no signals); drop cached pages.
+        if totals['encoded']:
+            invalidate_catalog()
+
+        # Finished kinds start from scratch next time.
+        for kind in kinds:
+            checkpoint.pop(kind, None)
+        if checkpoint:
+            self.save_checkpoint(checkpoint_path, checkpoint)
+        elif os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.monotonic() - started
+        processed = sum(totals.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} files in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f}/s): "
+            + ', '.join(f"{count} {status}" for status, count in sorted(totals.items()))
+        ))
+
+    def load_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_checkpoint(self, path, checkpoint):
+        # write then rename, so an interrupted write never corrupts the checkpoint
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
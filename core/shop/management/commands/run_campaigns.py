@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from shop.catalog import catalog_changed
+from shop.models import Campaign, Product
+
+
+class Command(BaseCommand):
+    """
+    Applies the campaigns that are due and reverts the ones that ended or
+    were disabled. Meant to run every minute or so from cron.
+
+    Each campaign is applied or reverted with set-based UPDATEs that also
+    recompute `discounted_price` in SQL, so a site-wide sale costs the same
+    few statements as a sale on one product. Applying is idempotent: running
+    campaigns only touch products that joined their selection since the last
+    run. Campaigns are applied biggest discount first, and every run re-applies
+    running campaigns, so products of an ended campaign fall back to any other
+    campaign still covering them.
+    """
+    help = "Apply due discount campaigns and revert ended ones"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        now = timezone.now()
+        due = Q(is_active=True, starts_at__lte=now, ends_at__gt=now)
+        changed = 0
+
+        running = Exists(Product.objects.filter(campaign=OuterRef('pk')))
+        for campaign in Campaign.objects.filter(running).exclude(due):
+            count = campaign.revert()
+            changed += count
+            self.stdout.write(f"reverted {campaign}: {count} products")
+
+        for campaign in Campaign.objects.filter(due).select_related('category').order_by('-discount', 'pk'):
+            count = campaign.apply()
+            changed += count
+            if count:
+                self.stdout.write(f"applied {campaign}: {count} products")
+
+        if changed:
+            catalog_changed()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"{changed} products updated in {elapsed:.1f}s"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.leaderboards import WINDOWS, prune_buckets, refresh_leaderboards
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the cached trending and best-seller leaderboards from the hourly
+    buckets and deletes buckets older than the longest window. Meant to run
+    every few minutes from cron.
+    """
+    help = "Rebuild the trending and best-seller leaderboards"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        pruned = prune_buckets()
+        leaderboards = refresh_leaderboards()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(leaderboards.boards)} leaderboards over {', '.join(WINDOWS)} built, "
+            f"{pruned} old buckets deleted in {elapsed:.1f}s"
+        ))
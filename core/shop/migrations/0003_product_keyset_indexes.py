@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_category_slug'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'created_at', 'id'], name='shop_produc_name_ccfea8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-discount', 'id'], name='shop_produc_discoun_54a715_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailyView',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='views')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='shop.product', verbose_name='product')),
+            ],
+            options={
+                'verbose_name': 'daily view',
+                'verbose_name_plural': 'daily views',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date'], name='shop_produc_date_cc2400_idx')],
+                'unique_together': {('product', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    GIN indexes for the search document and the trigram name search.
+    These only exist on PostgreSQL; other databases use the fallback search.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS shop_product_search_vector_gin '
+        'ON shop_product USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS shop_product_name_trgm_gin '
+        'ON shop_product USING gin (name gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        "UPDATE shop_product SET search_vector = "
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(brand, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS shop_product_search_vector_gin')
+    schema_editor.execute('DROP INDEX IF EXISTS shop_product_name_trgm_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_productdailyview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='search vector'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
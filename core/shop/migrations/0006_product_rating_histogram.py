@@ -0,0 +1,66 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:12
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    """
+    Fills rating_sum and the histogram of products that already have ratings.
+    """
+    Product = apps.get_model('shop', 'Product')
+    Rating = apps.get_model('shop', 'Rating')
+    rows = Rating.objects.order_by().values('product_id').annotate(
+        total=Sum('score'),
+        **{f'rating_{score}': Count('id', filter=Q(score=score)) for score in range(1, 6)},
+    )
+    products = []
+    for row in rows:
+        product = Product(pk=row['product_id'], rating_sum=row['total'])
+        for score in range(1, 6):
+            setattr(product, f'rating_{score}', row[f'rating_{score}'])
+        products.append(product)
+    Product.objects.bulk_update(
+        products, ['rating_sum'] + [f'rating_{score}' for score in range(1, 6)], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, verbose_name='1 star ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, verbose_name='2 star ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, verbose_name='3 star ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, verbose_name='4 star ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, verbose_name='5 star ratings'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='rating sum'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
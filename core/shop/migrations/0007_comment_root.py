@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_comment_roots(apps, schema_editor):
+    """
+    Sets the thread root of existing replies by walking up their parents.
+    """
+    Comment = apps.get_model('shop', 'Comment')
+    parents = dict(Comment.objects.filter(parent__isnull=False).values_list('id', 'parent_id'))
+
+    def find_root(comment_id):
+        while comment_id in parents:
+            comment_id = parents[comment_id]
+        return comment_id
+
+    replies = [Comment(pk=comment_id, root_id=find_root(comment_id)) for comment_id in parents]
+    Comment.objects.bulk_update(replies, ['root'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_product_rating_histogram'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='shop.comment', verbose_name='thread root'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product', 'parent', '-created', '-id'], name='shop_commen_product_2e9baf_idx'),
+        ),
+        migrations.RunPython(backfill_comment_roots, migrations.RunPython.noop),
+    ]
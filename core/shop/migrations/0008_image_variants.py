@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_comment_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='full_file',
+            field=models.ImageField(blank=True, editable=False, upload_to='', verbose_name='full size image'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='medium_file',
+            field=models.ImageField(blank=True, editable=False, upload_to='', verbose_name='medium image'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail_file',
+            field=models.ImageField(blank=True, editable=False, upload_to='', verbose_name='thumbnail'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image_file',
+            field=models.ImageField(upload_to='products_images', verbose_name='image'),
+        ),
+    ]
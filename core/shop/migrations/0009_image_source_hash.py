@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='source hash'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:24
+
+import django.db.models.deletion
+import mptt.fields
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def backfill_category_tree(apps, schema_editor):
+    """
+    Existing categories become root nodes (one tree each, ordered by name)
+    and get their product count and price range.
+    """
+    Category = apps.get_model('shop', 'Category')
+    Product = apps.get_model('shop', 'Product')
+    stats = {
+        row.pop('category_id'): row
+        for row in Product.objects.order_by().values('category_id').annotate(
+            product_count=Count('id'), min_price=Min('discounted_price'), max_price=Max('discounted_price'),
+        )
+    }
+    categories = list(Category.objects.order_by('name', 'id'))
+    for tree_id, category in enumerate(categories, start=1):
+        category.tree_id, category.lft, category.rght, category.level = tree_id, 1, 2, 0
+        for name, value in stats.get(category.pk, {}).items():
+            setattr(category, name, value)
+    Category.objects.bulk_update(
+        categories, ['tree_id', 'lft', 'rght', 'level', 'product_count', 'min_price', 'max_price'], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_image_source_hash'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'category', 'verbose_name_plural': 'categories'},
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='level',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='lft',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='max_price',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='max price'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='min_price',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='min price'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='shop.category', verbose_name='parent category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='product count'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='rght',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='tree_id',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_category_tree, migrations.RunPython.noop),
+    ]
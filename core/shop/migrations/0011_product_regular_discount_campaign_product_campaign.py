@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:40
+
+import django.core.validators
+import django.db.models.deletion
+import mptt.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_category_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='regular_discount',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, verbose_name='discount outside the campaign (%)'),
+        ),
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='name')),
+                ('discount', models.PositiveSmallIntegerField(help_text='Discount percent must be between 1 and 100.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)], verbose_name='discount (%)')),
+                ('brand', models.CharField(blank=True, max_length=250, null=True, verbose_name='brand')),
+                ('starts_at', models.DateTimeField(verbose_name='starts at')),
+                ('ends_at', models.DateTimeField(verbose_name='ends at')),
+                ('is_active', models.BooleanField(default=True, help_text='Uncheck to end the campaign early.', verbose_name='active')),
+                ('category', mptt.fields.TreeForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='campaigns', to='shop.category', verbose_name='category')),
+                ('products', models.ManyToManyField(blank=True, related_name='campaigns', to='shop.product', verbose_name='products')),
+            ],
+            options={
+                'verbose_name': 'campaign',
+                'verbose_name_plural': 'campaigns',
+                'ordering': ['-starts_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='campaign',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='discounted_products', to='shop.campaign', verbose_name='campaign'),
+        ),
+    ]
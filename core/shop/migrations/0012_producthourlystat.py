@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_regular_discount_campaign_product_campaign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductHourlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='hour')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='views')),
+                ('sales', models.PositiveIntegerField(default=0, verbose_name='units sold')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_stats', to='shop.product', verbose_name='product')),
+            ],
+            options={
+                'verbose_name': 'hourly stat',
+                'verbose_name_plural': 'hourly stats',
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['hour'], name='shop_produc_hour_b4540c_idx')],
+                'unique_together': {('product', 'hour')},
+            },
+        ),
+    ]
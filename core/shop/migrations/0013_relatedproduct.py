@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_producthourlystat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('similar', 'similar content')], default='similar', max_length=20, verbose_name='kind')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='rank')),
+                ('score', models.FloatField(verbose_name='score')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_products', to='shop.product', verbose_name='product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='shop.product', verbose_name='related product')),
+            ],
+            options={
+                'verbose_name': 'related product',
+                'verbose_name_plural': 'related products',
+                'ordering': ['product', 'kind', 'rank'],
+                'indexes': [models.Index(fields=['product', 'kind', 'rank'], name='shop_relate_product_cf0549_idx')],
+                'unique_together': {('product', 'kind', 'related')},
+            },
+        ),
+    ]
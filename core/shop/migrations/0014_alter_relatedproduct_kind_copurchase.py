@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='relatedproduct',
+            name='kind',
+            field=models.CharField(choices=[('similar', 'similar content'), ('bought_together', 'frequently bought together')], default='similar', max_length=20, verbose_name='kind'),
+        ),
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='orders')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='other product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='product')),
+            ],
+            options={
+                'verbose_name': 'co-purchase',
+                'verbose_name_plural': 'co-purchases',
+                'indexes': [models.Index(fields=['other'], name='shop_copurc_other_i_d62edc_idx')],
+                'unique_together': {('product', 'other')},
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+VARIANTS = ('thumbnail', 'medium', 'full')
+
+
+def backfill_variant_widths(apps, schema_editor):
+    """
+    Reads the widths of variants generated before widths were stored (only
+    the image header is read).
+    """
+    from PIL import Image as PilImage
+
+    Image = apps.get_model('shop', 'Image')
+    images = []
+    rows = Image.objects.exclude(thumbnail_file='').only(*[f'{variant}_file' for variant in VARIANTS])
+    for image in rows.iterator():
+        for variant in VARIANTS:
+            field_file = getattr(image, f'{variant}_file')
+            if not field_file:
+                continue
+            try:
+                with field_file.storage.open(field_file.name, 'rb') as f, PilImage.open(f) as variant_image:
+                    setattr(image, f'{variant}_width', variant_image.width)
+            except (OSError, ValueError):
+                pass
+        images.append(image)
+    Image.objects.bulk_update(images, [f'{variant}_width' for variant in VARIANTS], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_alter_relatedproduct_kind_copurchase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='full_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='full size image width'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='medium_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='medium image width'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='thumbnail width'),
+        ),
+        migrations.RunPython(backfill_variant_widths, migrations.RunPython.noop),
+    ]
@@ -1,26 +1,85 @@
-import os
-from PIL import Image as PilImage
+from decimal import Decimal
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models import Avg, Count
+from django.db import models, transaction
+from django.db.models import Count, Prefetch, OuterRef, Subquery, Value, F, FloatField, Q, Sum, Case, When
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.lookups import GreaterThan
 from django.urls import reverse
+from django.utils import timezone
 from django_jalali.db import models as jmodels
 from django.utils.text import slugify
-from django_resized import ResizedImageField
+from mptt.models import MPTTModel, TreeForeignKey
 from account.models import ShopUser
+from shop.images import IMAGE_VARIANTS, enqueue_image
 
 
-class Category(models.Model):
+class Category(MPTTModel):
     """
-    Category model for classifying products.
+    Category model for classifying products, organized as a tree.
+    Product count and price range of each category (its subcategories included)
+    are denormalized by shop.categories, so menus never aggregate products.
     """
     name = models.CharField(max_length=100, verbose_name='name')
     slug = models.SlugField(max_length=100, unique=True, verbose_name='slug')
+    parent = TreeForeignKey('self', on_delete=models.CASCADE, related_name='children', null=True, blank=True,
+                            verbose_name='parent category')
     created = models.DateTimeField(auto_now_add=True, verbose_name='created at')
 
+    # denormalized over the whole subtree, see shop.categories.update_category_stats
+    product_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='product count')
+    min_price = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='min price')
+    max_price = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='max price')
+
+    class MPTTMeta:
+        order_insertion_by = ['name']
+
+    class Meta:
+        verbose_name = 'category'
+        verbose_name_plural = 'categories'
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the parent the category was loaded with, so moving it
+        updates the stats of its old ancestors too (see shop.signals).
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def get_absolute_url(self):
+        """
+        Returns the URL of the category's product listing.
+        """
+        return reverse('shop:products_by_category', kwargs={'category_slug': self.slug})
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Custom queryset for Product with helpers for common page shapes.
+    """
+
+    def for_listing(self):
+        """
+        Loads everything a product card needs in a constant number of queries:
+        the category is joined, comments are counted with a correlated subquery
+        (no GROUP BY over the product row) and the images of all products on
+        the page are fetched in a single prefetch query.
+        """
+        comments_count = Comment.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(
+            count=Count('id')
+        ).values('count')
+        return self.select_related('category').annotate(
+            comments_count=Coalesce(Subquery(comments_count), Value(0)),
+        ).prefetch_related(
+            Prefetch('images', queryset=Image.objects.order_by('created', 'id'), to_attr='listing_images'),
+        )
+
 
 class Product(models.Model):
     """
@@ -43,14 +102,30 @@ class Product(models.Model):
         verbose_name='discount (%)'
     )
     discounted_price = models.PositiveIntegerField(default=0, verbose_name='price after discount', null=True, blank=True)
+    # set while a campaign's discount replaces the product's own, see `Campaign.apply`
+    campaign = models.ForeignKey('Campaign', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+                                 related_name='discounted_products', verbose_name='campaign')
+    regular_discount = models.PositiveSmallIntegerField(null=True, blank=True, editable=False,
+                                                        verbose_name='discount outside the campaign (%)')
     created_at = jmodels.jDateTimeField(auto_now_add=True, verbose_name='created at')
     updated_at = jmodels.jDateTimeField(auto_now=True, verbose_name='updated at')
     views = models.PositiveIntegerField(default=0, verbose_name='views')
     sold_count = models.PositiveIntegerField(default=0, verbose_name='sold count')
 
-    # product rating
+    # product rating (maintained incrementally, see `apply_rating_change`)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, verbose_name='average rating')
     rating_count = models.PositiveIntegerField(default=0, verbose_name='rating count')
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name='rating sum')
+    rating_1 = models.PositiveIntegerField(default=0, verbose_name='1 star ratings')
+    rating_2 = models.PositiveIntegerField(default=0, verbose_name='2 star ratings')
+    rating_3 = models.PositiveIntegerField(default=0, verbose_name='3 star ratings')
+    rating_4 = models.PositiveIntegerField(default=0, verbose_name='4 star ratings')
+    rating_5 = models.PositiveIntegerField(default=0, verbose_name='5 star ratings')
+
+    # search document, maintained by shop.search on PostgreSQL (GIN indexed)
+    search_vector = SearchVectorField(null=True, editable=False, verbose_name='search vector')
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ('name', 'created_at')
@@ -58,6 +133,9 @@ class Product(models.Model):
             models.Index(fields=['name']),
             models.Index(fields=['slug']),
             models.Index(fields=['created_at']),
+            # keyset pagination of the catalog listings (see shop.pagination)
+            models.Index(fields=['name', 'created_at', 'id']),
+            models.Index(fields=['-discount', 'id']),
         ]
         verbose_name = 'product'
         verbose_name_plural = 'products'
@@ -71,26 +149,153 @@ class Product(models.Model):
         """
         return reverse('shop:product_detail', kwargs={'slug': self.slug})
 
+    @property
+    def primary_image(self):
+        """
+        Returns the first image of the product.
+        Uses the images prefetched by `ProductQuerySet.for_listing` when available,
+        so rendering a list of cards does not issue a query per product.
+        """
+        if hasattr(self, 'listing_images'):
+            return self.listing_images[0] if self.listing_images else None
+        return self.images.first()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the category the product was loaded with, so moving a product
+        updates the stats of both categories, and the fields the autocomplete
+        index is labelled by, so saves that keep them skip re-announcing it (see shop.signals).
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        instance._loaded_discount = instance.__dict__.get('discount')
+        instance._loaded_autocomplete_label = autocomplete_label(instance.__dict__)
+        return instance
+
+    @property
+    def cache_version(self):
+        """
+        Version of what a product card shows, used in its fragment cache key.
+        Ratings and image processing update the row without touching
+        `updated_at`, so the rating and the primary image are included.
+        """
+        image = self.primary_image
+        image_version = f'{image.pk}.{image.thumbnail_file.name}' if image else ''
+        return f'{self.updated_at.timestamp()}-{self.rating_count}-{self.average_rating}-{image_version}'
+
     def save(self, *args, **kwargs):
         """
         Automatically generates a slug and calculates discounted price before saving.
+        A discount set while the product is in a campaign becomes its own
+        (`regular_discount`), restored when the campaign ends.
         """
         if not self.slug:
             self.slug = slugify(self.name, allow_unicode=True)
+        loaded_discount = getattr(self, '_loaded_discount', None)
+        if self.campaign_id and loaded_discount is not None and self.discount != loaded_discount:
+            self.regular_discount, self.discount = self.discount, loaded_discount
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'regular_discount'}
         if self.discount:
             self.discounted_price = int(self.original_price * (100 - self.discount) / 100)
         else:
             self.discounted_price = self.original_price
         super().save(*args, **kwargs)
+        self._loaded_discount = self.discount
+
+    @property
+    def rating_histogram(self):
+        """
+        Returns the number of ratings per score as a {score: count} dict.
+        """
+        return {score: getattr(self, f'rating_{score}') for score in RATING_SCORES}
+
+    def apply_rating_change(self, old_score=None, new_score=None):
+        """
+        Updates the rating aggregates for one rating being created (old_score=None),
+        changed, or deleted (new_score=None), in a single atomic UPDATE of
+        expressions. Costs O(1) regardless of how many ratings the product has.
+        """
+        if old_score == new_score:
+            return
+        count_delta = (new_score is not None) - (old_score is not None)
+        sum_delta = (new_score or 0) - (old_score or 0)
+
+        updates = {
+            'rating_count': F('rating_count') + count_delta,
+            'rating_sum': F('rating_sum') + sum_delta,
+            # every expression in an UPDATE sees the old row, so apply the deltas here too
+            'average_rating': Cast(Coalesce(
+                Cast(F('rating_sum') + sum_delta, FloatField()) / NullIf(F('rating_count') + count_delta, 0),
+                Value(0.0),
+            ), models.DecimalField(max_digits=3, decimal_places=2)),
+        }
+        if old_score is not None:
+            updates[f'rating_{old_score}'] = F(f'rating_{old_score}') - 1
+        if new_score is not None:
+            updates[f'rating_{new_score}'] = F(f'rating_{new_score}') + 1
+        Product.objects.filter(pk=self.pk).update(**updates)
 
     def update_rating(self):
         """
-        Updates product's average rating and count based on related ratings.
+        Recomputes product's rating aggregates from all of its ratings.
+        Used to repair drift; regular votes go through `apply_rating_change`.
         """
-        agg = self.ratings.aggregate(avg=Avg('score'), count=Count('id'))
-        self.average_rating = agg['avg'] or 0
-        self.rating_count = agg['count'] or 0
-        self.save(update_fields=['average_rating', 'rating_count'])
+        aggregates = rating_aggregates(self.ratings.all())
+        for name, value in aggregates.items():
+            setattr(self, name, value)
+        self.save(update_fields=list(aggregates))
+
+
+def autocomplete_label(values):
+    """
+    The product values its autocomplete suggestion and grouping are built from.
+    """
+    return tuple(values.get(name) for name in ('name', 'slug', 'brand', 'category_id'))
+
+
+def discounted_price_expression(discount=F('discount')):
+    """
+    SQL version of the discount rule in `Product.save`, for updating many
+    products with a single UPDATE (bulk imports, campaigns).
+    `discount` is the discount the products will have after the UPDATE;
+    every expression of an UPDATE sees the old row, so a statement that
+    changes `discount` passes the new value here.
+    """
+    if not hasattr(discount, 'resolve_expression'):
+        discount = Value(discount)
+    return Case(
+        When(GreaterThan(discount, 0), then=F('original_price') * (100 - discount) / 100),
+        default=F('original_price'),
+        output_field=models.PositiveIntegerField(),
+    )
+
+
+RATING_SCORES = range(1, 6)
+
+
+def rating_aggregates(ratings):
+    """
+    Aggregates a Rating queryset into the Product rating fields
+    (count, sum, average and histogram) with a single query.
+    """
+    agg = ratings.aggregate(
+        rating_count=Count('id'),
+        rating_sum=Sum('score'),
+        **{f'rating_{score}': Count('id', filter=Q(score=score)) for score in RATING_SCORES},
+    )
+    return rating_fields_from(agg)
+
+
+def rating_fields_from(agg):
+    """
+    Builds the Product rating field values from aggregated count/sum/histogram values.
+    """
+    fields = {name: value or 0 for name, value in agg.items() if name.startswith('rating_')}
+    count, total = fields['rating_count'], fields['rating_sum']
+    fields['average_rating'] = (Decimal(total) / count).quantize(Decimal('0.01')) if count else Decimal('0.00')
+    return fields
 
 
 class ProductFeature(models.Model):
@@ -113,14 +318,28 @@ class ProductFeature(models.Model):
 
 class Image(models.Model):
     """
-    Stores product images and automatically converts them to WebP format.
+    Stores product images. The uploaded original is kept as is; WebP variants
+    of several sizes are generated in the background (see shop.images).
     """
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images', verbose_name='product')
-    image_file = ResizedImageField(upload_to='products_images', quality=80, verbose_name='image')
+    image_file = models.ImageField(upload_to='products_images', verbose_name='image')
     title = models.CharField(max_length=100, verbose_name='title')
     description = models.TextField(verbose_name='description')
     created = jmodels.jDateTimeField(auto_now_add=True, verbose_name='created at')
 
+    # WebP variants, filled by the background image processing
+    thumbnail_file = models.ImageField(blank=True, editable=False, verbose_name='thumbnail')
+    medium_file = models.ImageField(blank=True, editable=False, verbose_name='medium image')
+    full_file = models.ImageField(blank=True, editable=False, verbose_name='full size image')
+    # real widths of the variants (smaller than their nominal size when the original is)
+    thumbnail_width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='thumbnail width')
+    medium_width = models.PositiveIntegerField(null=True, blank=True, editable=False,
+                                               verbose_name='medium image width')
+    full_width = models.PositiveIntegerField(null=True, blank=True, editable=False,
+                                             verbose_name='full size image width')
+    # hash of the original and the encoding settings the variants were built with
+    source_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name='source hash')
+
     class Meta:
         verbose_name = "image"
         verbose_name_plural = "images"
@@ -130,36 +349,70 @@ class Image(models.Model):
     def __str__(self):
         return self.title or "Untitled"
 
-    def save(self, *args, **kwargs):
+    @classmethod
+    def from_db(cls, db, field_names, values):
         """
-        Saves the image and converts it to optimized WebP format.
+        Remembers the stored file name, so saving only reprocesses new uploads.
         """
-        super().save(*args, **kwargs)  # First, save normally
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image_name = instance.__dict__.get('image_file')
+        return instance
 
-        image_path = self.image_file.path
+    def save(self, *args, **kwargs):
+        """
+        Saves the image and queues generation of its WebP variants
+        when a new file was uploaded. Does no image encoding itself.
+        """
+        super().save(*args, **kwargs)
+        if self.image_file and self.image_file.name != getattr(self, '_loaded_image_name', None):
+            self._loaded_image_name = self.image_file.name
+            enqueue_image(self.pk)
 
-        # Open and convert to WebP
-        img = PilImage.open(image_path)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the original and variant files from storage when the model is deleted.
+        """
+        for field_file in (self.image_file, self.thumbnail_file, self.medium_file, self.full_file):
+            if field_file:
+                field_file.storage.delete(field_file.name)
+        super().delete(*args, **kwargs)
 
-        webp_path = os.path.splitext(image_path)[0] + ".webp"
-        img.save(webp_path, "WEBP", quality=70, optimize=True, method=6)
+    @property
+    def variants(self):
+        """
+        Returns (variant file, width) pairs of the generated variants, smallest
+        first, with the real width of each stored file.
+        """
+        return [
+            (getattr(self, f'{variant}_file'), getattr(self, f'{variant}_width'))
+            for variant in IMAGE_VARIANTS
+            if getattr(self, f'{variant}_file') and getattr(self, f'{variant}_width')
+        ]
 
-        # Replace the original file with the WebP one
-        os.remove(image_path)
-        self.image_file.name = os.path.splitext(self.image_file.name)[0] + ".webp"
+    @property
+    def thumbnail_url(self):
+        """
+        URL for product cards: the thumbnail, or the original until it is processed.
+        """
+        return (self.thumbnail_file or self.image_file).url
 
-        # Update the image file path
-        super().save(update_fields=["image_file"])
+    @property
+    def display_url(self):
+        """
+        URL for the product page: the full size WebP, or the original until it is processed.
+        """
+        return (self.full_file or self.image_file).url
 
-    def delete(self, *args, **kwargs):
+    @property
+    def srcset(self):
         """
-        Deletes the image file from storage when the model is deleted.
+        `srcset` attribute value listing every generated variant with its width.
+        Variants of a small original share its width; only the first of them is listed.
         """
-        storage, path = self.image_file.storage, self.image_file.path
-        storage.delete(path)
-        super().delete(*args, **kwargs)
+        candidates = {}
+        for field_file, width in self.variants:
+            candidates.setdefault(width, field_file.url)
+        return ', '.join(f'{url} {width}w' for width, url in candidates.items())
 
 
 class Comment(models.Model):
@@ -171,16 +424,30 @@ class Comment(models.Model):
     body = models.TextField(verbose_name="comment body")
     created = jmodels.jDateTimeField(auto_now_add=True, verbose_name='created at')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='replies', null=True, blank=True, verbose_name='parent comment')
+    # top-level comment of the thread (null for top-level comments), lets a whole thread load in one query
+    root = models.ForeignKey('self', on_delete=models.CASCADE, related_name='thread_replies', null=True, blank=True,
+                             editable=False, verbose_name='thread root')
 
     class Meta:
         verbose_name = "comment"
         verbose_name_plural = "comments"
         ordering = ['-created']
-        indexes = [models.Index(fields=['created'])]
+        indexes = [
+            models.Index(fields=['created']),
+            models.Index(fields=['product', 'parent', '-created', '-id']),
+        ]
 
     def __str__(self):
         return f"{self.user} — {self.product}"
 
+    def save(self, *args, **kwargs):
+        """
+        Sets the thread root of replies before saving.
+        """
+        if self.parent_id and not self.root_id:
+            self.root_id = self.parent.root_id or self.parent_id
+        super().save(*args, **kwargs)
+
 
 class Rating(models.Model):
     """
@@ -192,6 +459,16 @@ class Rating(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name='created at')
     updated = models.DateTimeField(auto_now=True, verbose_name='updated at')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the score the rating was loaded with, so saving a changed score
+        can update the product aggregates incrementally (see shop.signals).
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_score = instance.__dict__.get('score')
+        return instance
+
     class Meta:
         verbose_name = "rating"
         verbose_name_plural = "ratings"
@@ -200,3 +477,191 @@ class Rating(models.Model):
 
     def __str__(self):
         return f'{self.product} — {self.user} — {self.score}'
+
+
+class ProductDailyView(models.Model):
+    """
+    Per-day view counts of a product, filled by the buffered view counter
+    (see shop.counters) for analytics.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_views', verbose_name='product')
+    date = models.DateField(verbose_name='date')
+    views = models.PositiveIntegerField(default=0, verbose_name='views')
+
+    class Meta:
+        verbose_name = "daily view"
+        verbose_name_plural = "daily views"
+        ordering = ['-date']
+        unique_together = ('product', 'date')
+        indexes = [models.Index(fields=['date'])]
+
+    def __str__(self):
+        return f'{self.product} — {self.date} — {self.views}'
+
+
+
+class ProductHourlyStat(models.Model):
+    """
+    Views and units sold of a product per hour, the counters the rolling
+    leaderboards are summed from (see shop.leaderboards). Views are written
+    by the buffered view counter, sales when order items are created.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='hourly_stats', verbose_name='product')
+    hour = models.DateTimeField(verbose_name='hour')
+    views = models.PositiveIntegerField(default=0, verbose_name='views')
+    sales = models.PositiveIntegerField(default=0, verbose_name='units sold')
+
+    class Meta:
+        verbose_name = "hourly stat"
+        verbose_name_plural = "hourly stats"
+        ordering = ['-hour']
+        unique_together = ('product', 'hour')
+        indexes = [models.Index(fields=['hour'])]
+
+    def __str__(self):
+        return f'{self.product} — {self.hour:%Y-%m-%d %H}:00 — {self.views} views, {self.sales} sold'
+
+
+
+class RelatedProduct(models.Model):
+    """
+    A precomputed neighbour of a product, listed on the product page.
+    Rows are rebuilt offline (see shop.recommendations), so the page reads
+    its related products with one indexed lookup.
+    """
+    SIMILAR = 'similar'
+    BOUGHT_TOGETHER = 'bought_together'
+    KIND_CHOICES = [
+        (SIMILAR, 'similar content'),
+        (BOUGHT_TOGETHER, 'frequently bought together'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_products',
+                                verbose_name='product')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_to',
+                                verbose_name='related product')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=SIMILAR, verbose_name='kind')
+    rank = models.PositiveSmallIntegerField(verbose_name='rank')
+    score = models.FloatField(verbose_name='score')
+
+    class Meta:
+        verbose_name = "related product"
+        verbose_name_plural = "related products"
+        ordering = ['product', 'kind', 'rank']
+        unique_together = ('product', 'kind', 'related')
+        indexes = [models.Index(fields=['product', 'kind', 'rank'])]
+
+    def __str__(self):
+        return f'{self.product} → {self.related} ({self.kind}, {self.score:.3f})'
+
+
+class CoPurchase(models.Model):
+    """
+    Number of paid orders containing both products, one row per pair with
+    `product_id <= other_id`: the sparse co-occurrence matrix the "bought
+    together" recommendations are scored from. The diagonal rows
+    (`product == other`) count the orders containing the product.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='product')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='other product')
+    orders = models.PositiveIntegerField(default=0, verbose_name='orders')
+
+    class Meta:
+        verbose_name = "co-purchase"
+        verbose_name_plural = "co-purchases"
+        unique_together = ('product', 'other')
+        indexes = [models.Index(fields=['other'])]
+
+    def __str__(self):
+        return f'{self.product_id} + {self.other_id}: {self.orders}'
+
+
+class Campaign(models.Model):
+    """
+    A percentage off for a set of products during a time window.
+
+    Products are selected by category (subcategories included), brand and an
+    explicit product set; the criteria that are filled in must all match, and
+    a campaign without any covers the whole catalog. Campaigns are switched
+    on and off by the `run_campaigns` command, each with a single UPDATE no
+    matter how many products it covers. When campaigns overlap, a product
+    gets the biggest discount.
+    """
+    name = models.CharField(max_length=100, verbose_name='name')
+    discount = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="Discount percent must be between 1 and 100.",
+        verbose_name='discount (%)'
+    )
+    category = TreeForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='campaigns',
+                              verbose_name='category')
+    brand = models.CharField(max_length=250, blank=True, null=True, verbose_name='brand')
+    products = models.ManyToManyField(Product, blank=True, related_name='campaigns', verbose_name='products')
+    starts_at = models.DateTimeField(verbose_name='starts at')
+    ends_at = models.DateTimeField(verbose_name='ends at')
+    is_active = models.BooleanField(default=True, help_text="Uncheck to end the campaign early.",
+                                    verbose_name='active')
+
+    class Meta:
+        verbose_name = 'campaign'
+        verbose_name_plural = 'campaigns'
+        ordering = ['-starts_at']
+
+    def __str__(self):
+        return f'{self.name} ({self.discount}%)'
+
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': "A campaign must end after it starts."})
+
+    def target_products(self):
+        """
+        Products covered by the campaign, as a queryset (no query is run).
+        """
+        products = Product.objects.all()
+        if self.category_id:
+            products = products.filter(category__in=self.category.get_descendants(include_self=True))
+        if self.brand:
+            products = products.filter(brand=self.brand)
+        if self.pk and self.products.exists():
+            products = products.filter(pk__in=self.products.values('pk'))
+        return products
+
+    def apply(self):
+        """
+        Gives the target products the campaign's discount with one UPDATE,
+        skipping those already in a campaign with a bigger discount, and
+        reverts products the campaign no longer covers. The products' own
+        discount is kept in `regular_discount`. Returns the number of
+        products changed.
+        """
+        targets = self.target_products()
+        with transaction.atomic():
+            changed = self.revert(self.discounted_products.exclude(pk__in=targets.values('pk')))
+            changed += targets.filter(
+                Q(campaign=None) | Q(campaign=self) & ~Q(discount=self.discount)
+                | Q(campaign__discount__lt=self.discount)
+            ).update(
+                campaign=self,
+                # a product taken over from another campaign keeps its saved discount
+                regular_discount=Case(When(campaign=None, then=F('discount')), default=F('regular_discount')),
+                discount=self.discount,
+                discounted_price=discounted_price_expression(self.discount),
+                updated_at=timezone.now(),
+            )
+        return changed
+
+    def revert(self, products=None):
+        """
+        Restores the products' own discount (all the campaign's products by
+        default) with one UPDATE. Returns the number of products changed.
+        """
+        if products is None:
+            products = self.discounted_products.all()
+        return products.update(
+            campaign=None,
+            discount=F('regular_discount'),
+            regular_discount=None,
+            discounted_price=discounted_price_expression(F('regular_discount')),
+            updated_at=timezone.now(),
+        )
@@ -0,0 +1,135 @@
+"""
+Keyset (cursor) pagination for catalog listings.
+
+Django's Paginator runs a COUNT(*) on every request and uses OFFSET, which
+gets slower the deeper a user scrolls. KeysetPaginator instead remembers the
+ordering values of the last row it returned (the cursor) and asks for the rows
+that come after it, so every page is a single indexed range scan.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
+
+
+class KeysetPage:
+    """
+    One page of results returned by `KeysetPaginator`.
+    Behaves like a list of objects and exposes the cursor of the next page.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by the values of its ordering fields.
+
+    `ordering` must be a total order over non-null concrete fields of the
+    model, e.g. ('name', 'created_at', 'id'). Prefix a field with '-' for
+    descending order. The last field should be unique (usually 'id') so
+    ties never skip or repeat rows.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [
+            (queryset.model._meta.get_field(name.lstrip('-')), name.startswith('-'))
+            for name in self.ordering
+        ]
+
+    def get_page(self, cursor=None):
+        """
+        Returns the page that starts after `cursor`.
+        An empty or invalid cursor returns the first page.
+        """
+        queryset = self.queryset.order_by(*self.ordering)
+        values = self.decode_cursor(cursor) if cursor else None
+        if values is not None:
+            queryset = queryset.filter(self._after(values))
+
+        # Fetch one extra row to know whether there is a next page, without counting.
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        return KeysetPage(rows, next_cursor)
+
+    def _after(self, values):
+        """
+        Builds the row-value comparison "ordering columns come after `values`":
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        """
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.fields, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field.attname}__{lookup}': value})
+            equal &= Q(**{field.attname: value})
+        return condition
+
+    def encode_cursor(self, obj):
+        """
+        Serializes the ordering values of `obj` into an opaque, URL-safe string.
+        """
+        values = []
+        for field, _ in self.fields:
+            value = getattr(obj, field.attname)
+            if hasattr(value, 'togregorian'):
+                value = value.togregorian()
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.isoformat()
+            values.append(value)
+        data = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Parses a cursor produced by `encode_cursor`.
+        Returns None when the cursor is malformed.
+        """
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data)
+        except (ValueError, binascii.Error):
+            return None
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+
+        decoded = []
+        for (field, _), value in zip(self.fields, values):
+            if value is None:
+                return None
+            try:
+                if isinstance(field, models.DateTimeField):
+                    value = datetime.datetime.fromisoformat(value)
+                elif isinstance(field, models.DateField):
+                    value = datetime.date.fromisoformat(value)
+                else:
+                    value = field.to_python(value)
+            except (TypeError, ValueError, ValidationError):
+                return None
+            decoded.append(value)
+        return decoded
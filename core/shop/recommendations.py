@@ -0,0 +1,336 @@
+"""
+Precomputed related products.
+
+Content similarity: every product becomes a sparse TF-IDF vector of the
+words of its name, brand, description and feature values (name words weigh
+more), plus its brand and category as whole terms. Vectors are L2
+normalized, so the cosine similarity of two products is the dot product of
+their vectors. Neighbours are scored through an inverted index
+(term -> [(product, weight)]): for each product only the products sharing a
+term are touched, which is the sparse matrix product of the product's row
+with the whole matrix, never the dense product x product matrix.
+
+Terms found in a single product cannot relate two products and terms found
+in most products relate everything, so both are dropped; the posting lists
+of the remaining common terms keep only their heaviest entries.
+
+Co-purchases: the number of paid orders containing each pair of products
+is kept in CoPurchase, a sparse co-occurrence matrix. `count_co_purchases`
+adds the orders paid since the last run (each order is flagged once it is
+counted, so orders paid late are not missed) and the neighbours of the
+products in those orders are rescored by Jaccard similarity:
+orders(a and b) / orders(a or b).
+
+The top N neighbours of each product are stored as RelatedProduct rows,
+replaced batch by batch by the `build_related_products` and
+`build_bought_together` commands.
+"""
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F, Max, Q, Window
+from django.db.models.functions import RowNumber
+
+from shop.autocomplete import normalize
+from shop.cache import CATALOG_VERSION_KEY, get_version, invalidate_catalog, single_flight
+from order.models import Order, OrderItem
+from shop.models import CoPurchase, Product, ProductFeature, RelatedProduct
+
+# Neighbours stored per product.
+RELATED_PRODUCTS_COUNT = 10
+
+# Products whose neighbours are written per transaction.
+BATCH_SIZE = 1000
+
+# Term weight per field, before TF-IDF.
+FIELD_WEIGHTS = {'name': 3, 'brand': 2, 'feature': 2, 'category': 2, 'description': 1}
+
+# Terms found in a larger share of the products are ignored.
+MAX_DOCUMENT_FREQUENCY = 0.8
+
+# Entries kept per posting list, heaviest first.
+POSTINGS_LIMIT = 1000
+
+TOKEN_RE = re.compile(r'\w{2,}')
+
+# Paid orders counted per transaction.
+ORDER_BATCH_SIZE = 500
+
+# Orders with more distinct products only count their first ones (pairs grow quadratically).
+MAX_BASKET_SIZE = 50
+
+# Pairs bought together less often are not recommended.
+MIN_CO_PURCHASES = 2
+
+# Products shown per category of a cart's products, and how long they are cached.
+SIMILAR_PER_CATEGORY = 4
+SIMILAR_IN_CATEGORIES_TIMEOUT = 60 * 60
+
+
+def tokens(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def product_terms():
+    """
+    Returns {product id: Counter of weighted terms} for the whole catalog.
+    """
+    features = defaultdict(list)
+    for product_id, name, value in ProductFeature.objects.values_list('product_id', 'name', 'value').iterator():
+        features[product_id].append((name, value))
+
+    terms = {}
+    rows = Product.objects.order_by('pk').values_list('pk', 'name', 'brand', 'description', 'category_id')
+    for pk, name, brand, description, category_id in rows.iterator(chunk_size=2000):
+        counts = Counter()
+        for token in tokens(name):
+            counts[token] += FIELD_WEIGHTS['name']
+        for token in tokens(description):
+            counts[token] += FIELD_WEIGHTS['description']
+        for feature_name, value in features.get(pk, ()):
+            counts[f'feature:{normalize(feature_name)}={normalize(value)}'] += FIELD_WEIGHTS['feature']
+            for token in tokens(value):
+                counts[token] += FIELD_WEIGHTS['description']
+        if brand:
+            counts[f'brand:{normalize(brand)}'] += FIELD_WEIGHTS['brand']
+        counts[f'category:{category_id}'] += FIELD_WEIGHTS['category']
+        terms[pk] = counts
+    return terms
+
+
+def tfidf_vectors(terms):
+    """
+    Turns weighted term counts into L2 normalized TF-IDF vectors ({term: weight} dicts).
+    """
+    document_count = len(terms)
+    frequencies = Counter(term for counts in terms.values() for term in counts)
+    max_frequency = max(2, MAX_DOCUMENT_FREQUENCY * document_count)
+    idf = {
+        term: math.log(document_count / frequency)
+        for term, frequency in frequencies.items()
+        if 2 <= frequency <= max_frequency
+    }
+
+    vectors = {}
+    for pk, counts in terms.items():
+        vector = {term: (1 + math.log(count)) * idf[term] for term, count in counts.items() if term in idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        vectors[pk] = {term: weight / norm for term, weight in vector.items()} if norm else {}
+    return vectors
+
+
+def inverted_index(vectors):
+    postings = defaultdict(list)
+    for pk, vector in vectors.items():
+        for term, weight in vector.items():
+            postings[term].append((weight, pk))
+    return {
+        term: [(pk, weight) for weight, pk in heapq.nlargest(POSTINGS_LIMIT, entries)]
+        for term, entries in postings.items()
+    }
+
+
+def nearest_neighbours(vector, postings, exclude, count):
+    """
+    Returns the `count` products most similar to `vector` as (product id, score) pairs.
+    """
+    scores = defaultdict(float)
+    for term, weight in vector.items():
+        for pk, other_weight in postings[term]:
+            scores[pk] += weight * other_weight
+    scores.pop(exclude, None)
+    return heapq.nlargest(count, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def build_similar_products(count=RELATED_PRODUCTS_COUNT, batch_size=BATCH_SIZE):
+    """
+    Recomputes the 'similar' related products of every product.
+    Returns the number of products processed.
+    """
+    vectors = tfidf_vectors(product_terms())
+    postings = inverted_index(vectors)
+
+    product_ids = list(vectors)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        replace_related(RelatedProduct.SIMILAR, {
+            pk: nearest_neighbours(vectors[pk], postings, pk, count) for pk in batch
+        })
+
+    # product pages list their related products
+    invalidate_catalog()
+    return len(product_ids)
+
+
+def replace_related(kind, neighbours):
+    """
+    Replaces the `kind` related products of the products in `neighbours`
+    ({product id: [(related id, score)] best first}) in one transaction.
+    """
+    rows = [
+        RelatedProduct(product_id=pk, related_id=related_id, kind=kind, rank=rank, score=score)
+        for pk, ranked in neighbours.items()
+        for rank, (related_id, score) in enumerate(ranked, start=1)
+    ]
+    with transaction.atomic():
+        RelatedProduct.objects.filter(kind=kind, product_id__in=list(neighbours)).delete()
+        RelatedProduct.objects.bulk_create(rows)
+
+
+# ----- co-purchases -----
+
+def basket_pairs(baskets):
+    """
+    Counts the product pairs (diagonal included) of {order id: product ids} baskets.
+    """
+    pairs = Counter()
+    for product_ids in baskets.values():
+        basket = sorted(product_ids)[:MAX_BASKET_SIZE]
+        for i, product_id in enumerate(basket):
+            for other_id in basket[i:]:
+                pairs[(product_id, other_id)] += 1
+    return pairs
+
+
+def add_co_purchases(pairs):
+    """
+    Adds pair counts to the CoPurchase matrix with one read and one upsert.
+    """
+    existing = {
+        (product_id, other_id): orders
+        for product_id, other_id, orders in CoPurchase.objects.filter(
+            product_id__in={product_id for product_id, _ in pairs},
+            other_id__in={other_id for _, other_id in pairs},
+        ).values_list('product_id', 'other_id', 'orders')
+    }
+    CoPurchase.objects.bulk_create(
+        [CoPurchase(product_id=product_id, other_id=other_id, orders=existing.get((product_id, other_id), 0) + count)
+         for (product_id, other_id), count in pairs.items()],
+        update_conflicts=True,
+        unique_fields=['product', 'other'],
+        update_fields=['orders'],
+    )
+
+
+def count_co_purchases(batch_size=ORDER_BATCH_SIZE):
+    """
+    Adds the paid orders that are not counted yet to the CoPurchase matrix.
+    Returns the number of orders counted and the ids of their products.
+    """
+    counted, touched = 0, set()
+    while True:
+        with transaction.atomic():
+            order_ids = list(
+                Order.objects.filter(paid=True, co_purchases_counted=False).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                break
+            baskets = defaultdict(set)
+            for order_id, product_id in OrderItem.objects.filter(order_id__in=order_ids).values_list(
+                    'order_id', 'product_id'):
+                baskets[order_id].add(product_id)
+            pairs = basket_pairs(baskets)
+            if pairs:
+                add_co_purchases(pairs)
+            Order.objects.filter(pk__in=order_ids).update(co_purchases_counted=True)
+        counted += len(order_ids)
+        touched.update(product_id for product_ids in baskets.values() for product_id in product_ids)
+    return counted, touched
+
+
+def bought_together_neighbours(product_ids, count):
+    """
+    Returns {product id: [(related id, Jaccard score)] best first} for `product_ids`.
+    """
+    pairs = CoPurchase.objects.filter(
+        Q(product_id__in=product_ids) | Q(other_id__in=product_ids),
+        orders__gte=MIN_CO_PURCHASES,
+    ).exclude(product=F('other')).values_list('product_id', 'other_id', 'orders')
+    co_orders = defaultdict(dict)
+    for product_id, other_id, orders in pairs:
+        co_orders[product_id][other_id] = orders
+        co_orders[other_id][product_id] = orders
+    involved = set(co_orders)
+    totals = dict(
+        CoPurchase.objects.filter(product=F('other'), product_id__in=involved).values_list('product_id', 'orders')
+    )
+
+    neighbours = {}
+    for product_id in product_ids:
+        scores = [
+            (other_id, orders / (totals[product_id] + totals[other_id] - orders))
+            for other_id, orders in co_orders.get(product_id, {}).items()
+        ]
+        neighbours[product_id] = heapq.nlargest(count, scores, key=lambda item: (item[1], -item[0]))
+    return neighbours
+
+
+def build_bought_together(count=RELATED_PRODUCTS_COUNT, batch_size=BATCH_SIZE, rebuild=False):
+    """
+    Counts the newly paid orders and rescores the products they contain
+    (every product with co-purchases when `rebuild` recounts all orders).
+    Returns the number of orders counted and of products rescored.
+    """
+    if rebuild:
+        with transaction.atomic():
+            CoPurchase.objects.all().delete()
+            RelatedProduct.objects.filter(kind=RelatedProduct.BOUGHT_TOGETHER).delete()
+            Order.objects.filter(co_purchases_counted=True).update(co_purchases_counted=False)
+
+    counted, touched = count_co_purchases()
+    touched = sorted(touched)
+    for start in range(0, len(touched), batch_size):
+        batch = touched[start:start + batch_size]
+        replace_related(RelatedProduct.BOUGHT_TOGETHER, bought_together_neighbours(batch, count))
+
+    if touched:
+        invalidate_catalog()
+    return counted, len(touched)
+
+
+def bought_together_with(product_ids, count=4):
+    """
+    Products frequently bought with any of `product_ids` (e.g. a cart),
+    best first, with one query.
+    """
+    return Product.objects.filter(
+        related_to__product__in=product_ids, related_to__kind=RelatedProduct.BOUGHT_TOGETHER,
+    ).exclude(pk__in=product_ids).annotate(
+        co_purchase_score=Max('related_to__score'),
+    ).order_by('-co_purchase_score', 'pk')[:count]
+
+
+def related_products(product, kind=RelatedProduct.SIMILAR):
+    """
+    The precomputed related products of `product`, best first, as a lazy queryset.
+    """
+    return Product.objects.filter(related_to__product=product, related_to__kind=kind).order_by('related_to__rank')
+
+
+def similar_in_categories(product_ids, per_category=SIMILAR_PER_CATEGORY):
+    """
+    The first `per_category` products (in catalog order) of each category of
+    `product_ids`, excluding those products, with one windowed query
+    (ROW_NUMBER() OVER (PARTITION BY category)). Cached per set of products
+    under the catalog version.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return []
+    signature = hashlib.md5(','.join(map(str, product_ids)).encode()).hexdigest()
+    key = f'shop:similar_in_categories:{get_version(CATALOG_VERSION_KEY)}:{per_category}:{signature}'
+
+    def compute():
+        categories = Product.objects.filter(pk__in=product_ids).values('category')
+        return list(
+            Product.objects.filter(category__in=categories).exclude(pk__in=product_ids).annotate(
+                category_rank=Window(RowNumber(), partition_by=F('category'), order_by=Product._meta.ordering),
+            ).filter(category_rank__lte=per_category).order_by('category_id', 'category_rank')
+        )
+
+    return single_flight(key, compute, SIMILAR_IN_CATEGORIES_TIMEOUT)
@@ -0,0 +1,88 @@
+"""
+Product search backend.
+
+On PostgreSQL every product keeps a precomputed `search_vector` (name weighted
+highest, then brand, then description) covered by a GIN index, and the name
+has a trigram GIN index for typo tolerance. A search is a single ranked query
+that only touches matching rows through those indexes.
+
+Other databases (sqlite in development) fall back to a LIKE based query with
+a simple weighted relevance, which is good enough for small catalogs.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from shop.models import Product
+
+# PostgreSQL text search configuration; product texts are mostly Persian, which has no stemmer.
+SEARCH_CONFIG = 'simple'
+
+# Weight of the fuzzy (trigram) name similarity in the final rank.
+TRIGRAM_WEIGHT = 0.5
+
+SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('brand', weight='B', config=SEARCH_CONFIG)
+    + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+)
+
+
+def is_full_text_supported():
+    """
+    Returns True when the database supports the indexed full-text search.
+    """
+    return connection.vendor == 'postgresql'
+
+
+def update_search_vectors(queryset=None):
+    """
+    Recomputes the search document of the given products (all products by default)
+    in a single UPDATE. Does nothing on databases without full-text search.
+    """
+    if not is_full_text_supported():
+        return 0
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.update(search_vector=SEARCH_VECTOR)
+
+
+def search_products(query, queryset=None):
+    """
+    Returns products matching `query`, best matches first.
+    Each product is annotated with its relevance as `rank`.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    if is_full_text_supported():
+        return _postgres_search(queryset, query)
+    return _fallback_search(queryset, query)
+
+
+def _postgres_search(queryset, query):
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    return queryset.filter(
+        Q(search_vector=search_query) | Q(name__trigram_similar=query)
+    ).annotate(
+        rank=SearchRank(F('search_vector'), search_query) + TrigramSimilarity('name', query) * TRIGRAM_WEIGHT,
+    ).order_by('-rank', 'id')
+
+
+def _fallback_search(queryset, query):
+    terms = query.split()[:10]
+    if not terms:
+        return queryset.none()
+
+    condition = Q()
+    rank = Value(0)
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(brand__icontains=term) | Q(description__icontains=term)
+        # same weights as the PostgreSQL search document: name > brand > description
+        rank = rank + Case(
+            When(name__icontains=term, then=Value(4)),
+            When(brand__icontains=term, then=Value(2)),
+            When(description__icontains=term, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    return queryset.filter(condition).annotate(rank=rank).order_by('-rank', 'id')
@@ -1,36 +1,251 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
-from .models import Product
+from .autocomplete import prefix_index
+from .cache import invalidate_catalog, invalidate_product
+from .catalog import catalog_changed
+from .categories import invalidate_category_tree, update_category_stats
+from .facets import invalidate_facets
+from .models import Product, ProductFeature, Category, Comment, Image, Rating, Campaign, autocomplete_label
+from .search import update_search_vectors
 
+# Product fields that make up the search document
+SEARCH_FIELDS = {'name', 'brand', 'description'}
 
-@receiver(pre_save, sender=Product)
-def calculate_new_price(sender, instance, **kwargs):
+# Product fields used by the autocomplete index
+AUTOCOMPLETE_FIELDS = {'name', 'slug', 'brand', 'category', 'sold_count', 'views'}
+
+# Autocomplete fields other than the ranking scores
+AUTOCOMPLETE_LABEL_FIELDS = {'name', 'slug', 'brand', 'category'}
+
+# Product fields that facets are counted on
+FACET_FIELDS = {'brand', 'category', 'original_price', 'discount', 'discounted_price'}
+
+# Product fields that the denormalized category stats depend on
+CATEGORY_STAT_FIELDS = {'category', 'original_price', 'discount', 'discounted_price'}
+
+
+@receiver(post_save, sender=Product)
+def refresh_search_vector(sender, instance, update_fields=None, **kwargs):
+    """
+    🔔 Signal: post_save for Product model
+
+    Keeps the product's search document in sync with its name, brand and description.
+    Saves limited to unrelated fields (e.g. rating counters) are skipped.
+    """
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    update_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_autocomplete(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    🔔 Signal: post_save for Product model
+
+    Updates the product (and its brand/category ranking) in the in-memory autocomplete index.
+    Saves that only change its scores (e.g. sold_count after an order) are not
+    announced to other processes, so they don't all rebuild their index.
+    """
+    if update_fields is not None:
+        if not AUTOCOMPLETE_FIELDS.intersection(update_fields):
+            return
+        scores_only = not AUTOCOMPLETE_LABEL_FIELDS.intersection(update_fields)
+    else:
+        label = autocomplete_label(instance.__dict__)
+        scores_only = not created and getattr(instance, '_loaded_autocomplete_label', None) == label
+        instance._loaded_autocomplete_label = label
+    prefix_index.update_product(instance, scores_only=scores_only)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_for_autocomplete(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_delete for Product model
+
+    Removes the product from the autocomplete index.
+    """
+    prefix_index.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def index_category_for_autocomplete(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_save for Category model
+
+    Adds or renames the category in the autocomplete index.
+    """
+    prefix_index.update_category(instance)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category_for_autocomplete(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_delete for Category model
+
+    Removes the category from the autocomplete index.
+    """
+    prefix_index.remove_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_facets(sender, instance, update_fields=None, **kwargs):
+    """
+    🔔 Signal: post_save for Product model
+
+    Makes cached facet counts stale when a faceted field may have changed.
+    """
+    if update_fields is not None and not FACET_FIELDS.intersection(update_fields):
+        return
+    invalidate_facets()
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_facets(sender, **kwargs):
+    """
+    🔔 Signal: post_save/post_delete for Product, ProductFeature and Category models
+
+    Makes cached facet counts stale.
+    """
+    invalidate_facets()
+
+
+@receiver(post_save, sender=Product)
+def update_product_category_stats(sender, instance, update_fields=None, **kwargs):
+    """
+    🔔 Signal: post_save for Product model
+
+    Updates the product count and price range of the product's category
+    (and of its previous category, when it was moved) and their ancestors.
+    """
+    if update_fields is not None and not CATEGORY_STAT_FIELDS.intersection(update_fields):
+        return
+    update_category_stats({instance.category_id, getattr(instance, '_loaded_category_id', None)})
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_category_stats(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_delete for Product model
+
+    Updates the stats of the deleted product's category and its ancestors.
+    """
+    update_category_stats([instance.category_id])
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_tree(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_save for Category model
+
+    A category was added, renamed or moved: updates the stats of the
+    category and its ancestors, old and new ones when it was moved, and
+    drops the cached tree.
+    """
+    update_category_stats({instance.pk, instance.parent_id, getattr(instance, '_loaded_parent_id', None)})
+    instance._loaded_parent_id = instance.parent_id
+    invalidate_category_tree()
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_from_tree(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_delete for Category model
+
+    Updates the stats of the removed category's ancestors and drops the cached tree.
+    """
+    update_category_stats([instance.parent_id])
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_pages(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_save/post_delete for Product model
+
+    Makes the cached product page and every cached listing stale.
+    """
+    invalidate_product(instance.pk)
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+def invalidate_pages_of_product(sender, instance, **kwargs):
     """
-    🔔 Signal: pre_save for Product model
+    🔔 Signal: post_save/post_delete for Image, Rating and ProductFeature models
 
-    This function runs automatically **before** a Product instance is saved.
+    Images and ratings are shown on product cards too, so listings are made stale as well.
+    """
+    invalidate_product(instance.product_id)
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_save/post_delete for Comment model
+
+    Comments are only shown on the product page.
+    """
+    invalidate_product(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_pages(sender, **kwargs):
+    """
+    🔔 Signal: post_save/post_delete for Category model
+
+    Category names and counts appear in menus on every page.
+    """
+    invalidate_catalog()
 
-    Purpose:
-        - Automatically calculate the `discount_price` field
-          based on `original_price` and `discount` percentage.
 
-    Behavior:
-        - If a discount exists, it calculates the discounted price.
-        - If the discount is missing, the discounted price equals the original price.
-        - If invalid or non-numeric data is provided, it safely falls back to the original price.
+@receiver(post_save, sender=Rating)
+def add_rating_to_product(sender, instance, created, **kwargs):
     """
+    🔔 Signal: post_save for Rating model
 
-    # Check if the product has a discount value
-    if instance.discount is not None:
-        try:
-            # Calculate discounted price:
-            # Formula → discounted_price = original_price × (100 - discount) ÷ 100
-            instance.discount_price = int(
-                instance.original_price * (100 - instance.discount) / 100
-            )
-        except (TypeError, ValueError):
-            # In case of invalid input (non-numeric values), fall back to original price
-            instance.discount_price = instance.original_price
+    Applies the new or changed score to the product's rating aggregates
+    with a single expression UPDATE (no re-aggregation of all ratings).
+    """
+    old_score = None if created else getattr(instance, '_loaded_score', None)
+    if not created and old_score is None:
+        # Loaded without its score (e.g. .only()); fall back to a full recompute.
+        instance.product.update_rating()
     else:
-        # No discount → keep discounted price equal to original price
-        instance.discount_price = instance.original_price
+        # the update is pure expressions, so the product row is never loaded
+        Product(pk=instance.product_id).apply_rating_change(old_score, instance.score)
+    instance._loaded_score = instance.score
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_product(sender, instance, **kwargs):
+    """
+    🔔 Signal: post_delete for Rating model
+
+    Removes the deleted score from the product's rating aggregates.
+    """
+    Product(pk=instance.product_id).apply_rating_change(getattr(instance, '_loaded_score', instance.score), None)
+
+
+@receiver(pre_delete, sender=Campaign)
+def revert_deleted_campaign(sender, instance, **kwargs):
+    """
+    🔔 Signal: pre_delete for Campaign model
+
+    Gives the products of a campaign that is deleted while running their own discount back.
+    """
+    if instance.revert():
+        catalog_changed()
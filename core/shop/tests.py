@@ -1,3 +1,1096 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image as PilImage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from account.models import ShopUser
+from order.models import Order, OrderItem
+from shop.autocomplete import GENERATION_CACHE_KEY, prefix_index
+from shop.cache import single_flight
+from shop.categories import get_category_tree, update_category_stats
+from shop.comments import get_comment_page
+from shop.counters import ViewCounter, current_hour, view_counter
+from shop.feeds import feed_rows
+from shop.images import encoding_signature
+from shop.leaderboards import build_leaderboards, prune_buckets
+from shop.management.commands import reencode_media
+from shop.models import (Campaign, CoPurchase, Product, ProductFeature, Category, Image, Comment, ProductDailyView,
+                         ProductHourlyStat, Rating, RelatedProduct)
+from shop.pagination import KeysetPaginator
+from shop.recommendations import bought_together_with, related_products
+
+
+class QueryBudgetMixin:
+    """
+    Test helper that fails when a block of code runs more queries than allowed.
+    Unlike `assertNumQueries`, the budget is an upper bound, so unrelated
+    optimizations do not break the test.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as ctx:
+            yield ctx
+        executed = len(ctx.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(f"{i}. {q['sql']}" for i, q in enumerate(ctx.captured_queries, start=1))
+            self.fail(f"{executed} queries executed, budget is {budget}:\n{queries}")
+
+
+def create_catalog(count, discount=None):
+    """
+    Creates a category with `count` products, each having two images and a comment.
+    Images are inserted with `bulk_create` so no file processing happens.
+    """
+    category = Category.objects.create(name='Category', slug=f'category-{Category.objects.count()}')
+    user = ShopUser.objects.create_user(email=f'user{ShopUser.objects.count()}@example.com', password='pass',
+                                        phone=f'0912{ShopUser.objects.count():07d}')
+    products = [
+        Product.objects.create(category=category, name=f'Product {i:03d}', slug=f'{category.slug}-product-{i}',
+                               description='description', original_price=1000 + i, discount=discount)
+        for i in range(count)
+    ]
+    Image.objects.bulk_create([
+        Image(product=product, image_file=f'products_images/{product.slug}-{n}.webp', title='image', description='')
+        for product in products for n in range(2)
+    ])
+    Comment.objects.bulk_create([Comment(product=product, user=user, body='comment') for product in products])
+    return products
+
+
+class ProductListQueryBudgetTest(QueryBudgetMixin, TestCase):
+    """
+    The listing pages must render in a constant number of queries,
+    regardless of how many products are on the page.
+    """
+    LISTING_BUDGET = 4
+
+    def test_products_list_budget(self):
+        create_catalog(30)
+        self.client.get(reverse('shop:products_list'))  # fill the facets cache
+        with self.assertQueryBudget(self.LISTING_BUDGET):
+            response = self.client.get(reverse('shop:products_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'products_images/')
+
+    def test_products_list_ajax_budget(self):
+        create_catalog(30)
+        with self.assertQueryBudget(self.LISTING_BUDGET):
+            response = self.client.get(reverse('shop:products_list'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+
+    def test_products_list_discount_budget(self):
+        create_catalog(30, discount=10)
+        with self.assertQueryBudget(self.LISTING_BUDGET):
+            response = self.client.get(reverse('shop:products_list_discount'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_primary_image_uses_prefetch(self):
+        create_catalog(3)
+        products = list(Product.objects.for_listing())
+        with self.assertNumQueries(0):
+            for product in products:
+                self.assertTrue(product.primary_image.image_file.name.endswith('-0.webp'))
+                self.assertEqual(product.comments_count, 1)
+                self.assertTrue(product.category.name)
+
+
+class KeysetPaginatorTest(QueryBudgetMixin, TestCase):
+    """
+    Walking a listing page by page must return every product exactly once,
+    in order, and never count the table.
+    """
+
+    def walk(self, queryset, ordering, per_page):
+        paginator = KeysetPaginator(queryset, ordering, per_page)
+        seen, cursor = [], None
+        while True:
+            with self.assertQueryBudget(1) as ctx:
+                page = paginator.get_page(cursor)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+            seen.extend(page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_walks_listing_with_ties(self):
+        products = create_catalog(7)
+        # duplicate names force the created_at/id tie-breakers to be used
+        Product.objects.filter(pk__in=[p.pk for p in products[:4]]).update(name='Same name')
+        ordering = ('name', 'created_at', 'id')
+        seen = self.walk(Product.objects.all(), ordering, per_page=3)
+        self.assertEqual([p.pk for p in seen], list(Product.objects.order_by(*ordering).values_list('pk', flat=True)))
+
+    def test_walks_descending_listing(self):
+        products = create_catalog(9)
+        for i, product in enumerate(products):
+            Product.objects.filter(pk=product.pk).update(discount=10 + i % 3)
+        ordering = ('-discount', 'id')
+        seen = self.walk(Product.objects.filter(discount__gt=0), ordering, per_page=2)
+        self.assertEqual([p.pk for p in seen], list(Product.objects.order_by(*ordering).values_list('pk', flat=True)))
+
+    def test_invalid_cursor_returns_first_page(self):
+        create_catalog(3)
+        page = KeysetPaginator(Product.objects.all(), ('name', 'id'), 2).get_page('not-a-cursor')
+        self.assertEqual(page[0].name, 'Product 000')
+
+    def test_ajax_page_returns_next_cursor(self):
+        create_catalog(25)
+        response = self.client.get(reverse('shop:products_list'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        cursor = response['X-Next-Cursor']
+        self.assertTrue(cursor)
+        response = self.client.get(reverse('shop:products_list'), {'cursor': cursor},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertContains(response, 'Product 020')
+        # same card markup as the full page, which the infinite scroll appends to
+        self.assertContains(response, '<li class="products-list__ele">', count=5)
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+
+class FacetsTest(QueryBudgetMixin, TestCase):
+    """
+    Facet counts follow the filter state, ignore each facet's own selection
+    and are served from the cache until the catalog changes.
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products = create_catalog(4)
+            for product, brand, price in zip(self.products, ['Apple', 'Apple', 'Samsung', 'Nokia'],
+                                             [50_000, 200_000, 200_000, 2_000_000]):
+                product.brand, product.original_price = brand, price
+                product.save()
+            ProductFeature.objects.create(product=self.products[0], name='color', value='black')
+            ProductFeature.objects.create(product=self.products[1], name='color', value='white')
+            ProductFeature.objects.create(product=self.products[2], name='color', value='black')
+
+    def get(self, **params):
+        return self.client.get(reverse('shop:products_list'), params)
+
+    def counts(self, facet):
+        return {item['value']: item['count'] for item in facet}
+
+    def test_counts_follow_filters(self):
+        response = self.get(brand='Apple')
+        self.assertEqual(len(response.context['products']), 2)
+        facets = response.context['facets']
+        # other brands stay selectable with their own counts
+        self.assertEqual(self.counts(facets['brand']), {'Apple': 2, 'Samsung': 1, 'Nokia': 1})
+        self.assertEqual(self.counts(facets['price']), {'under-100k': 1, '100k-500k': 1})
+        self.assertEqual(self.counts(facets['features']['color']), {'black': 1, 'white': 1})
+
+        response = self.get(feature='color:black', price='100k-500k')
+        self.assertEqual([p.brand for p in response.context['products']], ['Samsung'])
+        facets = response.context['facets']
+        self.assertEqual(self.counts(facets['features']['color']), {'black': 1, 'white': 1})
+        self.assertEqual(self.counts(facets['price']), {'under-100k': 1, '100k-500k': 1})
+
+    def test_facets_are_cached_until_catalog_changes(self):
+        self.get(brand='Apple')
+        with self.assertQueryBudget(ProductListQueryBudgetTest.LISTING_BUDGET):
+            self.get(brand='Apple')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[3].brand = 'Apple'
+            self.products[3].save()
+        facets = self.get(brand='Apple').context['facets']
+        self.assertEqual(self.counts(facets['brand']), {'Apple': 3, 'Samsung': 1})
+
+
+class CategoryTreeTest(QueryBudgetMixin, TestCase):
+    """
+    Category stats include subcategories and are kept current by signals;
+    menus and category pages render from the cached tree.
+    """
+
+    def setUp(self):
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.android = Category.objects.create(name='Android', slug='android', parent=self.phones)
+        self.other = Category.objects.create(name='Other', slug='other')
+        self.cheap = Product.objects.create(category=self.android, name='Cheap', slug='cheap', description='d',
+                                            original_price=1000, discount=50)
+        self.expensive = Product.objects.create(category=self.phones, name='Expensive', slug='expensive',
+                                                description='d', original_price=9000)
+
+    def stats(self, category):
+        category.refresh_from_db()
+        return category.product_count, category.min_price, category.max_price
+
+    def test_stats_roll_up_and_follow_moves(self):
+        self.assertEqual(self.stats(self.android), (1, 500, 500))
+        self.assertEqual(self.stats(self.phones), (2, 500, 9000))
+
+        product = Product.objects.get(pk=self.cheap.pk)
+        product.category = self.other
+        product.save()
+        self.assertEqual(self.stats(self.android), (0, None, None))
+        self.assertEqual(self.stats(self.phones), (1, 9000, 9000))
+        self.assertEqual(self.stats(self.other), (1, 500, 500))
+
+        self.expensive.delete()
+        self.assertEqual(self.stats(self.phones), (0, None, None))
+
+    def test_category_changes_only_touch_their_ancestors(self):
+        other_android = Category.objects.create(name='Other Android', slug='other-android', parent=self.other)
+        Product.objects.create(category=other_android, name='Third', slug='third', description='d',
+                               original_price=200)
+        # stats of unrelated trees are not recomputed
+        Category.objects.filter(pk=self.phones.pk).update(product_count=99)
+        with self.assertNumQueries(3):  # the category, its ancestors, their aggregates
+            update_category_stats([other_android.pk])
+        self.assertEqual(self.stats(self.phones)[0], 99)
+        self.assertEqual(self.stats(self.other), (1, 200, 200))
+
+        # moving a subtree updates both its old and new ancestors
+        Category.objects.filter(pk=self.phones.pk).update(product_count=2)
+        android = Category.objects.get(pk=self.android.pk)
+        android.parent = self.other
+        android.save()
+        self.assertEqual(self.stats(self.phones), (1, 9000, 9000))
+        self.assertEqual(self.stats(self.other), (2, 200, 500))
+
+        android.delete()
+        self.assertEqual(self.stats(self.other), (1, 200, 200))
+
+    def test_tree_is_cached(self):
+        tree = get_category_tree()
+        self.assertEqual([node.slug for node in tree], ['other', 'phones'])
+        self.assertEqual(tree.get('phones').product_count, 2)
+        self.assertEqual(sorted(tree.get('phones').descendant_ids), sorted([self.phones.pk, self.android.pk]))
+        with self.assertNumQueries(0):
+            get_category_tree()
+
+    def test_category_page_lists_subtree(self):
+        url = reverse('shop:products_by_category', kwargs={'category_slug': 'phones'})
+        response = self.client.get(url)
+        self.assertEqual({p.slug for p in response.context['products']}, {'cheap', 'expensive'})
+        self.assertContains(response, 'Android (1)')
+
+        response = self.client.get(reverse('shop:products_by_category', kwargs={'category_slug': 'android'}))
+        self.assertEqual([p.slug for p in response.context['products']], ['cheap'])
+        self.assertEqual([c.slug for c in response.context['category_ancestors']], ['phones'])
+
+        with self.assertQueryBudget(ProductListQueryBudgetTest.LISTING_BUDGET):
+            self.client.get(url)
+        self.assertEqual(self.client.get(reverse('shop:products_by_category', kwargs={'category_slug': 'x'})).status_code, 404)
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=0)
+class PageCacheTest(TestCase):
+    """
+    Anonymous pages are cached under versioned keys that signals bump.
+    """
+
+    def setUp(self):
+        self.product = create_catalog(2)[0]
+        self.url = self.product.get_absolute_url()
+
+    def test_anonymous_detail_page_is_cached(self):
+        self.client.get(self.url)
+        pending = view_counter.pending(self.product.pk)
+        with self.assertNumQueries(1):  # the product lookup
+            response = self.client.get(self.url)
+        self.assertContains(response, self.product.name)
+        self.assertNotContains(response, 'csrfmiddlewaretoken\': \'')
+        # views are still counted
+        self.assertEqual(view_counter.pending(self.product.pk), pending + 1)
+        view_counter.flush()
+
+    def test_signals_invalidate_pages(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(product=self.product, user=ShopUser.objects.get(), body='a fresh comment')
+        self.assertContains(self.client.get(self.url), 'a fresh comment')
+
+        self.client.get(reverse('shop:products_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed product'
+            self.product.save()
+            # a page rendered before the commit is not cached under the new version
+            self.assertNotContains(self.client.get(reverse('shop:products_list')), 'Renamed product')
+        self.assertContains(self.client.get(reverse('shop:products_list')), 'Renamed product')
+        view_counter.flush()
+
+    def test_logged_in_users_are_not_served_from_cache(self):
+        self.client.get(self.url)
+        self.client.force_login(ShopUser.objects.get())
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+        view_counter.flush()
+
+    def test_single_flight_waits_for_the_running_computation(self):
+        cache.add('test:key:lock', 1)
+        cache.set('test:key', 'computed elsewhere')
+        self.assertEqual(single_flight('test:key', lambda: 'computed here', 10), 'computed elsewhere')
+        cache.delete_many(['test:key', 'test:key:lock'])
+        self.assertEqual(single_flight('test:key', lambda: 'computed here', 10), 'computed here')
+        self.assertIsNone(cache.get('test:key:lock'))
+        cache.delete('test:key')
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=0)
+class ConditionalGetTest(TestCase):
+    """
+    Catalog pages answer revalidation with 304 without rendering.
+    """
+
+    def setUp(self):
+        self.product = create_catalog(2)[0]
+        self.url = self.product.get_absolute_url()
+
+    def test_product_page_revalidation(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        # no Last-Modified: nothing on the page has a modification time that follows every change
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        pending = view_counter.pending(self.product.pk)
+        with self.assertNumQueries(1):  # the product
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(view_counter.pending(self.product.pk), pending + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(product=self.product, user=ShopUser.objects.get(), body='new')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        view_counter.flush()
+
+    def test_listing_revalidation(self):
+        url = reverse('shop:products_list')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # the AJAX partial of the same URL is a different representation
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(product=self.product, user=ShopUser.objects.get(), score=4)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ProductFeedTest(TestCase):
+    """
+    The catalog feed streams every product in each format.
+    """
+
+    def setUp(self):
+        self.products = create_catalog(5)
+        ProductFeature.objects.create(product=self.products[0], name='color', value='black & white')
+
+    def fetch(self, feed_format, **headers):
+        response = self.client.get(reverse('shop:product_feed', args=[feed_format]), **headers)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_jsonl_feed(self):
+        response, body = self.fetch('jsonl')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['slug'] for row in rows], [p.slug for p in self.products])
+        self.assertEqual(rows[0]['features'], {'color': 'black & white'})
+        self.assertTrue(rows[0]['image_url'].startswith('http://testserver/'))
+
+    def test_csv_and_xml_feeds(self):
+        _, body = self.fetch('csv')
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['features'], 'color: black & white')
+
+        _, body = self.fetch('xml')
+        self.assertIn('<feature name="color">black &amp; white</feature>', body.decode())
+        self.assertEqual(body.decode().count('<product>'), 5)
+
+    def test_gzip_feed_and_constant_queries(self):
+        response, body = self.fetch('jsonl', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(body).splitlines()), 5)
+
+        # products, images and features per chunk, however many products there are
+        with self.assertNumQueries(3):
+            list(feed_rows('', chunk_size=100))
+
+    def test_export_command(self):
+        path = tempfile.mktemp(suffix='.jsonl.gz')
+        try:
+            call_command('export_products', output=path, gzip=True, stderr=StringIO())
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(len(f.readlines()), 5)
+        finally:
+            os.remove(path)
+
+
+class ImportProductsTest(TestCase):
+    """
+    import_products upserts products, categories and features in bulk.
+    """
+
+    def write(self, suffix, text):
+        f = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        f.write(text)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def run_import(self, path):
+        out, err = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_products', path, batch_size=2, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_and_jsonl_update(self):
+        path = self.write('.csv', (
+            "name,category,brand,original_price,discount,inventory,features\n"
+            "Phone,Phones,Apple,1000,10,3,color: black; size: 6\n"
+            "Phone,Phones,Samsung,800,,1,\n"
+            "Case,Accessories,,50,0,9,\n"
+            ",Phones,,1,,,\n"
+        ))
+        out, err = self.run_import(path)
+        self.assertIn('3 products imported, 1 rows skipped', out)
+        self.assertIn('line 5: skipped', err)
+
+        phone = Product.objects.get(slug='phone')
+        self.assertEqual(phone.discounted_price, 900)
+        self.assertEqual(Product.objects.get(slug='phone-2').discounted_price, 800)
+        self.assertEqual(dict(phone.features.values_list('name', 'value')), {'color': 'black', 'size': '6'})
+        self.assertEqual(phone.category.product_count, 2)
+        self.assertEqual(get_category_tree().get('accessories').product_count, 1)
+
+        path = self.write('.jsonl', json.dumps({
+            'slug': 'phone', 'name': 'Phone', 'category': 'Phones', 'original_price': 2000, 'discount': 50,
+            'features': {'color': 'red'},
+        }) + '\n')
+        self.run_import(path)
+        phone.refresh_from_db()
+        self.assertEqual((phone.original_price, phone.discounted_price), (2000, 1000))
+        self.assertEqual(list(phone.features.values_list('value', flat=True)), ['red'])
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_invalid_rows_are_skipped(self):
+        Product.objects.create(category=Category.objects.create(name='Phones', slug='phones'), name='Phone',
+                               slug='phone', description='d', original_price=500)
+        path = self.write('.csv', (
+            "name,category,brand,original_price,inventory,weight\n"
+            "Phone,Phones,,1000,3,\n"
+            "Case,Phones,,-1,,\n"
+            "Cable,Phones,,10,,-5\n"
+            f"{'x' * 101},Phones,,10,,\n"
+            f"Charger,Phones,{'b' * 251},10,,\n"
+        ))
+        out, err = self.run_import(path)
+        self.assertIn('1 products imported, 4 rows skipped', out)
+        for line in (3, 4, 5, 6):
+            self.assertIn(f'line {line}: skipped', err)
+        # a row without a slug never overwrites an existing product
+        self.assertEqual(Product.objects.get(slug='phone').original_price, 500)
+        self.assertEqual(Product.objects.get(slug='phone-2').original_price, 1000)
+
+    def test_malformed_jsonl_lines_are_skipped(self):
+        path = self.write('.jsonl', '\n'.join([
+            json.dumps({'name': 'Phone', 'category': 'Phones', 'original_price': 100}),
+            '{"name": "Broken",',
+            json.dumps(['Case', 'Phones']),
+            json.dumps({'name': 2024, 'category': 'Phones', 'brand': 7, 'features': ['x']}),
+            json.dumps({'name': ['Cable'], 'category': {'name': 'Phones'}}),
+        ]) + '\n')
+        out, err = self.run_import(path)
+        self.assertIn('3 products imported, 2 rows skipped', out)
+        self.assertIn('line 2: skipped, invalid JSON', err)
+        self.assertIn('line 3: skipped, not a JSON object', err)
+        self.assertEqual(Product.objects.get(name='2024').brand, '7')
+        self.assertEqual(get_category_tree().get('phones').product_count, 2)
+
+    def test_export_round_trip(self):
+        create_catalog(3)
+        ProductFeature.objects.create(product=Product.objects.first(), name='color', value='blue')
+        path = tempfile.mktemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        call_command('export_products', format='csv', output=path, stderr=StringIO())
+        Product.objects.update(original_price=1)
+        self.run_import(path)
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(sorted(Product.objects.values_list('original_price', flat=True)), [1000, 1001, 1002])
+        self.assertTrue(ProductFeature.objects.filter(name='color', value='blue').exists())
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=0)
+class CampaignTest(QueryBudgetMixin, TestCase):
+    """
+    Campaigns are applied and reverted with set-based UPDATEs.
+    """
+
+    def setUp(self):
+        self.parent = Category.objects.create(name='Electronics', slug='electronics')
+        self.child = Category.objects.create(name='Phones', slug='phones', parent=self.parent)
+        self.other = Category.objects.create(name='Books', slug='books')
+        self.phone = Product.objects.create(category=self.child, name='Phone', slug='phone', description='d',
+                                            original_price=1000, discount=10)
+        self.tv = Product.objects.create(category=self.parent, name='TV', slug='tv', description='d',
+                                         original_price=2000)
+        self.book = Product.objects.create(category=self.other, name='Book', slug='book', description='d',
+                                           original_price=500)
+        now = timezone.now()
+        self.window = {'starts_at': now - timedelta(hours=1), 'ends_at': now + timedelta(hours=1)}
+
+    def prices(self):
+        return dict(Product.objects.values_list('slug', 'discounted_price'))
+
+    def run_campaigns(self):
+        call_command('run_campaigns', stdout=StringIO())
+
+    def test_sitewide_sale_is_one_update(self):
+        sale = Campaign.objects.create(name='Sale', discount=20, **self.window)
+        with self.assertQueryBudget(6):
+            self.assertEqual(sale.apply(), 3)
+        self.assertEqual(self.prices(), {'phone': 800, 'tv': 1600, 'book': 400})
+
+        self.assertEqual(sale.revert(), 3)
+        self.assertEqual(self.prices(), {'phone': 900, 'tv': 2000, 'book': 500})
+        self.assertEqual(Product.objects.get(slug='phone').discount, 10)
+
+    def test_scheduler_and_overlapping_campaigns(self):
+        Campaign.objects.create(name='Sale', discount=10, **self.window)
+        electronics = Campaign.objects.create(name='Electronics', discount=50, category=self.parent, **self.window)
+        Campaign.objects.create(name='Later', discount=90, starts_at=self.window['ends_at'],
+                                ends_at=self.window['ends_at'] + timedelta(days=1))
+        self.run_campaigns()
+        self.assertEqual(self.prices(), {'phone': 500, 'tv': 1000, 'book': 450})
+
+        electronics.is_active = False
+        electronics.save()
+        self.run_campaigns()
+        # products of the disabled campaign fall back to the site-wide one
+        self.assertEqual(self.prices(), {'phone': 900, 'tv': 1800, 'book': 450})
+        self.assertEqual(Product.objects.get(slug='phone').regular_discount, 10)
+
+    def test_discount_changes_during_a_campaign_are_kept(self):
+        sale = Campaign.objects.create(name='Sale', discount=20, **self.window)
+        sale.apply()
+        phone = Product.objects.get(slug='phone')
+        phone.discount = 30
+        phone.save()
+        self.assertEqual(self.prices()['phone'], 800)
+
+        path = os.path.join(tempfile.mkdtemp(), 'products.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            for slug, discount in (('tv', 5), ('radio', 15)):
+                f.write(json.dumps({'name': slug, 'slug': slug, 'category': 'electronics', 'original_price': 2000,
+                                    'discount': discount}) + '\n')
+        call_command('import_products', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.prices(), {'phone': 800, 'tv': 1600, 'book': 400, 'radio': 1700})
+
+        sale.revert()
+        self.assertEqual(self.prices(), {'phone': 700, 'tv': 1900, 'book': 500, 'radio': 1700})
+
+    def test_deleting_a_running_campaign_reverts_it(self):
+        campaign = Campaign.objects.create(name='Books', discount=40, category=self.other, **self.window)
+        campaign.apply()
+        self.assertEqual(self.prices()['book'], 300)
+        campaign.delete()
+        self.assertEqual(self.prices(), {'phone': 900, 'tv': 2000, 'book': 500})
+
+
+class ViewCounterTest(TestCase):
+    """
+    Product views are buffered in memory and written in one batched UPDATE.
+    """
+
+    def test_detail_page_does_not_write(self):
+        product = create_catalog(1)[0]
+        self.client.force_login(ShopUser.objects.get())
+        pending = view_counter.pending(product.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(product.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(view_counter.pending(product.pk), pending + 1)
+        view_counter.flush()
+
+    def test_flush_aggregates_increments(self):
+        first, second = create_catalog(2)
+        updated_at = Product.objects.get(pk=first.pk).updated_at
+        counter = ViewCounter()
+        for _ in range(3):
+            counter.record(first.pk)
+        counter.record(second.pk, count=2)
+
+        # totals update + lookup/insert/update for the daily and the hourly buckets, wrapped in a savepoint
+        with self.assertNumQueries(9):
+            self.assertEqual(counter.flush(), 2)
+
+        first.refresh_from_db()
+        self.assertEqual(first.views, 3)
+        self.assertEqual(first.updated_at, updated_at)
+        self.assertEqual(Product.objects.get(pk=second.pk).views, 2)
+        self.assertEqual(ProductDailyView.objects.get(product=first).views, 3)
+        self.assertEqual(ProductHourlyStat.objects.get(product=first).views, 3)
+
+        counter.record(first.pk)
+        counter.flush()
+        self.assertEqual(Product.objects.get(pk=first.pk).views, 4)
+        self.assertEqual(ProductDailyView.objects.get(product=first).views, 4)
+        self.assertEqual(counter.flush(), 0)
+
+
+class LeaderboardTest(QueryBudgetMixin, TestCase):
+    """
+    Leaderboards are summed from hourly buckets and served from the cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+        parent = Category.objects.create(name='Electronics', slug='electronics')
+        self.child = Category.objects.create(name='Phones', slug='phones', parent=parent)
+        self.phone = Product.objects.create(category=self.child, name='Phone', slug='phone', description='d',
+                                            original_price=1000)
+        self.tv = Product.objects.create(category=parent, name='TV', slug='tv', description='d', original_price=2000)
+        self.book = Product.objects.create(category=Category.objects.create(name='Books', slug='books'),
+                                           name='Book', slug='book', description='d', original_price=500)
+        self.hour = current_hour()
+
+    def stat(self, product, hours_ago=0, views=0, sales=0):
+        ProductHourlyStat.objects.create(product=product, hour=self.hour - timedelta(hours=hours_ago),
+                                         views=views, sales=sales)
+
+    def names(self, leaderboards, metric, window, category=None):
+        return [entry.name for entry in leaderboards.get(metric, window, category.pk if category else None)]
+
+    def test_windows_and_categories(self):
+        self.stat(self.phone, views=50)
+        self.stat(self.tv, views=10, sales=2)
+        self.stat(self.book, hours_ago=48, sales=9)
+        self.stat(self.book, hours_ago=24 * 40, sales=100)  # outside every window
+        leaderboards = build_leaderboards()
+
+        self.assertEqual(self.names(leaderboards, 'trending', '24h'), ['Phone', 'TV'])
+        self.assertEqual(self.names(leaderboards, 'best_sellers', '24h'), ['TV'])
+        self.assertEqual(self.names(leaderboards, 'best_sellers', '7d'), ['Book', 'TV'])
+        # a category's board includes its subcategories
+        self.assertEqual(self.names(leaderboards, 'trending', '24h', self.child.parent), ['Phone', 'TV'])
+        self.assertEqual(self.names(leaderboards, 'trending', '24h', self.child), ['Phone'])
+
+        self.assertEqual(prune_buckets(), 1)
+
+    def test_sales_and_views_fill_buckets(self):
+        user = ShopUser.objects.create_user(email='buyer@example.com', password='pass', phone='09120000000')
+        order = Order.objects.create(buyer=user, phone='09120000000', address='a', postal_code='1', city='c',
+                                     province='p')
+        OrderItem.objects.create(order=order, product=self.book, price=500, quantity=3)
+        OrderItem.objects.create(order=order, product=self.phone, price=500, quantity=1)
+        # unpaid orders are not sales
+        self.assertFalse(ProductHourlyStat.objects.filter(sales__gt=0).exists())
+        Order.objects.create(buyer=user, phone='09120000000', address='a', postal_code='1', city='c',
+                             province='p').items.create(product=self.phone, price=500, quantity=5)
+        order = Order.objects.get(pk=order.pk)
+        order.paid = True
+        order.save()
+        order.save()
+        counter = ViewCounter()
+        counter.record(self.phone.pk, count=4)
+        counter.flush()
+
+        leaderboards = build_leaderboards()
+        self.assertEqual(self.names(leaderboards, 'best_sellers', '24h'), ['Book', 'Phone'])
+        self.assertEqual({entry.name: (entry.views, entry.sales) for entry in leaderboards.get('trending', '24h')},
+                         {'Book': (0, 3), 'Phone': (4, 1)})
+
+    def test_index_reads_leaderboards_from_cache(self):
+        self.stat(self.tv, sales=1)
+        call_command('update_leaderboards', stdout=StringIO())
+        get_category_tree()
+        with self.assertQueryBudget(0):
+            response = self.client.get(reverse('shop:index'))
+        self.assertContains(response, 'TV')
+
+
+class RelatedProductsTest(QueryBudgetMixin, TestCase):
+    """
+    Related products are precomputed from product content and read with one query.
+    """
+
+    def setUp(self):
+        phones = Category.objects.create(name='Phones', slug='phones')
+        books = Category.objects.create(name='Books', slug='books')
+        specs = [
+            (phones, 'Galaxy S24 phone', 'Samsung', 'android phone with amoled screen'),
+            (phones, 'Galaxy A55 phone', 'Samsung', 'android phone with large battery'),
+            (phones, 'iPhone 15', 'Apple', 'phone with ios'),
+            (books, 'Android programming', 'Packt', 'a book about android apps'),
+            (books, 'Python cookbook', 'Packt', 'a book about python'),
+        ]
+        self.products = [
+            Product.objects.create(category=category, name=name, slug=slugify(name), brand=brand,
+                                   description=description, original_price=1000)
+            for category, name, brand, description in specs
+        ]
+        ProductFeature.objects.create(product=self.products[0], name='OS', value='Android')
+        ProductFeature.objects.create(product=self.products[1], name='OS', value='Android')
+
+    def test_neighbours_are_ranked_by_similarity(self):
+        call_command('build_related_products', stdout=StringIO())
+        galaxy, galaxy_a, iphone, android_book, python_book = self.products
+
+        self.assertEqual(list(related_products(galaxy)[:2]), [galaxy_a, iphone])
+        self.assertEqual(list(related_products(python_book)[:1]), [android_book])
+        self.assertNotIn(galaxy, related_products(galaxy))
+
+        # rebuilding replaces the rows
+        call_command('build_related_products', count=1, stdout=StringIO())
+        self.assertEqual(RelatedProduct.objects.filter(product=galaxy).count(), 1)
+
+    def test_detail_page_reads_precomputed_list(self):
+        call_command('build_related_products', stdout=StringIO())
+        galaxy = self.products[0]
+        response = self.client.get(galaxy.get_absolute_url())
+        with self.assertQueryBudget(1):
+            self.assertEqual(list(response.context['related_product'])[0], self.products[1])
+
+
+class BoughtTogetherTest(TestCase):
+    """
+    Co-purchases are counted incrementally from paid orders and scored by Jaccard similarity.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Category', slug='category')
+        self.phone, self.case, self.charger, self.book = [
+            Product.objects.create(category=category, name=name, slug=name, description='d', original_price=1000)
+            for name in ('phone', 'case', 'charger', 'book')
+        ]
+        self.user = ShopUser.objects.create_user(email='buyer@example.com', password='pass', phone='09120000000')
+
+    def order(self, *products, paid=True):
+        order = Order.objects.create(buyer=self.user, phone='09120000000', address='a', postal_code='1', city='c',
+                                     province='p', paid=paid)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, price=1000)
+        return order
+
+    def build(self, **options):
+        call_command('build_bought_together', stdout=StringIO(), **options)
+
+    def test_incremental_counts_and_ranking(self):
+        self.order(self.phone, self.case)
+        self.order(self.phone, self.case, self.charger)
+        self.order(self.phone, self.charger)
+        self.order(self.phone, self.book, paid=False)
+        self.build()
+
+        # case and charger are each in 2 of the 3 phone orders (Jaccard 2/3); ties go to the older product
+        self.assertEqual(list(related_products(self.phone, RelatedProduct.BOUGHT_TOGETHER)), [self.case, self.charger])
+        self.assertEqual(CoPurchase.objects.get(product=self.phone, other=self.phone).orders, 3)
+
+        # a third phone + charger order only counts the new order
+        self.order(self.phone, self.charger)
+        self.build()
+        self.assertEqual(CoPurchase.objects.get(product=self.phone, other=self.charger).orders, 3)
+        self.assertEqual(list(related_products(self.phone, RelatedProduct.BOUGHT_TOGETHER)), [self.charger, self.case])
+
+        self.build(rebuild=True)
+        self.assertEqual(CoPurchase.objects.get(product=self.phone, other=self.charger).orders, 3)
+
+    def test_cart_suggestions_exclude_cart_products(self):
+        self.order(self.phone, self.case)
+        self.order(self.phone, self.case, self.charger)
+        self.order(self.case, self.charger)
+        self.build()
+        with self.assertNumQueries(1):
+            self.assertEqual(list(bought_together_with([self.phone.pk, self.case.pk])), [self.charger])
+
+
+class SearchTest(TestCase):
+    """
+    The search view returns matches ranked by where the query was found.
+    (On sqlite this exercises the fallback search.)
+    """
+
+    def test_name_matches_rank_above_description_matches(self):
+        category = Category.objects.create(name='Category', slug='category')
+        in_description = Product.objects.create(category=category, name='Blue mug', slug='blue-mug',
+                                                description='Fits well with a teapot')
+        in_name = Product.objects.create(category=category, name='Green teapot', slug='green-teapot',
+                                         description='Ceramic')
+        Product.objects.create(category=category, name='Spoon', slug='spoon', description='Steel')
+
+        response = self.client.get(reverse('shop:search'), {'query': 'teapot'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['result']), [in_name, in_description])
+
+
+class AutocompleteTest(TestCase):
+    """
+    Suggestions come from the in-memory prefix index, ranked by popularity,
+    and follow product changes through signals.
+    """
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Phones', slug='phones')
+        Product.objects.create(category=self.category, name='Apple phone', slug='apple-phone', brand='Apple',
+                               description='', sold_count=1)
+        Product.objects.create(category=self.category, name='Cheap phone', slug='cheap-phone', description='',
+                               sold_count=10)
+        prefix_index.build()
+
+    def labels(self, query):
+        response = self.client.get(reverse('shop:autocomplete'), {'q': query})
+        return [result['label'] for result in response.json()['results']]
+
+    def test_suggestions_are_ranked_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.labels('pho'), ['Phones', 'Cheap phone', 'Apple phone'])
+            self.assertEqual(self.labels('APP'), ['Apple phone', 'Apple'])
+
+    def test_index_follows_product_changes(self):
+        product = Product.objects.create(category=self.category, name='Phone case', slug='phone-case',
+                                         description='', sold_count=5)
+        self.assertIn('Phone case', self.labels('phone c'))
+        product.delete()
+        self.assertEqual(self.labels('phone c'), [])
+
+    def test_only_label_changes_are_announced(self):
+        product = Product.objects.get(slug='apple-phone')
+        generation = cache.get(GENERATION_CACHE_KEY)
+        product.sold_count = 50
+        product.save()
+        self.assertEqual(cache.get(GENERATION_CACHE_KEY), generation)
+        self.assertEqual(self.labels('pho'), ['Phones', 'Apple phone', 'Cheap phone'])
+        product.name = 'Apple handset'
+        product.save()
+        self.assertNotEqual(cache.get(GENERATION_CACHE_KEY), generation)
+
+    def test_changes_are_announced_before_the_index_is_built(self):
+        prefix_index.invalidate()
+        generation = cache.get(GENERATION_CACHE_KEY)
+        Product.objects.filter(slug='apple-phone').first().delete()
+        self.assertNotEqual(cache.get(GENERATION_CACHE_KEY), generation)
+
+
+class RatingAggregationTest(TestCase):
+    """
+    Votes update the product's rating aggregates incrementally.
+    """
+
+    def setUp(self):
+        self.product = create_catalog(1)[0]
+        self.users = [
+            ShopUser.objects.create_user(email=f'voter{i}@example.com', password='pass', phone=f'0935000000{i}')
+            for i in range(3)
+        ]
+
+    def rate(self, user, score):
+        self.client.force_login(user)
+        response = self.client.post(reverse('shop:rate_product', args=[self.product.pk]), {'score': score})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_vote_does_not_load_the_product(self):
+        with CaptureQueriesContext(connection) as context:
+            Rating.objects.create(product_id=self.product.pk, user=self.users[0], score=4)
+        product_table = Product._meta.db_table
+        self.assertFalse([q['sql'] for q in context if q['sql'].startswith('SELECT') and product_table in q['sql']])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (1, 4))
+
+    def test_create_update_and_delete(self):
+        self.rate(self.users[0], 5)
+        self.rate(self.users[1], 4)
+        data = self.rate(self.users[2], 4)
+        self.assertEqual(data['count'], 3)
+        self.assertAlmostEqual(data['average'], 4.33)
+
+        data = self.rate(self.users[0], 1)  # change of an existing vote
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['average'], 3.0)
+
+        Rating.objects.get(user=self.users[1]).delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 2)
+        self.assertEqual(self.product.rating_sum, 5)
+        self.assertEqual(self.product.average_rating, Decimal('2.50'))
+        self.assertEqual(self.product.rating_histogram, {1: 1, 2: 0, 3: 0, 4: 1, 5: 0})
+
+    def test_rebuild_command_fixes_drift(self):
+        self.rate(self.users[0], 5)
+        self.rate(self.users[1], 2)
+        Product.objects.filter(pk=self.product.pk).update(rating_count=10, rating_5=0, average_rating=1)
+
+        out = StringIO()
+        call_command('rebuild_ratings', '--check', stdout=out)
+        self.assertIn('1 found', out.getvalue())
+        call_command('rebuild_ratings', stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 2)
+        self.assertEqual(self.product.average_rating, Decimal('3.50'))
+        self.assertEqual(self.product.rating_histogram, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+
+@override_settings(VIEW_COUNTER_FLUSH_INTERVAL=0)
+class CommentThreadTest(QueryBudgetMixin, TestCase):
+    """
+    Comment threads load in a bounded number of queries and paginate by thread.
+    """
+
+    def setUp(self):
+        self.product = create_catalog(1)[0]
+        self.user = ShopUser.objects.get()
+        Comment.objects.all().delete()
+        self.threads = [Comment.objects.create(product=self.product, user=self.user, body=f'thread {i}')
+                        for i in range(12)]
+        reply = Comment.objects.create(product=self.product, user=self.user, body='reply', parent=self.threads[-1])
+        self.nested = Comment.objects.create(product=self.product, user=self.user, body='nested', parent=reply)
+
+    def test_replies_are_assembled_in_two_queries(self):
+        self.assertEqual(self.nested.root, self.threads[-1])
+        with self.assertNumQueries(2):
+            page = get_comment_page(self.product)
+            newest = page[0]
+            self.assertEqual(newest.body, 'thread 11')
+            self.assertEqual(newest.reply_list[0].reply_list[0].body, 'nested')
+            self.assertTrue(newest.reply_list[0].user.profile)
+        self.assertEqual(len(page), 10)
+        self.assertTrue(page.has_next)
+
+    def test_load_more_returns_remaining_threads(self):
+        page = get_comment_page(self.product)
+        response = self.client.get(reverse('shop:product_comments_list', args=[self.product.slug]),
+                                   {'cursor': page.next_cursor})
+        self.assertContains(response, 'thread 1<')
+        self.assertContains(response, 'thread 0<')
+        self.assertNotContains(response, 'thread 2<')
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+    def test_detail_page_query_budget(self):
+        self.client.force_login(self.user)
+        with self.assertQueryBudget(12):
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertContains(response, 'nested')
+
+
+def make_upload(name='photo.png', size=(2000, 1000), color='red'):
+    """
+    Returns an uploaded PNG file of the given size.
+    """
+    buffer = io.BytesIO()
+    PilImage.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageProcessingTest(TestCase):
+    """
+    Saving an image only stores the upload; variants are generated after commit.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_PROCESSING_SYNC=True)
+        self.settings_override.enable()
+        self.product = create_catalog(1)[0]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_variants_are_generated_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            image = Image.objects.create(product=self.product, image_file=make_upload(), title='t', description='')
+        self.assertFalse(image.thumbnail_file)
+        self.assertTrue(image.thumbnail_url.endswith('photo.png'))
+
+        for callback in callbacks:
+            callback()
+        image.refresh_from_db()
+        widths = {}
+        for field_file, width in image.variants:
+            with PilImage.open(field_file.path) as variant:
+                self.assertEqual(variant.format, 'WEBP')
+                widths[width] = variant.size[0]
+        self.assertEqual(widths, {320: 320, 800: 800, 1600: 1600})
+        self.assertIn('-thumbnail.webp 320w', image.srcset)
+
+        # a small original is not upscaled: the widths are the real ones
+        with self.captureOnCommitCallbacks(execute=True):
+            small = Image.objects.create(product=self.product, image_file=make_upload(size=(500, 250)), title='s',
+                                         description='')
+        small.refresh_from_db()
+        self.assertEqual([width for _, width in small.variants], [320, 500, 500])
+        self.assertEqual([candidate.split()[-1] for candidate in small.srcset.split(', ')], ['320w', '500w'])
+
+        # saving unrelated fields does not process the image again
+        with mock.patch('shop.models.enqueue_image') as enqueue:
+            image.title = 'new title'
+            image.save()
+        enqueue.assert_not_called()
+
+    def test_reencode_skips_unchanged_images(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(product=self.product, image_file=make_upload(), title='t', description='')
+        image.refresh_from_db()
+        self.assertEqual(len(image.source_hash), 64)
+
+        checkpoint = f'{self.media_root}/checkpoint.json'
+        out = StringIO()
+        call_command('reencode_media', only='image', workers=1, checkpoint=checkpoint, stdout=out)
+        self.assertIn('1 skipped', out.getvalue())
+
+        # changed encoding settings invalidate the hash
+        with self.settings(IMAGE_WEBP_QUALITY=50):
+            out = StringIO()
+            call_command('reencode_media', only='image', workers=1, checkpoint=checkpoint, stdout=out)
+        self.assertIn('1 encoded', out.getvalue())
+        self.assertNotEqual(Image.objects.get(pk=image.pk).source_hash, image.source_hash)
+
+    def test_reencode_keeps_profile_originals(self):
+        user = ShopUser.objects.create_user(email='photo@example.com', password='pass', phone='09120000009')
+        profile = user.profile
+        profile.image = make_upload()
+        profile.save()
+        original = profile.image.name
+
+        checkpoint = f'{self.media_root}/checkpoint.json'
+        for quality, status in ((75, '1 encoded'), (75, '1 skipped'), (50, '1 encoded')):
+            out = StringIO()
+            with self.settings(IMAGE_WEBP_QUALITY=quality):
+                call_command('reencode_media', only='profile', workers=1, checkpoint=checkpoint, stdout=out)
+            self.assertIn(status, out.getvalue())
+
+        profile.refresh_from_db()
+        self.assertEqual(profile.image.name, original)
+        self.assertTrue(os.path.exists(profile.image.path))
+        self.assertTrue(profile.image_url.endswith('-avatar.webp'))
+        with PilImage.open(profile.image_webp.path) as webp:
+            self.assertEqual(webp.format, 'WEBP')
+
+        # the avatar size is part of the hash, so changing it re-encodes
+        with self.settings(IMAGE_WEBP_QUALITY=50):
+            task = (profile.pk, profile.image.name, profile.image_hash, encoding_signature())
+            self.assertEqual(reencode_media._reencode_profile_image(task)[2], 'skipped')
+            with mock.patch.object(reencode_media, 'AVATAR_SIZE', 256):
+                self.assertEqual(reencode_media._reencode_profile_image(task)[2], 'encoded')
+
+        # a new upload is served as is until it is encoded
+        profile.image = make_upload()
+        profile.save()
+        profile.refresh_from_db()
+        self.assertEqual((profile.image_webp.name, profile.image_hash), ('', ''))
+        self.assertEqual(profile.image_url, profile.image.url)
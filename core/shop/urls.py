@@ -14,6 +14,9 @@ urlpatterns = [
     path("product/<slug:slug>/", views.product_detail, name="product_detail"),
     path("products/off/", views.products_list_discount, name="products_list_discount"),
     path("search/", views.search, name="search"),
+    path("search/autocomplete/", views.autocomplete, name="autocomplete"),
     path('product/<slug:slug>/comment/', views.product_comments, name='product_comment'),
+    path('product/<slug:slug>/comments/', views.product_comments_list, name='product_comments_list'),
     path('product/<int:pk>/rate/', views.rate_product, name='rate_product'),
+    path('feed/products.<str:feed_format>', views.product_feed, name='product_feed'),
 ]
\ No newline at end of file
@@ -1,45 +1,93 @@
 import json
 from django.conf import settings
-from django.contrib.postgres.search import SearchQuery, TrigramSimilarity
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import Paginator
 from django.db import transaction
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST
+from shop.autocomplete import prefix_index
+from shop.cache import cached_page
+from shop.categories import get_category_tree
+from shop.comments import get_comment_page
+from shop.conditional import listing_etag, product_etag
+from shop.counters import view_counter
+from shop.facets import get_facets
+from shop.feeds import FEED_CONTENT_TYPES, feed_rows, generate_feed
+from shop.filters import ProductFilter
 from shop.forms import SearchForm, CommentForm
-from shop.models import Product, Rating, Comment, Category
+from shop.leaderboards import get_leaderboards
+from shop.models import Product, Rating, Comment, Category, RelatedProduct
+from shop.pagination import KeysetPaginator
+from shop.recommendations import related_products
+from shop.search import search_products
 
 
 # -----------------------------
-# Basic index view (for testing)
+# Home page with trending products
 # -----------------------------
 def index(request):
-    return render(request, 'shop/index.html')
+    """
+    Shows the trending and best-selling products from the precomputed
+    leaderboards (see shop.leaderboards), without querying the database.
+    """
+    leaderboards = get_leaderboards()
+    context = {
+        'trending': leaderboards.get('trending', '24h'),
+        'best_sellers': leaderboards.get('best_sellers', '7d'),
+    }
+    return render(request, 'shop/index.html', context)
 
 
 # ---------------------------------
-# Display list of all products (paginated)
+# Display list of all products (cursor paginated)
 # ---------------------------------
-def products_list(request):
-    products = Product.objects.all()
-    paginator = Paginator(products, 20)  # Show 20 products per page
-    page = request.GET.get('page')
-    categories = Category.objects.all()
+PRODUCTS_PER_PAGE = 20
+PRODUCTS_LIST_ORDERING = ('name', 'created_at', 'id')
+PRODUCTS_DISCOUNT_ORDERING = ('-discount', 'id')
 
-    try:
-        products = paginator.get_page(page)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        products = []
 
-    context = {'products': products}
+def render_products_page(request, products, ordering, filterset=None, extra_context=None):
+    """
+    Renders one page of a product listing using keyset pagination.
+    The page after the current one is requested with `?cursor=<next_cursor>`.
+    With a `filterset`, the full page also shows its (cached) facet counts.
+    Anonymous visitors get the page from the cache (see shop.cache).
+    """
+    def render_page():
+        paginator = KeysetPaginator(products, ordering, PRODUCTS_PER_PAGE)
+        page = paginator.get_page(request.GET.get('cursor'))
+
+        context = {'products': page, **(extra_context or {})}
+
+        # Handle AJAX request (for infinite scroll or dynamic load)
+        if request.headers.get('x-requested-With') == 'XMLHttpRequest':
+            response = render(request, 'shop/products_list_ajax.html', context)
+            response['X-Next-Cursor'] = page.next_cursor or ''
+            return response
+
+        if filterset is not None:
+            context['filter'] = filterset
+            context['facets'] = get_facets(filterset)
+        return render(request, 'shop/product_list.html', context)
+
+    return cached_page(request, render_page)
+
 
-    # Handle AJAX request (for infinite scroll or dynamic load)
-    if request.headers.get('x-requested-With') == 'XMLHttpRequest':
-        return render(request, 'shop/products_list_ajax.html', context)
+@condition(etag_func=listing_etag)
+def products_list(request, category_slug=None):
+    data = request.GET.copy()
+    extra_context = {}
+    if category_slug:
+        # category pages are the listing filtered by the category and its subcategories
+        tree = get_category_tree()
+        category = tree.get(category_slug)
+        if category is None:
+            raise Http404("Category not found")
+        data['category'] = category_slug
+        extra_context = {'category': category, 'category_ancestors': tree.ancestors(category)}
 
-    return render(request, 'shop/product_list.html', context)
+    filterset = ProductFilter(data, queryset=Product.objects.for_listing())
+    return render_products_page(request, filterset.qs, PRODUCTS_LIST_ORDERING, filterset, extra_context)
 
 
 # -------------------------------------------------
@@ -47,10 +95,24 @@ def products_list(request):
 # -------------------------------------------------
 def product_detail(request, slug):
     # Get product by slug
-    product = Product.objects.get(slug=slug)
+    product = get_object_or_404(Product, slug=slug)
+
+    # Count views (buffered, written in batches by shop.counters); also for cached and 304 responses
+    view_counter.record(product.pk)
+
+    return product_detail_page(request, product)
+
+
+@condition(etag_func=product_etag)
+def product_detail_page(request, product):
+    # Anonymous visitors get the page from the cache (see shop.cache)
+    return cached_page(request, lambda: render_product_detail(request, product), product_id=product.pk)
+
 
-    # Get up to 3 related products from the same category
-    related_product = Product.objects.filter(category=product.category).exclude(slug=product.slug)[:3]
+def render_product_detail(request, product):
+    # Up to 3 related products, precomputed by shop.recommendations (one indexed lookup)
+    related_product = related_products(product)[:3]
+    bought_together = related_products(product, RelatedProduct.BOUGHT_TOGETHER)[:4]
 
     # Calculate rating percent (for display in stars or progress bar)
     rating_percent = (float(product.average_rating) / 5.0) * 100 if product.rating_count else 0
@@ -66,22 +128,39 @@ def product_detail(request, slug):
     # Initialize empty comment form
     form = CommentForm()
 
-    # Count views
-    product.views += 1
-    product.save()
-
     context = {
         'product': product,
         'related_product': related_product,
+        'bought_together': bought_together,
         'form': form,
         'rating_percent': rating_percent,
         'user_rating': user_rating,
-        'comments': Comment.objects.filter(product=product, parent__isnull=True),
+        'comments': get_comment_page(product),
+        'login_url': settings.LOGIN_URL,
     }
 
     return render(request, 'shop/product_detail.html', context)
 
 
+# -------------------------------------------------
+# Next page of comment threads ("load more", AJAX)
+# -------------------------------------------------
+def product_comments_list(request, slug):
+    product = get_object_or_404(Product, slug=slug)
+    return product_comments_page(request, product)
+
+
+@condition(etag_func=product_etag)
+def product_comments_page(request, product):
+    def render_comments():
+        comments = get_comment_page(product, request.GET.get('cursor'))
+        response = render(request, 'shop/comments_ajax.html', {'comments': comments})
+        response['X-Next-Cursor'] = comments.next_cursor or ''
+        return response
+
+    return cached_page(request, render_comments, product_id=product.pk)
+
+
 # -------------------------------------------------
 # Add new comment (and handle replies via parent ID)
 # -------------------------------------------------
@@ -98,7 +177,7 @@ def product_comments(request, slug):
         parent_id = request.POST.get('parent')
         if parent_id:
             try:
-                parent_comment = Comment.objects.get(id=parent_id)
+                parent_comment = Comment.objects.get(id=parent_id, product=product)
                 comment.parent = parent_comment
             except Comment.DoesNotExist:
                 return JsonResponse({'sent': False, 'error': 'Parent comment not found'}, status=404)
@@ -110,7 +189,7 @@ def product_comments(request, slug):
             'sent': True,
             'comment_id': comment.id,
             'parent': comment.parent.id if comment.parent else None,  # Important for replies
-            'comment_user': comment.user.first_name,
+            'comment_user': comment.user.profile.first_name,
             'comment_body': comment.body,
             'comment_create': comment.created.strftime('%Y-%m-%d %H:%M'),
         }
@@ -124,30 +203,18 @@ def product_comments(request, slug):
 # -------------------------------------------------
 # List products that have discounts (ordered by discount)
 # -------------------------------------------------
+@condition(etag_func=listing_etag)
 def products_list_discount(request):
-    products = Product.objects.filter(discount__gt=0).order_by('-discount')
-    paginator = Paginator(products, 20)
-    page = request.GET.get('page')
-
-    try:
-        products = paginator.get_page(page)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        products = []
-
-    context = {'products': products}
-
-    # AJAX support for asynchronous loading
-    if request.headers.get('x-requested-With') == 'XMLHttpRequest':
-        return render(request, 'shop/products_list_ajax.html', context)
-
-    return render(request, 'shop/products_list.html', context)
+    products = Product.objects.for_listing().filter(discount__gt=0)
+    return render_products_page(request, products, PRODUCTS_DISCOUNT_ORDERING)
 
 
 # -------------------------------------------------
-# Full-text search with PostgreSQL TrigramSimilarity
+# Ranked product search (see shop.search)
 # -------------------------------------------------
+SEARCH_RESULTS_PER_PAGE = 20
+
+
 def search(request):
     query = None
     result = []
@@ -156,20 +223,9 @@ def search(request):
         form = SearchForm(data=request.GET)
         if form.is_valid():
             query = form.cleaned_data["query"]
-            search_query = SearchQuery(query)
-
-            # Search similar names
-            result_1 = Product.objects.annotate(
-                similarity=TrigramSimilarity("name", query)
-            ).filter(similarity__gt=0.2).order_by("-similarity")
-
-            # Search similar descriptions
-            result_2 = Product.objects.annotate(
-                similarity=TrigramSimilarity("description", query)
-            ).filter(similarity__gt=0.2).order_by("-similarity")
-
-            # Merge both result sets
-            result = result_1 | result_2
+            products = search_products(query, Product.objects.for_listing())
+            paginator = Paginator(products, SEARCH_RESULTS_PER_PAGE)
+            result = paginator.get_page(request.GET.get('page'))
 
     context = {
         "query": query,
@@ -179,6 +235,17 @@ def search(request):
     return render(request, "shop/search.html", context)
 
 
+# -------------------------------------------------
+# Search box autocomplete (in-memory prefix index, no DB access)
+# -------------------------------------------------
+AUTOCOMPLETE_LIMIT = 10
+
+
+def autocomplete(request):
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({'results': prefix_index.search(query, AUTOCOMPLETE_LIMIT)})
+
+
 # -------------------------------------------------
 # Handle user rating for a product via AJAX (POST)
 # -------------------------------------------------
@@ -217,16 +284,20 @@ def rate_product(request, pk):
     if score < 1 or score > 5:
         return JsonResponse({'error': 'invalid_score_range'}, status=400)
 
-    # Save or update rating atomically
+    # Save or update rating atomically; the existing rating row is locked so the
+    # product aggregates are updated from the score it really had (see shop.signals)
     with transaction.atomic():
-        rating, created = Rating.objects.update_or_create(
+        rating, created = Rating.objects.select_for_update().get_or_create(
             product=product,
             user=request.user,
             defaults={'score': score}
         )
+        if not created and rating.score != score:
+            rating.score = score
+            rating.save(update_fields=['score', 'updated'])
 
-        # Update product's average rating and rating count
-        product.update_rating()
+    # Read the updated average rating and rating count
+    product.refresh_from_db(fields=['average_rating', 'rating_count'])
 
     # Return updated rating info to frontend
     return JsonResponse({
@@ -235,3 +306,22 @@ def rate_product(request, pk):
         'count': product.rating_count,
         'user_score': rating.score
     })
+
+
+# -------------------------------------------------
+# Full catalog feed for marketplaces (streamed, JSONL/CSV/XML)
+# -------------------------------------------------
+def product_feed(request, feed_format):
+    if feed_format not in FEED_CONTENT_TYPES:
+        raise Http404("Unknown feed format")
+
+    # compress on the fly when the client accepts it
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    rows = feed_rows(request.build_absolute_uri('/'))
+    response = StreamingHttpResponse(generate_feed(feed_format, rows, compress=compress),
+                                     content_type=FEED_CONTENT_TYPES[feed_format])
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    response['Content-Disposition'] = f'inline; filename="products.{feed_format}"'
+    return response